@@ -1,6 +1,22 @@
 import click
+import numpy
+import time
+from sputnik.analyzer import Analysis, calibrate
+from sputnik.autotune import Autotuner, TuningCache, tune as tune_gates
+from sputnik.backends import BACKENDS
+from sputnik.benchmark import (RATIO_METRICS, compare_results, load_results, run_suite,
+                               save_results)
+from sputnik.context import ContextPool
 from sputnik.engine import Sputnik
+from sputnik.gatecache import GateCache
+from sputnik.keystore import KeyFile, resolve_key, save_key
+from sputnik.optimizer import optimize
 from sputnik.parser import Parser
+from sputnik.profiler import Profiler
+from sputnik.server import Server
+from sputnik.sharding import ShardPool
+from sputnik.verifier import verify as verify_log
+from sputnik.wire import open_ciphertext, save_ciphertext
 
 
 @click.group()
@@ -11,25 +27,389 @@ def cli():
 
 @cli.command()
 @click.argument('sputnik_filepath')
-def run(sputnik_filepath, **kwargs):
+@click.option('--optimize', 'optimize_program', is_flag=True,
+              help="Run the optimizer pass before executing.")
+@click.option('--reuse-buffers', is_flag=True,
+              help="Reuse the ciphertexts of dead variables for new gate results.")
+@click.option('--memory-limit', type=int, default=None,
+              help="Maximum bytes of device memory for gate results.")
+@click.option('--profile', 'trace_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Profile every operation and write a Chrome trace JSON to this path.")
+@click.option('--key', 'key_filepath', type=click.Path(exists=True, dir_okay=False),
+              default=None, help="Bootstrapping key file, as written by `keygen`.")
+@click.option('--input', 'inputs', multiple=True, metavar='NAME=FILE',
+              help="Entrance variable NAME from a ciphertext FILE. Can be repeated.")
+@click.option('--output', 'output_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Write the final STATE as a ciphertext to this file.")
+@click.option('--trace-log', 'log_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Record every merkle-tree leaf to this file, for `verify`.")
+@click.option('--autotune', is_flag=True,
+              help="Launch gates with the fastest settings for the device, tuning them if needed.")
+@click.option('--tuning-cache', 'cache_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Tuning cache file, by default $SPUTNIK_TUNING_CACHE or ~/.cache/sputnik.")
+@click.option('--gate-cache', 'gate_cache_bytes', type=int, default=None,
+              help="Reuse the results of gates repeated over the same inputs, keeping at most "
+                   "this many bytes of them.")
+def run(sputnik_filepath, optimize_program, reuse_buffers, memory_limit, trace_filepath,
+        key_filepath, inputs, output_filepath, log_filepath, autotune, cache_filepath,
+        gate_cache_bytes, **kwargs):
     """
     Executes the Sputnik program file at the given path.
     """
     click.echo("Executing Sputnik program...")
-    # TODO: Bootstrapping key input
 
     SputnikParser = Parser(sputnik_filepath)
     program = SputnikParser.get_program()
+    if inputs and key_filepath is None:
+        raise click.UsageError("--input needs --key to load the ciphertexts with")
+    if key_filepath is not None:
+        key_name = program.find_key_name()
+        if key_name is None:
+            raise click.UsageError("The program has no KEY to pass the key file as")
+        # Loaded when KEY runs, unless inputs need it first.
+        kwargs[key_name] = KeyFile(key_filepath)
+    if optimize_program:
+        program, report = optimize(program)
+        click.echo("Optimized: {} -> {} bootstraps ({} saved), {} -> {} operations".format(
+                   report.bootstraps_before, report.bootstraps_after,
+                   report.bootstraps_saved, report.operations_before,
+                   report.operations_after))
 
-    sputnik_execution_engine = Sputnik(program, None)
-    output = sputnik_execution_engine.execute_program(**kwargs)
+    profiler = None if trace_filepath is None else Profiler()
+    autotuner = Autotuner(TuningCache(cache_filepath)) if autotune else None
+    gate_cache = None if gate_cache_bytes is None else GateCache(gate_cache_bytes)
+    sputnik_execution_engine = Sputnik(program, None, reuse_buffers=reuse_buffers,
+                                       memory_limit=memory_limit, profiler=profiler,
+                                       trace_log=log_filepath, autotuner=autotuner,
+                                       gate_cache=gate_cache)
+    backend = sputnik_execution_engine.backend
+    if inputs:
+        key = resolve_key(kwargs.get(program.find_key_name()), backend)
+    for spec in inputs:
+        var_name, separator, input_filepath = spec.partition('=')
+        if not separator:
+            raise click.BadParameter("expected NAME=FILE, got {}".format(spec), param_hint='--input')
+        kwargs[var_name] = open_ciphertext(input_filepath, backend, key)
+
+    try:
+        output = sputnik_execution_engine.execute_program(**kwargs)
+    finally:
+        sputnik_execution_engine.close()
 
     click.echo("Execution complete! Final Status:")
     click.echo("Execution killed?  {}".format(program.is_killed))
-    click.echo("Execution halted?  {}\n\n".format(program.is_halted))
+    click.echo("Execution halted?  {}".format(program.is_halted))
+    click.echo("Peak gate memory:  {} bytes".format(
+               sputnik_execution_engine.allocator.high_water))
+    if gate_cache is not None:
+        click.echo("Gate cache:        {} hits, {} misses ({:.1%} hit rate)".format(
+                   gate_cache.stats.hits, gate_cache.stats.misses, gate_cache.stats.hit_rate))
+    click.echo("\n")
     click.echo("Final State or State Machine Output:")
     click.echo(output)
 
+    if output_filepath is not None:
+        if not program.is_killed or program.state is None:
+            raise click.ClickException("The program didn't exit with a STATE to write")
+        save_ciphertext(output_filepath, backend, program.key, program.state)
+        click.echo("STATE written to {}".format(output_filepath))
+
+    if profiler is not None:
+        click.echo("\nProfile:")
+        click.echo(profiler.format_summary())
+        profiler.write_chrome_trace(trace_filepath)
+        click.echo("Chrome trace written to {}".format(trace_filepath))
+
+
+@cli.command()
+@click.argument('sputnik_filepath')
+@click.option('--size', type=int, default=None,
+              help="STATE size in bits, if the program doesn't set SIZE.")
+@click.option('--calibrate', 'calibrate_gates', is_flag=True,
+              help="Measure per-gate latency on the local device to predict runtime.")
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to calibrate against.")
+def analyze(sputnik_filepath, size, calibrate_gates, backend):
+    """
+    Estimates the cost of the Sputnik program file at the given path.
+    """
+    SputnikParser = Parser(sputnik_filepath)
+    program = SputnikParser.get_program()
+    analysis = Analysis(program, size=size)
+
+    click.echo("OPCODE histogram:")
+    for op_code, count in analysis.histogram.most_common():
+        click.echo("  {:<8} {:>8}".format(op_code, count))
+
+    click.echo("\nBootstrapped gates:      {}".format(analysis.bootstrapped))
+    click.echo("Bootstrap-free ops:      {}".format(analysis.bootstrap_free))
+    click.echo("Critical-path depth:     {}".format(analysis.depth))
+    click.echo("Peak live ciphertexts:   {}".format(analysis.peak_live))
+    if analysis.peak_live_bytes is not None:
+        click.echo("Peak ciphertext memory:  {:.2f} MiB ({} bits each)".format(
+                   analysis.peak_live_bytes / 2**20, analysis.size))
+
+    if calibrate_gates:
+        engine_backend = BACKENDS[backend]()
+        _, bootstrap_key = engine_backend.make_key_pair(numpy.random.RandomState())
+        timings = calibrate(engine_backend, bootstrap_key, analysis.size or 32)
+
+        click.echo("\nMeasured gate latency ({} backend):".format(backend))
+        for op_code, latency in sorted(timings.items()):
+            click.echo("  {:<8} {:>10.3f} ms".format(op_code, latency * 1000))
+        click.echo("\nPredicted runtime:       {:.3f} s".format(
+                   analysis.predict_runtime(timings)))
+        click.echo("Predicted, scheduled:    {:.3f} s".format(
+                   analysis.predict_runtime(timings, scheduled=True)))
+
+
+@cli.command()
+@click.option('--size', 'sizes', type=int, multiple=True, default=[32],
+              help="STATE size in bits to compile kernels for. Can be repeated.")
+@click.option('--batch', 'batches', type=int, multiple=True, default=[1],
+              help="Batch size to compile kernels for. Can be repeated.")
+@click.option('--contexts', type=int, default=1,
+              help="Number of compute contexts to create.")
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to warm up.")
+def warmup(sizes, batches, contexts, backend):
+    """
+    Creates compute contexts and compiles every gate kernel ahead of time.
+    Compiled kernels land in the device compiler's on-disk cache, so engines
+    started afterwards skip the compilation.
+    """
+    start = time.perf_counter()
+    pool = ContextPool(size=contexts, factory=BACKENDS[backend])
+    _, bootstrap_key = pool.shared().make_key_pair(numpy.random.RandomState())
+    pool.warmup(bootstrap_key, [(size,) for size in sizes], batch_sizes=batches)
+    click.echo("Warmed up {} context(s) for sizes {} in {:.3f} s".format(
+               len(pool.contexts), ', '.join(str(size) for size in sizes),
+               time.perf_counter() - start))
+
+
+@cli.command()
+@click.option('--size', 'sizes', type=int, multiple=True, default=[32],
+              help="Word size in bits to tune for. Can be repeated.")
+@click.option('--batch', 'batches', type=int, multiple=True, default=[1],
+              help="Number of words launched together to tune for. Can be repeated.")
+@click.option('--key', 'key_filepath', type=click.Path(exists=True, dir_okay=False),
+              default=None, help="Bootstrapping key file, by default a new key.")
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to tune.")
+@click.option('--repeats', type=int, default=3,
+              help="Runs per setting; the best one is kept.")
+@click.option('--tuning-cache', 'cache_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Tuning cache file, by default $SPUTNIK_TUNING_CACHE or ~/.cache/sputnik.")
+def tune(sizes, batches, key_filepath, backend, repeats, cache_filepath):
+    """
+    Measures every performance setting of the backend on the local device
+    and stores the fastest one per ciphertext shape in the tuning cache,
+    for `run --autotune` and `serve --autotune`.
+    """
+    engine_backend = BACKENDS[backend]()
+    if key_filepath is None:
+        _, bootstrap_key = engine_backend.make_key_pair(numpy.random.RandomState())
+    else:
+        bootstrap_key = resolve_key(KeyFile(key_filepath), engine_backend)
+    device = engine_backend.device_name()
+    params = engine_backend.ciphertext_params(bootstrap_key)
+    cache = TuningCache(cache_filepath)
+
+    click.echo("Tuning {}".format(device))
+    for size in sizes:
+        for batch in batches:
+            shape = (size,) if batch == 1 else (batch, size)
+            timings = tune_gates(engine_backend, bootstrap_key, shape, repeats=repeats)
+            cache.put(device, params, shape, timings)
+            click.echo("\nShape {}:".format(shape))
+            for seconds, tuning in timings:
+                click.echo("  {:>10.3f} ms  {}".format(seconds * 1000, tuning or 'default'))
+    cache.save()
+    click.echo("\nSaved to {}".format(cache.path))
+
+
+@cli.command()
+@click.argument('sputnik_filepath')
+@click.argument('log_filepath', type=click.Path(exists=True, dir_okay=False))
+@click.argument('root')
+@click.option('--key', 'key_filepath', type=click.Path(exists=True, dir_okay=False),
+              default=None, help="Bootstrapping key file the program ran with.")
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to execute sampled gates with.")
+@click.option('--sample', type=float, default=0.01,
+              help="Fraction of the gates to check in depth.")
+@click.option('--workers', type=int, default=None,
+              help="Number of worker processes, by default one per CPU core.")
+@click.option('--seed', type=int, default=None,
+              help="Seed for picking the sampled gates.")
+@click.option('--optimize', 'optimize_program', is_flag=True,
+              help="Match the leaves against the optimized program, for logs of `run --optimize`.")
+def verify(sputnik_filepath, log_filepath, root, key_filepath, backend, sample, workers, seed,
+           optimize_program):
+    """
+    Verifies a merkle ROOT against the leaf log recorded by `run --trace-log`
+    for the Sputnik program file at the given path.
+
+    Logs of `run --optimize` need --optimize here too, since the optimized
+    program runs other gates. The other `run` flags don't change which gates
+    run, and need nothing.
+    """
+    if key_filepath is None and BACKENDS[backend].needs_key:
+        raise click.UsageError("--key is needed to re-execute gates with the {} backend".format(
+                               backend))
+    program = Parser(sputnik_filepath).get_program()
+    if optimize_program:
+        program, _ = optimize(program)
+    key = None if key_filepath is None else KeyFile(key_filepath)
+    with ShardPool(key, workers=workers, backend=BACKENDS[backend]) as pool:
+        report = verify_log(program, log_filepath, root, pool, sample=sample, seed=seed)
+
+    click.echo("Leaves:            {}".format(report.leaf_count))
+    click.echo("Recomputed root:   {}".format(report.root))
+    click.echo("Root matches?      {}".format(report.root_matches))
+    click.echo("Unexpected leaves: {}".format(len(report.unexpected_leaves)))
+    if report.unexpected_leaves and not optimize_program:
+        click.echo("  Leaves of `run --optimize` are only expected with --optimize")
+    click.echo("Inclusion proofs:  {} checked, {} invalid".format(
+               report.proofs_checked, len(report.invalid_proofs)))
+    click.echo("Gates re-executed: {} checked, {} invalid".format(
+               report.gates_checked, len(report.invalid_gates)))
+    for index in report.invalid_gates:
+        click.echo("  Leaf {} doesn't match its re-executed gate".format(index))
+    if not report.ok:
+        raise SystemExit(1)
+    click.echo("Verified.")
+
+
+@cli.command()
+@click.argument('socket_path', type=click.Path(dir_okay=False))
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to run jobs on.")
+@click.option('--schedule', is_flag=True,
+              help="Group independent gates of a program into vectorized calls.")
+@click.option('--max-batch', type=int, default=16,
+              help="Most jobs merged into one batched execution.")
+@click.option('--max-queue', type=int, default=256,
+              help="Most jobs queued or running before clients are made to wait.")
+@click.option('--batch-window', type=float, default=0.002,
+              help="Seconds to wait for concurrent jobs to batch with.")
+@click.option('--autotune', is_flag=True,
+              help="Launch gates with the fastest settings for the device, tuning them if needed.")
+@click.option('--tuning-cache', 'cache_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Tuning cache file, by default $SPUTNIK_TUNING_CACHE or ~/.cache/sputnik.")
+@click.option('--gate-cache', 'gate_cache_bytes', type=int, default=None,
+              help="Reuse the results of gates repeated over the same inputs across jobs, "
+                   "keeping at most this many bytes of them.")
+@click.option('--gate-cache-device', 'gate_cache_device_bytes', type=int, default=None,
+              help="Most bytes of cached results kept on the device; the rest spill to host memory.")
+@click.option('--key', 'key_specs', multiple=True, metavar='NAME=FILE',
+              help="Key file jobs can use by NAME. Can be repeated.")
+@click.option('--warmup-size', 'warmup_sizes', type=int, multiple=True, default=[32],
+              help="Word size in bits to compile the gates of every key for, in every batch size, "
+                   "before serving. Can be repeated.")
+def serve(socket_path, backend, schedule, max_batch, max_queue, batch_window, autotune,
+          cache_filepath, gate_cache_bytes, gate_cache_device_bytes, key_specs, warmup_sizes):
+    """
+    Serves jobs over a Unix socket at the given path, keeping programs, keys
+    and engines resident between jobs. Jobs can only use the keys given
+    with --key.
+    """
+    keys = dict()
+    for spec in key_specs:
+        key_name, separator, key_filepath = spec.partition('=')
+        if not separator:
+            raise click.BadParameter("expected NAME=FILE, got {}".format(spec), param_hint='--key')
+        keys[key_name] = key_filepath
+    autotuner = Autotuner(TuningCache(cache_filepath)) if autotune else None
+    gate_cache = None
+    if gate_cache_bytes is not None:
+        gate_cache = GateCache(gate_cache_bytes, device_bytes=gate_cache_device_bytes)
+    server = Server(socket_path, backend=BACKENDS[backend](), schedule=schedule,
+                    max_batch=max_batch, max_queue=max_queue, batch_window=batch_window,
+                    autotuner=autotuner, gate_cache=gate_cache, keys=keys,
+                    warmup_sizes=warmup_sizes)
+    click.echo("Serving on {}".format(socket_path))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.argument('key_filepath', type=click.Path(dir_okay=False))
+@click.option('--secret-key', 'secret_key_filepath', type=click.Path(dir_okay=False),
+              required=True, help="Where to write the secret key.")
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to make the keys for.")
+def keygen(key_filepath, secret_key_filepath, backend):
+    """
+    Makes a new key pair and writes the bootstrapping key to the given path,
+    in a file that `run --key` maps rather than reads.
+    """
+    engine_backend = BACKENDS[backend]()
+    secret_key, bootstrap_key = engine_backend.make_key_pair(numpy.random.RandomState())
+    save_key(bootstrap_key, key_filepath, engine_backend)
+    save_key(secret_key, secret_key_filepath, engine_backend)
+    click.echo("Bootstrapping key written to {}".format(key_filepath))
+    click.echo("Secret key written to {}".format(secret_key_filepath))
+
+
+@cli.command()
+@click.option('--size', 'sizes', type=int, multiple=True, default=[8, 32],
+              help="STATE size in bits of the generated circuits. Can be repeated.")
+@click.option('--depth', 'depths', type=int, multiple=True, default=[8],
+              help="Number of gate levels of the generated circuits. Can be repeated.")
+@click.option('--width', 'widths', type=int, multiple=True, default=[4],
+              help="Number of gates per level of the generated circuits. Can be repeated.")
+@click.option('--backend', type=click.Choice(sorted(BACKENDS)), default='nufhe',
+              help="Backend to benchmark.")
+@click.option('--repeats', type=int, default=3,
+              help="Number of runs per circuit; the fastest one counts.")
+@click.option('--output', 'output_filepath', type=click.Path(dir_okay=False), default=None,
+              help="Write the results as JSON to this file.")
+@click.option('--compare', 'baseline_filepath', type=click.Path(exists=True, dir_okay=False),
+              default=None, help="Compare against the results JSON in this file.")
+@click.option('--threshold', type=float, default=0.1,
+              help="Relative slowdown flagged as a regression.")
+@click.option('--ratio-threshold', type=float, default=0.05,
+              help="Absolute increase of the merkle overhead fraction flagged as a regression.")
+def bench(sizes, depths, widths, backend, repeats, output_filepath, baseline_filepath, threshold,
+          ratio_threshold):
+    """
+    Benchmarks generated circuits and optionally checks them for regressions
+    against earlier results. Exits with status 1 if any are found.
+    """
+    results = run_suite(backend, BACKENDS[backend], sizes, depths, widths, repeats=repeats)
+
+    click.echo("{:<24} {:>10} {:>12} {:>14} {:>10} {:>10} {:>10}".format(
+               'circuit', 'run ms', 'gates/s', 'bootstrap us', 'merkle %', 'parse ms', 'start ms'))
+    for benchmark in results['benchmarks']:
+        click.echo("{:<24} {:>10.3f} {:>12.1f} {:>14.3f} {:>10.1f} {:>10.3f} {:>10.3f}".format(
+                   benchmark['name'], benchmark['run_seconds'] * 1000,
+                   benchmark['gates_per_second'], benchmark['bootstrap_latency'] * 1e6,
+                   benchmark['merkle_overhead'] * 100, benchmark['parse_seconds'] * 1000,
+                   benchmark['startup_seconds'] * 1000))
+
+    if output_filepath is not None:
+        save_results(results, output_filepath)
+        click.echo("Results written to {}".format(output_filepath))
+
+    if baseline_filepath is not None:
+        regressions = compare_results(load_results(baseline_filepath), results, threshold,
+                                      ratio_threshold)
+        if not regressions:
+            click.echo("No regressions over {:.0%}".format(threshold))
+            return
+        click.echo("Regressions over {:.0%}:".format(threshold))
+        for name, metric, before, after, change in regressions:
+            if metric in RATIO_METRICS:
+                change = "{:+.1f} points".format(change * 100)
+            else:
+                change = "{:+.1%}".format(change)
+            click.echo("  {:<24} {:<18} {:>12.6g} -> {:<12.6g} ({})".format(
+                       name, metric, before, after, change))
+        raise SystemExit(1)
+
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,188 @@
+from sputnik.compiler import STATE_SLOT, STATE_WRITERS
+from sputnik.opcodes import GATE_OP_CODES, OP_CODES, SIGNATURES, VAR
+
+
+# Operations that return or dump the program's variables, so nothing they
+# read is released. EXIT only reads STATE.
+BARRIER_OP_CODES = ('EXIT', 'HALT', 'RECOVER')
+
+
+def _value_flow(program):
+    """
+    Walks the compiled `program` from its entrance, numbering every value
+    as it's defined. Yields, for each operation, its index, OPCODE, the
+    values it reads, the slots it binds as `(slot, value)` pairs and whether
+    the values it defines may be recycled.
+
+    A SLICE value is a view of its source's ciphertext, so reading it also
+    counts as reading the value it was sliced from.
+    """
+    bytecode = program.bytecode
+    bindings = dict()
+    value_count = 0
+    # View value -> the value owning its ciphertext
+    bases = dict()
+
+    for op_index in range(program.find_entrance(), len(bytecode)):
+        op_code = OP_CODES[bytecode.op_ids[op_index]]
+        operands = bytecode.operands[op_index]
+        reads = list()
+        binds = list()
+        recyclable = False
+
+        if op_code == 'EXEC':
+            binds = [(slot, value_count + idx) for idx, slot in enumerate(operands)]
+        elif op_code == 'PUSH':
+            left, right = operands
+            if left in bindings:
+                binds = [(right, bindings[left])]
+        elif op_code == 'EXIT':
+            reads = [bindings[STATE_SLOT]] if STATE_SLOT in bindings else []
+        elif op_code in BARRIER_OP_CODES:
+            reads = list(set(bindings.values()))
+            # Anything bound afterwards is restored as is.
+            binds = [(slot, value_count + idx) for idx, slot in enumerate(bindings)]
+        elif op_code in GATE_OP_CODES or op_code in STATE_WRITERS:
+            reads = [bindings[slot] for kind, slot in zip(SIGNATURES[op_code], operands)
+                     if kind == VAR and slot in bindings]
+            binds = [(STATE_SLOT, value_count)]
+            recyclable = True
+        elif op_code == 'SLICE':
+            source, _, _, target = operands
+            if source in bindings:
+                reads = [bindings[source]]
+                bases[value_count] = bases.get(reads[0], reads[0])
+            binds = [(target, value_count)]
+        elif op_code == 'CONCAT':
+            *sources, target = operands
+            reads = [bindings[slot] for slot in sources if slot in bindings]
+            binds = [(target, value_count)]
+            recyclable = True
+
+        reads += [bases[value] for value in reads if value in bases]
+        yield op_index, op_code, reads, binds, recyclable
+        for slot, value in binds:
+            bindings[slot] = value
+            value_count = max(value_count, value + 1)
+
+
+def plan_releases(program):
+    """
+    Computes the last use of every value in the compiled `program`, like a
+    register allocator does. Values are numbered per definition, so a
+    reassigned variable holds a new value, and PUSH only aliases a value
+    under another name. A value dies at the last operation reading it, or,
+    if it's never read, at the operation that overwrites its last binding.
+
+    Returns a dict mapping an operation index to the values that die there,
+    as `(slots, recyclable)` pairs: `slots` are the registers holding the
+    value right before the operation, and `recyclable` tells whether the
+    engine allocated the value's ciphertext itself, or it came from the
+    caller or a checkpoint and mustn't be written to. Values read by EXIT,
+    HALT or RECOVER are never released.
+    """
+    # First pass: find where every value dies.
+    deaths = dict()
+    read = set()
+    slot_counts = dict()
+    bindings = dict()
+    for op_index, op_code, reads, binds, _ in _value_flow(program):
+        for value in reads:
+            deaths[value] = None if op_code in BARRIER_OP_CODES else op_index
+            read.add(value)
+        for slot, value in binds:
+            old_value = bindings.get(slot)
+            bindings[slot] = value
+            slot_counts[value] = slot_counts.get(value, 0) + 1
+            if old_value is None:
+                continue
+            slot_counts[old_value] -= 1
+            if slot_counts[old_value] == 0 and old_value not in read:
+                deaths[old_value] = op_index
+
+    # Second pass: find the slots holding each value when it dies.
+    releases = dict()
+    recyclables = dict()
+    slots_of = dict()
+    bindings = dict()
+    dying = dict()
+    for op_index, value, in sorted((op_index, value) for value, op_index in deaths.items()
+                                   if op_index is not None):
+        dying.setdefault(op_index, list()).append(value)
+
+    for op_index, op_code, reads, binds, recyclable in _value_flow(program):
+        for value in dying.get(op_index, ()):
+            slots = tuple(sorted(slots_of.get(value, ())))
+            if slots:
+                releases.setdefault(op_index, list()).append((slots, recyclables[value]))
+        for slot, value in binds:
+            old_value = bindings.get(slot)
+            if old_value is not None:
+                slots_of[old_value].discard(slot)
+            bindings[slot] = value
+            slots_of.setdefault(value, set()).add(slot)
+            recyclables.setdefault(value, recyclable)
+    return releases
+
+
+class BufferAllocator:
+    """
+    Hands out ciphertext buffers for gate results, reusing the buffers of
+    values that are dead instead of allocating fresh ones.
+
+    Released buffers are kept on a free list per shape. The allocator keeps
+    count of the device memory held by the buffers it allocated, whether in
+    use or free, and raises a MemoryError rather than exceed `memory_limit`
+    bytes, after giving up free buffers of other shapes.
+    """
+
+    def __init__(self, backend, memory_limit=None):
+        self.backend = backend
+        self.memory_limit = memory_limit
+
+        self.allocated_bytes = 0
+        self.high_water = 0
+        self.allocations = 0
+        self.reuses = 0
+
+        self._free = dict()
+
+    def empty(self, key, shape):
+        """
+        Returns a ciphertext of the given shape, reusing a free one if any.
+        """
+        shape = tuple(shape)
+        free = self._free.get(shape)
+        if free:
+            self.reuses += 1
+            return free.pop()
+
+        ciphertext = self.backend.empty(key, shape)
+        nbytes = self.backend.nbytes(ciphertext)
+        if self.memory_limit is not None:
+            self._trim(self.memory_limit - nbytes)
+            if self.allocated_bytes + nbytes > self.memory_limit:
+                raise MemoryError("Allocating {} more bytes would exceed the {} bytes limit".format(
+                                  nbytes, self.memory_limit))
+
+        self.allocations += 1
+        self.allocated_bytes += nbytes
+        self.high_water = max(self.high_water, self.allocated_bytes)
+        return ciphertext
+
+    def release(self, ciphertext):
+        """
+        Returns a ciphertext allocated by `empty` to the free list.
+        """
+        self._free.setdefault(tuple(ciphertext.shape), list()).append(ciphertext)
+
+    def _trim(self, target):
+        """
+        Drops free buffers until at most `target` bytes are allocated.
+        """
+        for shape in list(self._free):
+            free = self._free[shape]
+            while free and self.allocated_bytes > target:
+                self.allocated_bytes -= self.backend.nbytes(free.pop())
+            if not free:
+                del self._free[shape]
@@ -0,0 +1,188 @@
+import time
+from collections import Counter
+
+from sputnik.compiler import STATE_WRITERS, get_signature
+from sputnik.opcodes import GATE_OP_CODES, SIGNATURES, VAR
+
+
+# OPCODES that produce a ciphertext without bootstrapping. NOT only negates
+# the LWE sample, and shifts, slices and concatenations only move samples
+# around, so they don't need a bootstrap either.
+BOOTSTRAP_FREE_OP_CODES = ('COPY', 'CONST', 'PUSH', 'NOT', 'SHL', 'SHR', 'SLICE', 'CONCAT')
+
+# Bootstrapped OPCODES, including the three input MUX
+BOOTSTRAPPED_OP_CODES = tuple(op_code for op_code in GATE_OP_CODES
+                              if op_code not in BOOTSTRAP_FREE_OP_CODES)
+
+# Size of one encrypted bit with the default nufhe parameters: an LWE sample
+# of 500 int32 coefficients, the int32 `b` and the float32 variance.
+LWE_BYTES_PER_BIT = (500 + 2) * 4
+
+
+class Analysis:
+    """
+    Static cost analysis of a Sputnik program, from its entrance to the first
+    EXIT or HALT. Nothing is executed; costs are derived from the operations
+    and, if given, measured per-gate timings.
+    """
+
+    def __init__(self, program, size=None):
+        """
+        Analyzes `program`. `size` is the STATE size in bits, for programs
+        that don't set it with SIZE.
+        """
+        if program.bytecode is None:
+            program.compile()
+
+        self.histogram = Counter()
+        self.size = size
+
+        # Bootstrapped gates per OPCODE on each level of the dependency graph
+        self.levels = list()
+
+        # Live ranges of every ciphertext value, as [definition, last use]
+        self.live_ranges = list()
+
+        depths = list()
+        bindings = dict()
+
+        def define(op_index, depth):
+            value = len(self.live_ranges)
+            self.live_ranges.append([op_index, op_index])
+            depths.append(depth)
+            return value
+
+        def use(op_index, var_name):
+            value = bindings[var_name]
+            self.live_ranges[value][1] = op_index
+            return value
+
+        entrance = program.find_entrance()
+        for op_index in range(entrance, len(program.operations)):
+            op_code, *args = program.operations[op_index]
+            self.histogram[op_code] += 1
+            signature = get_signature(op_code, args)
+
+            if op_code == 'SIZE' and self.size is None:
+                self.size = int(args[0])
+            elif op_code == 'PUSH':
+                left_name, right_name = args
+                bindings[right_name] = bindings[left_name]
+            elif op_code in GATE_OP_CODES or op_code in STATE_WRITERS:
+                inputs = [use(op_index, arg) for kind, arg in zip(signature, args)
+                          if kind == VAR]
+                depth = max((depths[value] for value in inputs), default=0)
+                if op_code in BOOTSTRAPPED_OP_CODES:
+                    if depth == len(self.levels):
+                        self.levels.append(Counter())
+                    self.levels[depth][op_code] += 1
+                    depth += 1
+                bindings['STATE'] = define(op_index, depth)
+            elif op_code == 'SLICE':
+                # A view of the source's ciphertext
+                bindings[args[3]] = use(op_index, args[0])
+            elif op_code == 'CONCAT':
+                inputs = [use(op_index, arg) for arg in args[:2]]
+                bindings[args[2]] = define(op_index, max(depths[value] for value in inputs))
+            elif op_code == 'EXEC':
+                for arg in args:
+                    bindings[arg] = define(op_index, 0)
+            elif op_code == 'EXIT':
+                if 'STATE' in bindings:
+                    use(op_index, 'STATE')
+                break
+            elif op_code == 'HALT':
+                # HALT dumps every variable, so all of them are still live.
+                for var_name in bindings:
+                    use(op_index, var_name)
+                break
+
+        self.end = op_index
+
+    @property
+    def bootstrapped(self):
+        """
+        Returns the number of bootstrapped gates.
+        """
+        return sum(self.histogram[op_code] for op_code in BOOTSTRAPPED_OP_CODES)
+
+    @property
+    def bootstrap_free(self):
+        """
+        Returns the number of operations that need no bootstrapping.
+        """
+        return sum(self.histogram[op_code] for op_code in BOOTSTRAP_FREE_OP_CODES)
+
+    @property
+    def depth(self):
+        """
+        Returns the critical-path depth in bootstrapped gates.
+        """
+        return len(self.levels)
+
+    @property
+    def peak_live(self):
+        """
+        Returns the highest number of ciphertexts alive at the same time.
+        """
+        events = Counter()
+        for start, end in self.live_ranges:
+            events[start] += 1
+            events[end + 1] -= 1
+
+        live = peak = 0
+        for op_index in sorted(events):
+            live += events[op_index]
+            peak = max(peak, live)
+        return peak
+
+    @property
+    def peak_live_bytes(self):
+        """
+        Returns the device memory held by `peak_live` ciphertexts of SIZE
+        bits with the default nufhe parameters, or None if SIZE is unknown.
+        """
+        if self.size is None:
+            return None
+        return self.peak_live * self.size * LWE_BYTES_PER_BIT
+
+    def predict_runtime(self, timings, scheduled=False):
+        """
+        Returns the predicted runtime in seconds from the per-gate `timings`.
+        Sequentially, every gate pays its own latency. With `scheduled`, the
+        gates of one OPCODE on one level run as a single launch.
+        """
+        if scheduled:
+            return sum(timings[op_code] for level in self.levels for op_code in level)
+        return sum(timings[op_code] * count for level in self.levels
+                   for op_code, count in level.items())
+
+
+def calibrate(backend, key, size, repeats=3):
+    """
+    Measures the latency of every bootstrapped gate on `backend` over `size`
+    bit operands, keeping the best of `repeats` runs. Returns a dict of
+    seconds per OPCODE.
+    """
+    operands = list()
+    for values in ([True, False] * size, [True, True, False, False] * size,
+                   [True, True, True, False] * size):
+        operand = backend.empty(key, (size,))
+        backend.constant(key, operand, values[:size])
+        operands.append(operand)
+
+    timings = dict()
+    for op_code in GATE_OP_CODES:
+        arity = len(SIGNATURES[op_code])
+        result = backend.empty(key, (size,))
+        best = None
+        for _ in range(repeats):
+            backend.synchronize()
+            start = time.perf_counter()
+            backend.gate(key, op_code, result, *operands[:arity])
+            backend.synchronize()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        timings[op_code] = best
+    return timings
@@ -0,0 +1,172 @@
+import json
+import numpy
+import os
+import tempfile
+import threading
+import time
+
+from sputnik.opcodes import SIGNATURES
+
+
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'sputnik', 'tuning.json')
+
+
+def default_cache_path():
+    """
+    Returns the path of the tuning cache, `$SPUTNIK_TUNING_CACHE` if set.
+    """
+    return os.environ.get('SPUTNIK_TUNING_CACHE', DEFAULT_CACHE_PATH)
+
+
+def tune(backend, key, shape, candidates=None, op_code='NAND', repeats=3):
+    """
+    Measures the gate `op_code` over ciphertexts of `shape` with every
+    tuning in `candidates`, by default all of the backend's, keeping the
+    best of `repeats` runs after a first one that compiles the kernels.
+    Tunings the device can't run are skipped.
+
+    Returns a list of `(seconds, tuning)`, fastest first.
+    """
+    if candidates is None:
+        candidates = backend.tuning_candidates()
+    arity = len(SIGNATURES[op_code])
+    inputs = list()
+    for values in ([True, False], [True, True, False, False], [True, True, True, False]):
+        operand = backend.empty(key, shape)
+        backend.constant(key, operand, numpy.resize(values, shape))
+        inputs.append(operand)
+    result = backend.empty(key, shape)
+
+    timings = list()
+    for tuning in candidates:
+        try:
+            backend.gate(key, op_code, result, *inputs[:arity], tuning=tuning)
+            backend.synchronize()
+        except Exception:
+            continue
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            backend.gate(key, op_code, result, *inputs[:arity], tuning=tuning)
+            backend.synchronize()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        timings.append((best, tuning))
+    if not timings:
+        raise RuntimeError("No tuning runs on {}".format(backend.device_name()))
+    return sorted(timings, key=lambda timing: timing[0])
+
+
+class TuningCache:
+    """
+    The best tuning for every device, encryption parameters and ciphertext
+    shape, stored as JSON at `path`. Saving merges the entries into what's
+    on disk, so processes tuning other shapes at the same time don't lose
+    each other's results.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        self.devices = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return dict()
+        if cache.get('version') != CACHE_VERSION:
+            # Tunings are cheap to measure again
+            return dict()
+        return cache['devices']
+
+    @staticmethod
+    def entry_name(params, shape):
+        return json.dumps([params, list(shape)], sort_keys=True)
+
+    def get(self, device, params, shape):
+        """
+        Returns the best tuning for ciphertexts of `shape` with the
+        encryption `params` on `device`, or None if it wasn't measured.
+        """
+        entry = self.devices.get(device, dict()).get(self.entry_name(params, shape))
+        return None if entry is None else entry['tuning']
+
+    def put(self, device, params, shape, timings):
+        """
+        Records the `(seconds, tuning)` timings `tune` returns.
+        """
+        self.devices.setdefault(device, dict())[self.entry_name(params, shape)] = {
+            'tuning': timings[0][1],
+            'seconds': timings[0][0],
+            'candidates': [{'tuning': tuning, 'seconds': seconds}
+                           for seconds, tuning in timings],
+        }
+
+    def save(self):
+        """
+        Writes the cache, atomically replacing the file.
+        """
+        devices = self._read()
+        for device, entries in self.devices.items():
+            devices.setdefault(device, dict()).update(entries)
+        self.devices = devices
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+            json.dump({'version': CACHE_VERSION, 'devices': devices}, f, indent=2, sort_keys=True)
+        os.replace(f.name, self.path)
+
+
+class Autotuner:
+    """
+    Picks the tuning of every gate launch the engine makes, by device,
+    encryption parameters and ciphertext shape, from a `TuningCache`.
+
+    Shapes that aren't in the cache are tuned the first time they're
+    launched, and the cache is saved, if `tune_missing`; otherwise they run
+    with the backend's default settings. Choices are remembered in memory,
+    so the cache is only consulted once per backend, key and shape.
+    """
+
+    def __init__(self, cache=None, tune_missing=True, repeats=3):
+        self.cache = cache if cache is not None else TuningCache()
+        self.tune_missing = tune_missing
+        self.repeats = repeats
+
+        # (id(backend), id(key), shape) -> (backend, key, tuning)
+        self._selected = dict()
+        self._lock = threading.Lock()
+
+    def select(self, backend, key, shape):
+        """
+        Returns the tuning to launch gates over ciphertexts of `shape` with,
+        or None for the backend's defaults.
+        """
+        selected = self._selected.get((id(backend), id(key), shape))
+        if selected is not None:
+            return selected[2]
+
+        with self._lock:
+            tuning = self._lookup(backend, key, shape)
+            self._selected[(id(backend), id(key), shape)] = (backend, key, tuning)
+        return tuning
+
+    def _lookup(self, backend, key, shape):
+        candidates = backend.tuning_candidates()
+        if len(candidates) == 1:
+            return candidates[0]
+
+        device = backend.device_name()
+        params = backend.ciphertext_params(key)
+        tuning = self.cache.get(device, params, shape)
+        if tuning is None and self.tune_missing:
+            timings = tune(backend, key, shape, candidates, repeats=self.repeats)
+            self.cache.put(device, params, shape, timings)
+            self.cache.save()
+            tuning = timings[0][1]
+        return tuning
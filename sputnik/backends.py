@@ -0,0 +1,512 @@
+import functools
+import io
+import itertools
+import nufhe
+import numpy
+import pickle
+import threading
+from sputnik.opcodes import SIGNATURES
+from reikna.cluda import any_api, ocl_id
+
+
+class TransferCounter:
+    """
+    Counts the bytes a backend moves between host and device memory.
+    """
+
+    def __init__(self):
+        self.to_host = 0
+        self.to_device = 0
+        self._lock = threading.Lock()
+
+    def add(self, to_host=0, to_device=0):
+        with self._lock:
+            self.to_host += to_host
+            self.to_device += to_device
+
+
+def _nbytes(arrays):
+    if arrays is None:
+        return 0
+    if isinstance(arrays, (tuple, list)):
+        return sum(_nbytes(array) for array in arrays)
+    return arrays.nbytes
+
+
+def to_host(method):
+    """
+    Marks a backend method that copies to host memory. The arrays it
+    returns are counted by the backend's `transfers`, if set.
+    """
+    @functools.wraps(method)
+    def counted(self, *args):
+        arrays = method(self, *args)
+        if self.transfers is not None:
+            self.transfers.add(to_host=_nbytes(arrays))
+        return arrays
+    return counted
+
+
+def to_device(method):
+    """
+    Marks a backend method that copies its last argument, host arrays, to
+    the device. They're counted by the backend's `transfers`, if set.
+    """
+    @functools.wraps(method)
+    def counted(self, *args):
+        if self.transfers is not None:
+            self.transfers.add(to_device=_nbytes(args[-1]))
+        return method(self, *args)
+    return counted
+
+
+class Backend:
+    """
+    The interface the Sputnik engine uses to store and compute on encrypted
+    bits. A backend decides what a ciphertext is; the engine only relies on
+    ciphertexts having a `shape`.
+
+    Every method takes the program's bootstrapping `key`, which backends that
+    don't encrypt are free to ignore; `needs_key` tells them apart.
+
+    Methods that move data between host and device memory are marked with
+    `to_host` or `to_device`, so the bytes they move are counted by
+    `transfers`, a `TransferCounter`, once one is set, e.g. by a profiler.
+    """
+
+    transfers = None
+    needs_key = True
+
+    def make_key_pair(self, rng):
+        """
+        Returns a new (secret key, bootstrapping key) pair for this backend.
+        """
+        raise NotImplementedError()
+
+    def empty(self, key, shape):
+        """
+        Returns a new, uninitialized ciphertext of the given shape.
+        """
+        raise NotImplementedError()
+
+    def gate(self, key, op_code, result, *inputs, tuning=None):
+        """
+        Computes the gate `op_code` over `inputs` into `result`. `tuning` is
+        one of `tuning_candidates`, or None for the default settings.
+        """
+        raise NotImplementedError()
+
+    def tuning_candidates(self):
+        """
+        Returns the performance settings gates can be launched with, as
+        dicts that can be stored as JSON, for `sputnik.autotune` to measure.
+        """
+        return [dict()]
+
+    def device_name(self):
+        """
+        Returns a name for the device the backend computes on, which tunings
+        are stored under.
+        """
+        return type(self).__name__
+
+    def copy(self, key, result, source):
+        """
+        Copies the `source` ciphertext into `result`.
+        """
+        raise NotImplementedError()
+
+    def constant(self, key, result, values):
+        """
+        Fills `result` with a trivial encryption of the bool array `values`.
+        """
+        raise NotImplementedError()
+
+    def stack(self, key, ciphertexts):
+        """
+        Returns a single ciphertext that holds `ciphertexts`, which all share
+        the same shape, along a new leading axis.
+        """
+        stacked = self.empty(key, (len(ciphertexts),) + ciphertexts[0].shape)
+        for idx, ciphertext in enumerate(ciphertexts):
+            self.copy(key, stacked[idx], ciphertext)
+        return stacked
+
+    def unstack(self, stacked):
+        """
+        Splits a stacked ciphertext back along its leading axis.
+        """
+        return [stacked[idx] for idx in range(stacked.shape[0])]
+
+    def shift(self, key, result, source, bits):
+        """
+        Shifts the bits of `source` into `result` towards the most
+        significant bit if `bits` is positive, or towards the least
+        significant one if negative, filling in trivially encrypted zeros.
+        """
+        shape = source.shape
+        width = shape[-1]
+        self.constant(key, result, numpy.zeros(shape, dtype=bool))
+        if abs(bits) >= width:
+            return
+        if bits >= 0:
+            self.copy(key, result[bit_index(shape, bits, width)],
+                      source[bit_index(shape, 0, width - bits)])
+        else:
+            self.copy(key, result[bit_index(shape, 0, width + bits)],
+                      source[bit_index(shape, -bits, width)])
+
+    def concatenate(self, key, ciphertexts):
+        """
+        Returns a single ciphertext that joins `ciphertexts` along their last
+        axis, i.e. puts their bits one after the other.
+        """
+        shape = ciphertexts[0].shape
+        width = sum(ciphertext.shape[-1] for ciphertext in ciphertexts)
+        result = self.empty(key, shape[:-1] + (width,))
+        start = 0
+        for ciphertext in ciphertexts:
+            stop = start + ciphertext.shape[-1]
+            self.copy(key, result[bit_index(shape, start, stop)], ciphertext)
+            start = stop
+        return result
+
+    def nbytes(self, ciphertext):
+        """
+        Returns the number of bytes of device memory the ciphertext holds.
+        """
+        raise NotImplementedError()
+
+    def to_host_async(self, ciphertext):
+        """
+        Starts copying the ciphertext to host memory and returns a tuple of
+        numpy arrays which are valid after the next `synchronize`.
+        """
+        raise NotImplementedError()
+
+    def synchronize(self):
+        """
+        Waits for all queued computations and transfers to finish.
+        """
+        pass
+
+    def marker(self):
+        """
+        Returns a marker of the computations and transfers queued so far, to
+        `wait` for later while more are queued.
+        """
+        return None
+
+    def wait(self, marker):
+        """
+        Waits for the work queued before `marker` to finish.
+        """
+        self.synchronize()
+
+    def warmup(self, key, shape):
+        """
+        Runs every gate once over ciphertexts of `shape`, so their kernels are
+        compiled and cached before they're needed.
+        """
+        left = self.empty(key, shape)
+        right = self.empty(key, shape)
+        self.constant(key, left, numpy.zeros(shape, dtype=bool))
+        self.constant(key, right, numpy.ones(shape, dtype=bool))
+
+        result = self.empty(key, shape)
+        for op_code in self.GATES:
+            inputs = (left, right, left)[:len(SIGNATURES[op_code])]
+            self.gate(key, op_code, result, *inputs)
+        self.copy(key, result, left)
+        self.synchronize()
+
+    def dump(self, ciphertext):
+        """
+        Returns a tuple of host numpy arrays that fully describe the
+        ciphertext, for `load` to restore.
+        """
+        raise NotImplementedError()
+
+    def load(self, key, arrays):
+        """
+        Returns a ciphertext from the arrays returned by `dump`.
+        """
+        raise NotImplementedError()
+
+    def load_traced(self, key, buffers):
+        """
+        Returns a ciphertext from the host arrays `to_host_async` returns
+        for it, which are all a merkle-tree leaf holds, so traced gates can
+        be executed again.
+        """
+        return self.load(key, buffers)
+
+    def dump_key(self, key):
+        """
+        Returns the bootstrapping key serialized to bytes, for `load_key`.
+        """
+        return pickle.dumps(key)
+
+    def load_key(self, data):
+        """
+        Returns a bootstrapping key from the bytes returned by `dump_key`.
+        """
+        return pickle.loads(data)
+
+    def ciphertext_params(self, key):
+        """
+        Returns the encryption parameters of the ciphertexts made with `key`,
+        as a dict that can be stored as JSON.
+        """
+        return dict()
+
+    @to_host
+    def host_array(self, obj):
+        """
+        Returns `obj` as a host numpy array if it's an array this backend
+        stores keys in, or None otherwise. Used to store keys on disk.
+        """
+        if isinstance(obj, numpy.ndarray):
+            return obj
+        return None
+
+    def reduce_key_object(self, obj):
+        """
+        Returns how to pickle a part of a key that can't be pickled as it
+        is, like `__reduce__` would, or NotImplemented to pickle it as usual.
+        """
+        return NotImplemented
+
+    @to_device
+    def device_array(self, array):
+        """
+        Returns the host numpy `array` as an array this backend stores keys
+        in. Mapped arrays are read-only, so they're only used as they are by
+        backends that never write to their keys.
+        """
+        return array
+
+
+class NufheBackend(Backend):
+    """
+    Runs gates homomorphically with nufhe on a reikna thread.
+    """
+
+    GATES = {
+        'NAND': nufhe.gate_nand,
+        'OR': nufhe.gate_or,
+        'AND': nufhe.gate_and,
+        'XOR': nufhe.gate_xor,
+        'XNOR': nufhe.gate_xnor,
+        'NOT': nufhe.gate_not,
+        'NOR': nufhe.gate_nor,
+        'ANDNY': nufhe.gate_andny,
+        'ANDYN': nufhe.gate_andyn,
+        'ORNY': nufhe.gate_orny,
+        'ORYN': nufhe.gate_oryn,
+        'MUX': nufhe.gate_mux,
+    }
+
+    # Performance parameters the autotuner chooses from
+    TUNING_SPACE = {
+        'single_kernel_bootstrap': (False, True),
+        'transforms_per_block': (1, 2, 4),
+    }
+
+    def __init__(self, thr=None, perf_params=None):
+        if thr is None:
+            thr = any_api().Thread.create(interactive=True)
+        if perf_params is None:
+            perf_params = nufhe.performance_parameters(single_kernel_bootstrap=False,
+                                                       transforms_per_block=1)
+        self.thr = thr
+        self.pp = perf_params
+
+        # Performance parameters for every tuning used so far
+        self._tuned_pp = dict()
+
+    def make_key_pair(self, rng):
+        return nufhe.make_key_pair(self.thr, rng, transform_type='NTT')
+
+    def empty(self, key, shape):
+        return nufhe.empty_ciphertext(self.thr, key.params, shape)
+
+    def gate(self, key, op_code, result, *inputs, tuning=None):
+        self.GATES[op_code](self.thr, key, result, *inputs, perf_params=self.perf_params(tuning))
+
+    def perf_params(self, tuning):
+        """
+        Returns the nufhe performance parameters of `tuning`.
+        """
+        if not tuning:
+            return self.pp
+        tuning_key = tuple(sorted(tuning.items()))
+        perf_params = self._tuned_pp.get(tuning_key)
+        if perf_params is None:
+            perf_params = self._tuned_pp[tuning_key] = nufhe.performance_parameters(**tuning)
+        return perf_params
+
+    def tuning_candidates(self):
+        names = sorted(self.TUNING_SPACE)
+        return [dict(zip(names, values))
+                for values in itertools.product(*(self.TUNING_SPACE[name] for name in names))]
+
+    def device_name(self):
+        # CUDA devices have neither a platform nor a driver version
+        device = self.thr._device
+        platform = getattr(device, 'platform', None)
+        return ':'.join(str(part) for part in (
+            self.thr.api.get_id(), platform and platform.name, device.name,
+            getattr(device, 'driver_version', None)) if part)
+
+    def copy(self, key, result, source):
+        nufhe.gate_copy(self.thr, key, result, source, perf_params=self.pp)
+
+    def constant(self, key, result, values):
+        nufhe.gate_constant(self.thr, key, result, values, perf_params=self.pp)
+
+    def nbytes(self, ciphertext):
+        return ciphertext.a.nbytes + ciphertext.b.nbytes + ciphertext.current_variances.nbytes
+
+    @to_host
+    def to_host_async(self, ciphertext):
+        return (self.thr.from_device(ciphertext.a, async_=True),
+                self.thr.from_device(ciphertext.b, async_=True))
+
+    def synchronize(self):
+        self.thr.synchronize()
+
+    def marker(self):
+        # Only OpenCL queues are marked; elsewhere waits synchronize.
+        if self.thr.api.get_id() == ocl_id():
+            import pyopencl
+            return pyopencl.enqueue_marker(self.thr._queue)
+        return None
+
+    def wait(self, marker):
+        if marker is None:
+            self.synchronize()
+        else:
+            marker.wait()
+
+    @to_host
+    def dump(self, ciphertext):
+        return (ciphertext.a.get(), ciphertext.b.get(), ciphertext.current_variances.get())
+
+    @to_device
+    def load(self, key, arrays):
+        a, b, current_variances = (self.thr.to_device(array) for array in arrays)
+        return nufhe.LweSampleArray(key.params.in_out_params, a, b, current_variances)
+
+    def load_traced(self, key, buffers):
+        # Noise variances aren't traced. They're estimates that don't take
+        # part in computing gates, so zeros do.
+        a, b = buffers
+        current_variances = numpy.zeros(b.shape, dtype=numpy.float32)
+        return self.load(key, (a, b, current_variances))
+
+    def dump_key(self, key):
+        data = io.BytesIO()
+        key.dump(data)
+        return data.getvalue()
+
+    def load_key(self, data):
+        return nufhe.NuFHECloudKey.load(io.BytesIO(data), self.thr)
+
+    def ciphertext_params(self, key):
+        params = key.params.in_out_params
+        return {'size': params.size, 'min_noise': params.min_noise,
+                'max_noise': params.max_noise}
+
+    @to_host
+    def host_array(self, obj):
+        if isinstance(obj, self.thr.api.Array):
+            return obj.get()
+        return None
+
+    def reduce_key_object(self, obj):
+        # Its shape info holds kernel types, which are rebuilt from the arrays.
+        if isinstance(obj, nufhe.LweSampleArray):
+            return nufhe.LweSampleArray, (obj.params, obj.a, obj.b, obj.current_variances)
+        return NotImplemented
+
+    @to_device
+    def device_array(self, array):
+        return self.thr.to_device(array)
+
+
+class NumpyBackend(Backend):
+    """
+    Runs gates in plaintext over numpy bool arrays. Nothing is encrypted, so
+    this is only meant for checking and profiling the logic of a program
+    before running it homomorphically.
+    """
+
+    GATES = {
+        'NAND': lambda a, b, out: numpy.logical_not(numpy.logical_and(a, b, out=out), out=out),
+        'OR': numpy.logical_or,
+        'AND': numpy.logical_and,
+        'XOR': numpy.logical_xor,
+        'XNOR': lambda a, b, out: numpy.equal(a, b, out=out),
+        'NOT': numpy.logical_not,
+        'NOR': lambda a, b, out: numpy.logical_not(numpy.logical_or(a, b, out=out), out=out),
+        'ANDNY': lambda a, b, out: numpy.greater(b, a, out=out),
+        'ANDYN': lambda a, b, out: numpy.greater(a, b, out=out),
+        'ORNY': lambda a, b, out: numpy.less_equal(a, b, out=out),
+        'ORYN': lambda a, b, out: numpy.greater_equal(a, b, out=out),
+        'MUX': lambda a, b, c, out: numpy.copyto(out, numpy.where(a, b, c)),
+    }
+
+    thr = None
+    needs_key = False
+
+    def make_key_pair(self, rng):
+        return None, None
+
+    def empty(self, key, shape):
+        return numpy.empty(shape, dtype=bool)
+
+    def gate(self, key, op_code, result, *inputs, tuning=None):
+        self.GATES[op_code](*inputs, out=result)
+
+    def copy(self, key, result, source):
+        numpy.copyto(result, source)
+
+    def constant(self, key, result, values):
+        numpy.copyto(result, numpy.asarray(values, dtype=bool))
+
+    def stack(self, key, ciphertexts):
+        return numpy.stack(ciphertexts)
+
+    def concatenate(self, key, ciphertexts):
+        return numpy.concatenate(ciphertexts, axis=-1)
+
+    def nbytes(self, ciphertext):
+        return ciphertext.nbytes
+
+    @to_host
+    def to_host_async(self, ciphertext):
+        return (ciphertext.copy(),)
+
+    @to_host
+    def dump(self, ciphertext):
+        return (numpy.asarray(ciphertext),)
+
+    @to_device
+    def load(self, key, arrays):
+        return arrays[0]
+
+
+def bit_index(shape, start, stop):
+    """
+    Returns the index that selects bits `start` to `stop` of every bit vector
+    in a ciphertext of `shape`, i.e. slices its last axis. Ciphertexts index
+    like arrays of their own shape, whatever the layout of their buffers.
+    """
+    return (slice(None),) * (len(shape) - 1) + (slice(start, stop),)
+
+
+BACKENDS = {
+    'nufhe': NufheBackend,
+    'numpy': NumpyBackend,
+}
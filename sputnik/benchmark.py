@@ -0,0 +1,203 @@
+import json
+import numpy
+import os
+import platform
+import tempfile
+import time
+
+from sputnik.analyzer import Analysis
+from sputnik.engine import Program, Sputnik
+from sputnik.merkle import TRACE_FULL, TRACE_OFF
+from sputnik.opcodes import SIGNATURES
+from sputnik.parser import Parser
+
+
+RESULTS_VERSION = 1
+
+# Default gate mix: weights of the gates in generated circuits
+DEFAULT_MIX = {
+    'AND': 3,
+    'XOR': 3,
+    'OR': 2,
+    'NAND': 1,
+    'NOT': 1,
+    'MUX': 1,
+}
+
+# Result metrics where lower is better, and where higher is better
+LOWER_IS_BETTER = ('parse_seconds', 'startup_seconds', 'run_seconds',
+                   'bootstrap_latency', 'merkle_overhead')
+HIGHER_IS_BETTER = ('gates_per_second',)
+
+# Metrics that are already fractions of the run time, close to zero, which
+# are compared by their absolute change: relative changes of them are mostly
+# noise
+RATIO_METRICS = ('merkle_overhead',)
+
+
+def generate_circuit(size, depth, width, mix=None, inputs=4, seed=0):
+    """
+    Returns the source of a random layered Sputnik program over `size`-bit
+    variables. Each of the `depth` levels has `width` gates, drawn from the
+    `mix` of gate weights, whose operands come from the level before, so
+    the critical path is exactly `depth` gates long. The program EXECs
+    `inputs` variables named `in0`, `in1`..., takes its bootstrapping key
+    as `key` and EXITs with the last gate.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = numpy.random.RandomState(seed)
+    op_codes = sorted(mix)
+    weights = numpy.array([mix[op_code] for op_code in op_codes], dtype=float)
+    weights /= weights.sum()
+
+    previous = ['in{}'.format(idx) for idx in range(inputs)]
+    lines = ['EXEC ' + ' '.join(previous), 'KEY key', 'SIZE {}'.format(size)]
+    for level in range(depth):
+        current = list()
+        for gate in range(width):
+            op_code = op_codes[rng.choice(len(op_codes), p=weights)]
+            arity = len(SIGNATURES[op_code])
+            args = [previous[rng.randint(len(previous))] for _ in range(arity)]
+            lines.append(' '.join([op_code] + args))
+            var_name = 'l{}g{}'.format(level, gate)
+            lines.append('PUSH STATE {}'.format(var_name))
+            current.append(var_name)
+        previous = current
+    lines.append('EXIT')
+    return '\n'.join(lines) + '\n'
+
+
+def circuit_name(size, depth, width):
+    return 'size{}-depth{}-width{}'.format(size, depth, width)
+
+
+def run_benchmark(backend_factory, size, depth, width, mix=None, repeats=3, seed=0):
+    """
+    Generates a circuit and measures it on a fresh backend from
+    `backend_factory`, keeping the best of `repeats` runs. Returns a dict of
+    results; times are in seconds.
+    """
+    source = generate_circuit(size, depth, width, mix=mix, seed=seed)
+    with tempfile.NamedTemporaryFile('w', suffix='.sputnik', delete=False) as f:
+        f.write(source)
+        source_path = f.name
+
+    try:
+        start = time.perf_counter()
+        program = Parser(source_path).get_program()
+        parse_seconds = time.perf_counter() - start
+    finally:
+        os.remove(source_path)
+    analysis = Analysis(program)
+
+    start = time.perf_counter()
+    backend = backend_factory()
+    Sputnik(program, None, backend=backend).close()
+    startup_seconds = time.perf_counter() - start
+
+    _, key = backend.make_key_pair(numpy.random.RandomState(seed))
+    rng = numpy.random.RandomState(seed)
+    # Backends that don't encrypt have no key, but KEY still needs one.
+    inputs = {'key': key if key is not None else 'plaintext'}
+    for var_name in program.operations[0][1:]:
+        ciphertext = backend.empty(key, (size,))
+        backend.constant(key, ciphertext, rng.randint(0, 2, size=size).astype(bool))
+        inputs[var_name] = ciphertext
+
+    timings = dict()
+    for trace in (TRACE_OFF, TRACE_FULL):
+        best = None
+        for _ in range(repeats):
+            engine = Sputnik(Program(program.operations), None, backend=backend, trace=trace)
+            backend.synchronize()
+            start = time.perf_counter()
+            engine.execute_program(**inputs)
+            backend.synchronize()
+            elapsed = time.perf_counter() - start
+            engine.close()
+            if best is None or elapsed < best:
+                best = elapsed
+        timings[trace] = best
+
+    gates = width * depth
+    run_seconds = timings[TRACE_OFF]
+    return {
+        'name': circuit_name(size, depth, width),
+        'size': size,
+        'depth': depth,
+        'width': width,
+        'gates': gates,
+        'bootstraps': analysis.bootstrapped * size,
+        'parse_seconds': parse_seconds,
+        'startup_seconds': startup_seconds,
+        'run_seconds': run_seconds,
+        'gates_per_second': gates / run_seconds,
+        'bootstrap_latency': run_seconds / max(analysis.bootstrapped * size, 1),
+        'merkle_overhead': (timings[TRACE_FULL] - run_seconds) / run_seconds,
+    }
+
+
+def run_suite(backend_name, backend_factory, sizes, depths, widths, mix=None, repeats=3):
+    """
+    Runs `run_benchmark` over every combination of sizes, depths and widths
+    and returns the results document.
+    """
+    benchmarks = list()
+    for size in sizes:
+        for depth in depths:
+            for width in widths:
+                benchmarks.append(run_benchmark(backend_factory, size, depth, width,
+                                                mix=mix, repeats=repeats))
+    return {
+        'version': RESULTS_VERSION,
+        'backend': backend_name,
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'mix': mix or DEFAULT_MIX,
+        'benchmarks': benchmarks,
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError("Unsupported benchmark results version {}".format(results.get('version')))
+    return results
+
+
+def compare_results(baseline, current, threshold=0.1, ratio_threshold=0.05):
+    """
+    Compares two results documents benchmark by benchmark. Returns a list of
+    `(name, metric, baseline value, current value, change)` for every metric
+    that got worse by more than `threshold` relative to its baseline value,
+    or, for RATIO_METRICS, by more than `ratio_threshold` in absolute terms.
+    The change is relative, or absolute for RATIO_METRICS.
+    """
+    baseline_benchmarks = {benchmark['name']: benchmark for benchmark in baseline['benchmarks']}
+    regressions = list()
+    for benchmark in current['benchmarks']:
+        reference = baseline_benchmarks.get(benchmark['name'])
+        if reference is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            before, after = reference[metric], benchmark[metric]
+            if metric in RATIO_METRICS:
+                change, limit = after - before, ratio_threshold
+            elif before <= 0:
+                continue
+            else:
+                change, limit = (after - before) / before, threshold
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > limit:
+                regressions.append((benchmark['name'], metric, before, after, change))
+    return regressions
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import mmap
+import os
+
+from sputnik.keystore import resolve_key
+from sputnik.wire import (
+    align_file,
+    check_file_header,
+    map_buffers,
+    read_footer,
+    write_ciphertext,
+    write_file_header,
+    write_footer,
+)
+
+
+MAGIC = b'SPTNKCKP'
+VERSION = 2
+
+
+class Checkpointer:
+    """
+    Writes program checkpoints into a single append-only `sputnik.wire`
+    container file.
+
+    Each checkpoint appends the variables that changed since the previous
+    checkpoint, as ciphertexts in the `sputnik.wire` format, followed by a
+    JSON manifest and the footer pointing at it. The manifest lists every variable with the
+    offsets of its buffers, which may live in earlier checkpoints, so only
+    the latest manifest is needed to restore the program and the buffers can
+    be memory-mapped back without parsing the rest of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Variable name -> (value, manifest entry) as of the last checkpoint
+        self._written = dict()
+
+    def save(self, program, backend, merkle=None):
+        """
+        Appends a checkpoint of `program` to the file. Ciphertexts are dumped
+        to host memory with `backend`. If `merkle` is given, its accumulator
+        is saved too, so the computation trace can be continued.
+        """
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as f:
+                write_file_header(f, MAGIC, VERSION)
+
+        variables = dict(program.variables)
+        if program.state is not None:
+            variables['STATE'] = program.state
+
+        with open(self.path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            entries = dict()
+            for var_name, var_data in variables.items():
+                written = self._written.get(var_name)
+                if written is not None and written[0] is var_data:
+                    entries[var_name] = written[1]
+                    continue
+
+                # Every variable is a ciphertext in the wire format, and its
+                # entry points at the buffers in it.
+                align_file(f)
+                entry = write_ciphertext(f, backend, program.key, var_data)
+                entries[var_name] = entry
+                self._written[var_name] = (var_data, entry)
+
+            manifest = {
+                'program': program_digest(program),
+                'exec_index': program.exec_index,
+                'size': program.size,
+                'key': program.key_name,
+                'variables': entries,
+            }
+            if merkle is not None:
+                merkle.finalize()
+                manifest['merkle'] = {
+                    'gate_count': merkle.gate_count,
+                    'leaf_count': merkle.tree.leaf_count,
+                    'frontier': [(height, digest.hex())
+                                 for height, digest in merkle.tree.frontier],
+                }
+
+            manifest_data = json.dumps(manifest).encode()
+            manifest_offset = f.tell()
+            f.write(manifest_data)
+            write_footer(f, manifest_offset, len(manifest_data), MAGIC)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def forget(self, var_data):
+        """
+        Forgets that `var_data` was written, so a buffer that is about to be
+        reused for another value is written again by the next `save`.
+        """
+        for var_name, written in list(self._written.items()):
+            if written[0] is var_data:
+                del self._written[var_name]
+
+    def restore(self, program, backend, merkle=None, **kwargs):
+        """
+        Restores `program` from the latest checkpoint. The bootstrapping key
+        is looked up by its reference in `kwargs`, like KEY does. Restored
+        variables are not written again by the next `save`.
+        """
+        checkpoint = Checkpoint(self.path)
+        manifest = checkpoint.manifest
+        if manifest['program'] != program_digest(program):
+            raise ValueError("The checkpoint at {} is for a different program".format(self.path))
+
+        if manifest['key'] is not None:
+            key = kwargs.get(manifest['key'], None)
+            if not key:
+                raise SyntaxError("No key defined as {}".format(manifest['key']))
+            program.key = resolve_key(key, backend)
+        program.key_name = manifest['key']
+        program.size = manifest['size']
+
+        program.registers = [None] * len(program.registers)
+        self._written = dict()
+        for var_name, entry in manifest['variables'].items():
+            var_data = backend.load(program.key, checkpoint.arrays(var_name))
+            program.set_variable_data(var_name, var_data)
+            self._written[var_name] = (var_data, entry)
+
+        if merkle is not None and 'merkle' in manifest:
+            merkle.gate_count = manifest['merkle']['gate_count']
+            merkle.tree.leaf_count = manifest['merkle']['leaf_count']
+            merkle.tree.frontier = [(height, bytes.fromhex(digest))
+                                    for height, digest in manifest['merkle']['frontier']]
+
+        program.set_exec_index(manifest['exec_index'])
+        program.is_halted = False
+        program.is_killed = False
+
+
+class Checkpoint:
+    """
+    The latest checkpoint in a checkpoint file, memory-mapped.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            check_file_header(f, MAGIC, VERSION, path, 'checkpoint')
+            # Copy-on-write, so restored arrays can be used as outputs.
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        footer = read_footer(self.data, MAGIC)
+        if footer is None:
+            raise ValueError("{} has no complete checkpoint".format(path))
+        manifest_offset, manifest_length = footer
+        self.manifest = json.loads(
+            self.data[manifest_offset:manifest_offset + manifest_length].decode())
+
+    def arrays(self, var_name):
+        """
+        Returns the buffers of a variable as numpy arrays over the mapping.
+        """
+        return map_buffers(self.data, self.manifest['variables'][var_name])
+
+
+def program_digest(program):
+    """
+    Returns a digest of the program's operations, to tell checkpoints of
+    different programs apart.
+    """
+    text = '\n'.join(' '.join(operation) for operation in program.operations)
+    return hashlib.sha256(text.encode()).hexdigest()
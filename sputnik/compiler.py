@@ -0,0 +1,177 @@
+from array import array
+
+from sputnik.opcodes import (
+    DEF,
+    GATE_OP_CODES,
+    INT,
+    NAME,
+    OP_CODE_IDS,
+    OP_CODES,
+    SIGNATURES,
+    VAR,
+)
+from sputnik.operations import Operations
+
+
+STATE_SLOT = 0
+
+# OPCODES that are not gates but still leave their result in STATE.
+STATE_WRITERS = ('COPY', 'CONST', 'SHL', 'SHR')
+
+
+def _pooled_operands(op_code):
+    pooled = tuple(kind in (INT, NAME) for kind in SIGNATURES[op_code] or ())
+    return pooled if any(pooled) else None
+
+
+# Which operands of every OPCODE, by id, are pooled rather than stored as
+# they are: integer literals and names. None if there are none.
+POOLED_OPERANDS = [_pooled_operands(op_code) for op_code in OP_CODES]
+
+
+class Bytecode:
+    """
+    The compiled form of a Sputnik program. Every operation is reduced to an
+    integer OPCODE and pre-resolved operands, where variables are integer
+    slots into `Program.registers` instead of names.
+
+    Operations are packed into typed arrays: `op_ids` holds a byte per
+    OPCODE and `values` the operands of all operations back to back, with
+    `offsets` marking where each operation's start. Integer literals and
+    names are pooled in `constants`, and stored as their index there, so
+    literals of any size fit. `operands[op_index]` returns the operands of
+    an operation as a tuple.
+    """
+
+    def __init__(self):
+        self.op_ids = array('B')
+        self.offsets = array('Q', [0])
+        self.values = array('q')
+        self.constants = list()
+        self.operands = _Operands(self)
+
+        # Constant -> index in `constants`
+        self._constant_ids = dict()
+
+    def __len__(self):
+        return len(self.op_ids)
+
+    def append(self, op_id, operands):
+        """
+        Appends an operation with its resolved operands.
+        """
+        pooled = POOLED_OPERANDS[op_id]
+        if pooled is not None:
+            operands = [self._pool(operand) if is_pooled else operand
+                        for operand, is_pooled in zip(operands, pooled)]
+        self.op_ids.append(op_id)
+        self.values.extend(operands)
+        self.offsets.append(len(self.values))
+
+    def _pool(self, constant):
+        constant_id = self._constant_ids.get(constant)
+        if constant_id is None:
+            constant_id = self._constant_ids[constant] = len(self.constants)
+            self.constants.append(constant)
+        return constant_id
+
+
+class _Operands:
+    """
+    The operands of every operation of a `Bytecode`, unpacked on access.
+    """
+
+    __slots__ = ('bytecode',)
+
+    def __init__(self, bytecode):
+        self.bytecode = bytecode
+
+    def __len__(self):
+        return len(self.bytecode)
+
+    def __getitem__(self, op_index):
+        bytecode = self.bytecode
+        values = bytecode.values[bytecode.offsets[op_index]:bytecode.offsets[op_index + 1]]
+        pooled = POOLED_OPERANDS[bytecode.op_ids[op_index]]
+        if pooled is None:
+            return tuple(values)
+        constants = bytecode.constants
+        return tuple(constants[value] if is_pooled else value
+                     for value, is_pooled in zip(values, pooled))
+
+
+def get_signature(op_code, args):
+    """
+    Returns the operand kinds for `op_code` called with `args`, raising a
+    SyntaxError if the number of arguments is wrong.
+    """
+    signature = SIGNATURES[op_code]
+    if signature is None:
+        return (DEF,) * len(args)
+    if len(args) != len(signature):
+        raise SyntaxError("{} expects {} arguments, got {}".format(
+                          op_code, len(signature), len(args)))
+    return signature
+
+
+def compile_operation(op_code, args, slot_of):
+    """
+    Validates a single operation and returns its OPCODE id along with the
+    resolved operands. `slot_of` maps a variable name to its slot.
+    """
+    op_id = OP_CODE_IDS.get(op_code)
+    if op_id is None:
+        raise SyntaxError("{} is not a valid OPCODE".format(op_code))
+
+    signature = get_signature(op_code, args)
+    operands = list()
+    for kind, arg in zip(signature, args):
+        if kind == INT:
+            try:
+                operands.append(int(arg))
+            except ValueError:
+                raise SyntaxError("{} expects an integer, got {}".format(op_code, arg))
+        elif kind == NAME:
+            operands.append(arg)
+        else:
+            operands.append(slot_of(arg))
+    return op_id, tuple(operands)
+
+
+def compile_program(operations, slot_of):
+    """
+    Compiles a list of parsed operations, or compact `Operations`, into
+    `Bytecode`, using `slot_of` to map variable names to register slots.
+    Raises a SyntaxError, naming the offending operation or its source
+    line, for unknown OPCODES, wrong argument counts and variables that are
+    read before they are defined.
+    """
+    if not isinstance(operations, Operations):
+        operations = Operations(operations)
+
+    bytecode = Bytecode()
+    symbols = operations.symbols
+    defined = set()
+    for op_index in range(len(operations)):
+        op_code = operations.op_code(op_index)
+        args = [symbols[arg_id] for arg_id in operations.args(op_index)]
+        try:
+            op_id, operands = compile_operation(op_code, args, slot_of)
+
+            signature = get_signature(op_code, args)
+            for kind, arg, operand in zip(signature, args, operands):
+                if kind == VAR and operand not in defined:
+                    raise SyntaxError("{} is used before it is defined".format(arg))
+            for kind, operand in zip(signature, operands):
+                if kind == DEF:
+                    defined.add(operand)
+            if op_code in GATE_OP_CODES or op_code in STATE_WRITERS:
+                defined.add(STATE_SLOT)
+        except SyntaxError as error:
+            line_number = operations.line_numbers[op_index]
+            location = "Line {}".format(line_number) if line_number else "Operation {}".format(op_index)
+            raise SyntaxError("{} `{}`: {}".format(
+                              location, ' '.join(operations[op_index]), error.msg))
+
+        bytecode.append(op_id, operands)
+    return bytecode
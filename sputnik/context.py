@@ -0,0 +1,137 @@
+import threading
+import weakref
+from contextlib import contextmanager
+
+from sputnik.backends import NufheBackend
+
+
+class ContextPool:
+    """
+    A pool of compute contexts (backends) shared by the whole process.
+
+    Creating a reikna thread and compiling the gate kernels for it is slow,
+    so contexts are created once and handed out to Sputnik engines instead
+    of every engine creating its own. `warmup` runs every gate once on each
+    context to compile and cache the kernels before real work arrives.
+
+    The shared context engines use by default is kept apart from the ones
+    handed out by `acquire`, so a checked out context is never in use by
+    anyone else.
+    """
+
+    def __init__(self, size=1, factory=NufheBackend):
+        """
+        Creates a pool of at most `size` contexts to check out, each made by
+        `factory`, besides the shared one. Contexts are created lazily, on
+        first use.
+        """
+        self.size = size
+        self.factory = factory
+        self.contexts = list()
+
+        self._shared = None
+        self._pooled = 0
+        self._idle = list()
+        self._lock = threading.Condition()
+
+        # Key -> (context index, shape) pairs warmed up for it. Keys are
+        # weakly referenced, so a new key is never taken for a dead one.
+        self._warmed = weakref.WeakKeyDictionary()
+        # The same, for keys that can't be weakly referenced, like the None
+        # of backends that don't encrypt
+        self._warmed_plain = dict()
+
+    def _create(self):
+        context = self.factory()
+        self.contexts.append(context)
+        return context
+
+    def shared(self):
+        """
+        Returns the shared context, without checking it out. This is what
+        engines use by default; concurrent users should `acquire` instead.
+        """
+        with self._lock:
+            if self._shared is None:
+                self._shared = self._create()
+            return self._shared
+
+    def acquire(self, timeout=None):
+        """
+        Checks a context out of the pool, creating one if the pool isn't full
+        yet, or else waiting up to `timeout` seconds for one to be released.
+        """
+        with self._lock:
+            while not self._idle:
+                if self._pooled < self.size:
+                    self._pooled += 1
+                    return self._create()
+                if not self._lock.wait(timeout):
+                    raise TimeoutError("No compute context available")
+            return self._idle.pop()
+
+    def release(self, context):
+        """
+        Returns a checked out context to the pool.
+        """
+        with self._lock:
+            self._idle.append(context)
+            self._lock.notify()
+
+    @contextmanager
+    def context(self, timeout=None):
+        """
+        Checks a context out for the duration of a `with` block.
+        """
+        context = self.acquire(timeout)
+        try:
+            yield context
+        finally:
+            self.release(context)
+
+    def warmup(self, key, shapes, batch_sizes=(1,)):
+        """
+        Creates every context of the pool and compiles the gate kernels, on
+        them and on the shared context if it exists, for the `key`
+        parameters and each ciphertext shape in `shapes`, alone and stacked
+        in batches of each of `batch_sizes`.
+        """
+        with self._lock:
+            while self._pooled < self.size:
+                self._pooled += 1
+                self._idle.append(self._create())
+            contexts = list(self.contexts)
+
+        try:
+            warmed = self._warmed.setdefault(key, set())
+        except TypeError:
+            warmed = self._warmed_plain.setdefault(key, set())
+        for shape in batch_shapes(shapes, batch_sizes):
+            for index, context in enumerate(contexts):
+                if (index, shape) not in warmed:
+                    context.warmup(key, shape)
+                    warmed.add((index, shape))
+
+
+def batch_shapes(shapes, batch_sizes):
+    """
+    Returns every ciphertext shape in `shapes`, stacked in batches of each
+    of `batch_sizes`. Batches of one aren't stacked.
+    """
+    return [tuple(shape) if batch_size == 1 else (batch_size,) + tuple(shape)
+            for shape in shapes for batch_size in batch_sizes]
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """
+    Returns the process-wide context pool, creating it on first use.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ContextPool()
+        return _default_pool
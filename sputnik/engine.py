@@ -1,34 +1,17 @@
-import nufhe
+import asyncio
 import numpy
-import pickle
-from binascii import hexlify
-from merkletools import MerkleTools
-from reikna.cluda import any_api
-
-
-OP_CODES = [
-    'EXEC',
-    'SIZE',
-    'KEY',
-    'PUSH',
-    'NAND',
-    'OR',
-    'AND',
-    'XOR',
-    'XNOR',
-    'NOT',
-    'COPY',
-    'CONST',
-    'NOR',
-    'ANDNY',
-    'ANDYN',
-    'ORNY',
-    'ORYN',
-    'MUX',
-    'HALT',
-    'EXIT',
-    'RECOVER',
-]
+from sputnik.allocator import BARRIER_OP_CODES, BufferAllocator, plan_releases
+from sputnik.backends import bit_index
+from sputnik.checkpoint import Checkpointer
+from sputnik.compiler import STATE_SLOT, compile_operation, compile_program
+from sputnik.context import default_pool
+from sputnik.gatecache import CACHED_OP_CODES
+from sputnik.keystore import resolve_key
+from sputnik.merkle import TRACE_FULL, MerkleAccumulator, MerklePipeline
+from sputnik.opcodes import OP_CODES
+from sputnik.scheduler import Schedule, is_schedulable
+from sputnik.sharding import shard_ranges
+from sputnik.tracelog import TraceLogWriter
 
 
 class Sputnik:
@@ -39,21 +22,98 @@ class Sputnik:
     TODO: Hash the variables and states throughout execution.
     """
 
-    def __init__(self, program, bootstrapping_key):
+    def __init__(self, program, bootstrapping_key, backend=None, schedule=False,
+                 trace=TRACE_FULL, trace_every=1, checkpoint=None, checkpoint_every=None,
+                 reuse_buffers=False, memory_limit=None, bits=None, profiler=None,
+                 max_in_flight=32, trace_log=None, autotuner=None, gate_cache=None):
         """
         Initializes the Sputnik Engine with a Program and a FHE bootstrapping
         key.
+
+        `backend` is the `sputnik.backends.Backend` that runs the gates. By
+        default gates are computed homomorphically with nufhe, on the shared
+        context of the process-wide `sputnik.context` pool.
+
+        If `schedule` is True, independent gates are grouped by data
+        dependencies and same-type gates are launched together as a single
+        vectorized gate call.
+
+        `trace` sets which gates are merkleized: all of them (`'full'`), every
+        `trace_every` gate (`'sampled'`) or none (`'off'`). If `trace_log` is
+        a path, the merkleized gates are recorded there for
+        `sputnik.verifier` to audit.
+
+        `checkpoint` is the path of a checkpoint file, written on HALT and
+        every `checkpoint_every` operations, and read back by RECOVER.
+
+        With `reuse_buffers`, variables are dropped after their last use and
+        their ciphertexts are reused for later gate results, so dead
+        variables are not left in `Program.variables`. Gate results never
+        take more than `memory_limit` bytes of device memory, if given. The
+        high-water mark is kept by `self.allocator`.
+
+        `bits` is the `(start, stop)` range of STATE bits the engine computes
+        when the program runs sharded, for CONST to produce just those bits.
+
+        `profiler` is a `sputnik.profiler.Profiler` that records every
+        executed operation.
+
+        `max_in_flight` is how many operations the async execution methods
+        queue on the device between yields to the event loop.
+
+        `autotuner` is a `sputnik.autotune.Autotuner` that picks the
+        backend's performance settings for every gate launch by the shape of
+        its ciphertexts. Without one, gates run with the backend's defaults.
+
+        `gate_cache` is a `sputnik.gatecache.GateCache`. Gates run one at a
+        time then take their result from it when they've been computed over
+        the same inputs before, and store it otherwise. Scheduled blocks
+        don't use it.
         """
+        if reuse_buffers and schedule:
+            raise ValueError("Buffer reuse can't be combined with scheduling")
+
         self.program = program
         self.bootstrapping_key = bootstrapping_key
+        self.schedule = schedule
+        self._schedules = dict()
 
-        # Merkle-tree for verification
-        self.merkle = MerkleTools(hash_type='SHA256')
+        # OPCODE handlers, indexed by OPCODE id
+        self.handlers = [getattr(self, op_code) for op_code in OP_CODES]
 
-        # Setup NuFHE
-        self.thr = any_api().Thread.create(interactive=True)
+        # Setup the execution backend
+        if backend is None:
+            backend = default_pool().shared()
+        self.backend = backend
+        self.thr = backend.thr
         self.rng = numpy.random.RandomState()
-        self.pp = nufhe.performance_parameters(single_kernel_bootstrap=False, transforms_per_block=1)
+
+        # Merkle-tree for verification
+        log = None if trace_log is None else TraceLogWriter(trace_log)
+        self.merkle = MerklePipeline(self.backend, mode=trace, sample_every=trace_every, log=log)
+
+        # Checkpointing
+        self.checkpointer = None if checkpoint is None else Checkpointer(checkpoint)
+        self.checkpoint_every = checkpoint_every
+
+        # Gate result buffers
+        self.allocator = BufferAllocator(self.backend, memory_limit=memory_limit)
+        self.reuse_buffers = reuse_buffers
+        self._releases = None
+
+        self.bits = bits
+
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach(self.backend, self.merkle)
+
+        # Async execution pacing: operations queued since the last yield, and
+        # the device marker placed then
+        self.max_in_flight = max_in_flight
+        self.autotuner = autotuner
+        self.gate_cache = gate_cache
+        self._queued = 0
+        self._marker = None
 
     def execute_program(self, exec_index=None, **kwargs):
         """
@@ -61,44 +121,434 @@ class Sputnik:
         `exec_index` is not provided, the program will find the entrance index
         and set it minus one for the next execution call.
         """
-        if exec_index is None:
-            self.program.set_exec_index(self.program.find_entrance() - 1)
+        program = self.program
+        releases = self._start(exec_index)
+        last_checkpoint = program.exec_index
 
         exec_condition = None
-        while not self.program.is_halted and not self.program.is_killed:
-            op_code, args = self.program.increment_exec_index_and_get_op()
-            exec_condition = self.execute_operation(op_code, args, **kwargs)
-            # TODO: Use exec_condition for logging/debugging/etc
+        try:
+            while not program.is_halted and not program.is_killed:
+                # Only HALT and EXIT return an exec condition, which is
+                # returned below; the profiler, if any, records every step.
+                exec_condition = self._step(releases, kwargs)
+
+                if self.checkpoint_every and \
+                        program.exec_index - last_checkpoint >= self.checkpoint_every:
+                    self.checkpoint()
+                    last_checkpoint = program.exec_index
+        except Exception:
+            state_info = program.freeze()
+            raise RuntimeError("{} and state {}".format(
+                               program.operations[program.exec_index], state_info))
 
         # If the program is halted, we return the entire finite state machine.
         # If the program is killed, we return the STATE like normal.
         if self.program.is_halted or self.program.is_killed:
             return exec_condition
 
-    def execute_operation(self, op_code, args, **kwargs):
+    async def execute_program_async(self, exec_index=None, **kwargs):
         """
-        Executes the given operation.
+        Like `execute_program`, but as a coroutine that lets the event loop
+        run while the device computes.
+
+        Gates are queued on the device without waiting for them. Every
+        `max_in_flight` operations the engine yields to the event loop, and
+        once more than that are queued it waits, off the event loop, for the
+        older ones to finish. The device is only waited for before EXIT, HALT
+        and RECOVER, and checkpoints, which need the results on the host.
         """
-        # Check if the OPCODE is in the list of OP_CODES
-        if not op_code in OP_CODES:
-            raise SyntaxError("{} is not a valid OPCODE".format(op_code))
+        program = self.program
+        releases = self._start(exec_index)
+        last_checkpoint = program.exec_index
+        loop = asyncio.get_running_loop()
+
+        exec_condition = None
+        try:
+            while not program.is_halted and not program.is_killed:
+                next_op_id = program.bytecode.op_ids[program.exec_index + 1]
+                if OP_CODES[next_op_id] in BARRIER_OP_CODES:
+                    await self._settle_async()
+                exec_condition = self._step(releases, kwargs)
+                await self._pace_async()
+
+                if self.checkpoint_every and \
+                        program.exec_index - last_checkpoint >= self.checkpoint_every:
+                    await self._settle_async()
+                    await loop.run_in_executor(None, self.checkpoint)
+                    last_checkpoint = program.exec_index
+        except Exception:
+            state_info = program.freeze()
+            raise RuntimeError("{} and state {}".format(
+                               program.operations[program.exec_index], state_info))
+
+        if self.program.is_halted or self.program.is_killed:
+            return exec_condition
 
-        # Get the OPCODE function
-        op_code_func = getattr(self, op_code)
+    def execute_operation(self, op_code, args, **kwargs):
+        """
+        Executes the given operation. Variable names in `args` are resolved to
+        the program's slots first.
+        """
+        op_id, operands = compile_operation(op_code, args, self.program.slot_of)
         try:
-            return op_code_func(args, **kwargs)
+            if self.profiler is not None:
+                return self.profiler.profile(op_code, self.program.exec_index,
+                                             self.handlers[op_id], operands, **kwargs)
+            return self.handlers[op_id](operands, **kwargs)
         except Exception:
             state_info = self.program.freeze()
             raise RuntimeError("{} with args {} and state {}".format(
                                op_code, args, state_info))
 
+    async def execute_operation_async(self, op_code, args, **kwargs):
+        """
+        Like `execute_operation`, but as a coroutine that paces the device
+        the way `execute_program_async` does.
+        """
+        if op_code in BARRIER_OP_CODES:
+            await self._settle_async()
+        result = self.execute_operation(op_code, args, **kwargs)
+        await self._pace_async()
+        return result
+
+    def _start(self, exec_index):
+        """
+        Prepares the program to be executed from `exec_index`, or from its
+        entrance. Returns the buffer releases to make after each operation.
+        """
+        program = self.program
+        if program.bytecode is None:
+            program.compile()
+        if self.gate_cache is not None:
+            # Entrance variables may have been written in place since the
+            # last run
+            self.gate_cache.forget_all()
+        if self.reuse_buffers and self._releases is None:
+            self._releases = plan_releases(program)
+        if exec_index is None:
+            program.set_exec_index(program.find_entrance() - 1)
+        else:
+            program.set_exec_index(exec_index)
+        return self._releases or dict()
+
+    def _step(self, releases, kwargs):
+        """
+        Executes the next operation, or the next block of schedulable gates
+        if the engine schedules. Returns what the operation's handler does.
+        """
+        program = self.program
+        profiler = self.profiler
+        if self.schedule:
+            next_op = program.operations[program.exec_index + 1]
+            if is_schedulable(next_op[0]):
+                if profiler is None:
+                    self.execute_schedule(program.exec_index + 1)
+                else:
+                    profiler.profile('SCHEDULE', program.exec_index + 1,
+                                     self.execute_schedule, program.exec_index + 1)
+                return None
+
+        program.exec_index += 1
+        op_index = program.exec_index
+        op_id = program.bytecode.op_ids[op_index]
+        operands = program.bytecode.operands[op_index]
+        dying = releases.get(op_index)
+        if dying:
+            held = [program.registers[slots[0]] for slots, _ in dying]
+        if profiler is None:
+            exec_condition = self.handlers[op_id](operands, **kwargs)
+        else:
+            exec_condition = profiler.profile(OP_CODES[op_id], op_index,
+                                              self.handlers[op_id], operands, **kwargs)
+        if dying:
+            self._release(dying, held)
+        return exec_condition
+
+    async def _pace_async(self):
+        """
+        Called after queueing an operation. Yields to the event loop every
+        `max_in_flight` operations, waiting off the loop for the device to
+        get through the ones queued before the previous yield.
+        """
+        self._queued += 1
+        if self._queued < self.max_in_flight:
+            return
+        self._queued = 0
+
+        marker = self.backend.marker()
+        previous, self._marker = self._marker, marker
+        if previous is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.backend.wait, previous)
+        else:
+            await asyncio.sleep(0)
+
+    async def _settle_async(self):
+        """
+        Waits, off the event loop, for all queued device work and merkle-tree
+        hashing to finish.
+        """
+        self._queued = 0
+        self._marker = None
+        await asyncio.get_running_loop().run_in_executor(None, self.backend.synchronize)
+        await self.merkle.finalize_async()
+
+    def execute_batch(self, batch, **kwargs):
+        """
+        Executes the program once over many sets of entrance variables. Each
+        dict in `batch` holds the entrance variables of one request; they are
+        stacked along a new leading axis so every gate runs as a single call
+        for the whole batch. `kwargs` are shared by all requests, like the
+        bootstrapping key or inputs every request has in common, which gates
+        broadcast against the batch.
+
+        Returns the list of per-request STATEs and the merkle-tree of the
+        batched execution, or the HALT information if the program halts.
+        Every request's leaves are also merkleized on their own, into
+        `self.merkle.job_trees`, which have the roots the requests would
+        have had if executed one at a time.
+        """
+        program = self.program
+        if program.bytecode is None:
+            program.compile()
+
+        # The key is needed to stack ciphertexts before KEY gets to run.
+        key = resolve_key(kwargs.get(program.find_key_name(), None), self.backend)
+
+        entrance_names = program.operations[program.find_entrance()][1:]
+        stacked = dict()
+        for var_name in entrance_names:
+            values = [request[var_name] for request in batch if var_name in request]
+            if not values:
+                continue
+            if len(values) != len(batch):
+                raise ValueError("{} is missing from some requests".format(var_name))
+            stacked[var_name] = self.backend.stack(key, values)
+
+        # Values computed from the stacked inputs have their extra axis.
+        # Unbatched ones, like those of CONST, are shared by every request,
+        # whatever their leading dimension.
+        rank = min((len(var_data.shape) for var_data in stacked.values()), default=None)
+        self.merkle.split(len(batch), rank)
+
+        exec_condition = self.execute_program(**dict(kwargs, **stacked))
+        if not program.is_killed:
+            return exec_condition
+
+        state, merkle = exec_condition
+        if state is None:
+            return [None] * len(batch), merkle
+        if rank is None or len(state.shape) < rank:
+            return [state] * len(batch), merkle
+        return self.backend.unstack(state), merkle
+
+    def execute_sharded(self, pool, shards=None, **kwargs):
+        """
+        Executes the program split into `shards` bit ranges, by default one
+        per worker of `pool`, a `sputnik.sharding.ShardPool` holding the
+        bootstrapping key. Every shard runs the whole program over its bits
+        of the entrance variables in its own process.
+
+        Returns the reassembled STATE and a merkle-tree whose leaves are the
+        roots of the shards' computation trees, in bit order.
+        """
+        program = self.program
+        if program.bytecode is None:
+            program.compile()
+        size = None
+        for op_code, *args in program.operations:
+            # Shifts, slices and concatenations move bits across shards
+            if op_code in ('HALT', 'RECOVER', 'SHL', 'SHR', 'SLICE', 'CONCAT'):
+                raise ValueError("Sharded programs can't {}".format(op_code))
+            if op_code == 'SIZE':
+                size = int(args[0])
+
+        key_name = program.find_key_name()
+        if key_name is not None and pool.key is not None:
+            kwargs.pop(key_name, None)
+        entrance_names = program.operations[program.find_entrance()][1:]
+        inputs = {var_name: kwargs.pop(var_name) for var_name in entrance_names
+                  if kwargs.get(var_name) is not None}
+
+        widths = {var_data.shape[-1] for var_data in inputs.values()}
+        if size is not None:
+            widths.add(size)
+        if len(widths) != 1:
+            raise ValueError("Entrance variables and SIZE must have the same number of bits")
+        width, = widths
+
+        backend = pool.backend
+        work = list()
+        for start, stop in shard_ranges(width, shards or pool.workers):
+            shard_inputs = {var_name: backend.dump(var_data[bit_index(var_data.shape, start, stop)])
+                            for var_name, var_data in inputs.items()}
+            work.append((program.operations, (start, stop), shard_inputs, kwargs,
+                         self.merkle.mode, self.merkle.sample_every))
+
+        states = list()
+        tree = MerkleAccumulator()
+        for state, root in pool.map(work):
+            states.append(None if state is None else backend.load(pool.key, state))
+            if root is not None:
+                tree.add_leaf(bytes.fromhex(root))
+
+        program.is_killed = True
+        if states[0] is not None:
+            program.state = backend.concatenate(pool.key, states)
+        return program.state, tree
+
+    def reset(self):
+        """
+        Clears the program's variables, key and status and starts a new
+        merkle-tree, so the program can be executed again. The compiled
+        bytecode, schedules and free buffers are kept.
+        """
+        self.program.reset()
+        self.merkle.reset()
+        self._queued = 0
+        self._marker = None
+
+    def close(self):
+        """
+        Waits for the merkle-tree pipeline, finishes the leaf log and shuts
+        down its worker threads. The engine can't execute anything
+        afterwards.
+        """
+        self.merkle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def checkpoint(self):
+        """
+        Writes a checkpoint of the program, including the merkle-tree so far.
+        """
+        if self.checkpointer is None:
+            raise RuntimeError("No checkpoint file to write to")
+        self.checkpointer.save(self.program, self.backend, self.merkle)
+
+    def recover(self, **kwargs):
+        """
+        Restores the program from the latest checkpoint and resumes execution
+        right after the last operation it had executed.
+        """
+        if self.checkpointer is None:
+            raise RuntimeError("No checkpoint file to recover from")
+        if self.program.bytecode is None:
+            self.program.compile()
+        self.checkpointer.restore(self.program, self.backend, self.merkle, **kwargs)
+        return self.execute_program(exec_index=self.program.exec_index, **kwargs)
+
+    def _release(self, dying, held):
+        """
+        Drops the values that died at the current operation from the
+        registers. `held` are their ciphertexts from before the operation ran;
+        the ones the engine allocated go back to the allocator for reuse.
+        """
+        registers = self.program.registers
+        for (slots, recyclable), var_data in zip(dying, held):
+            if var_data is None:
+                continue
+            for slot in slots:
+                if registers[slot] is var_data:
+                    registers[slot] = None
+            if self.checkpointer is not None:
+                self.checkpointer.forget(var_data)
+            if self.gate_cache is not None:
+                self.gate_cache.forget(var_data)
+            if recyclable:
+                self.allocator.release(var_data)
+
+    def execute_schedule(self, start):
+        """
+        Executes the block of gates beginning at `start` level by level. All
+        gates of the same type within a level are stacked along a new leading
+        axis and run as one gate call. Afterwards the program variables and
+        exec_index are left as if the block was executed sequentially.
+        """
+        schedule = self._schedules.get(start)
+        if schedule is None:
+            schedule = Schedule(self.program.operations, start)
+            self._schedules[start] = schedule
+
+        results = [None] * len(schedule.gates)
+
+        def value_of(value):
+            if isinstance(value, int):
+                return results[value]
+            return self.program.get_variable_data(value)
+
+        try:
+            for level in schedule.levels:
+                batches = dict()
+                for gate_id in level:
+                    _, op_code, inputs = schedule.gates[gate_id]
+                    operands = tuple(value_of(value) for value in inputs)
+                    shapes = tuple(operand.shape for operand in operands)
+                    if len(set(shapes)) == 1:
+                        batch_key = (op_code, shapes)
+                    else:
+                        # Broadcasting gates can't be stacked with others.
+                        batch_key = (op_code, gate_id)
+                    batches.setdefault(batch_key, list()).append((gate_id, operands))
+
+                for (op_code, _), batch in batches.items():
+                    gate_ids, operand_lists = zip(*batch)
+                    outputs = self._execute_gate_batch(op_code, operand_lists)
+                    for gate_id, output in zip(gate_ids, outputs):
+                        results[gate_id] = output
+        except Exception:
+            state_info = self.program.freeze()
+            raise RuntimeError("Scheduled block at {} and state {}".format(
+                               start, state_info))
+
+        # Keep the computation trace in program order.
+        for gate_id, (_, op_code, inputs) in enumerate(schedule.gates):
+            operands = [value_of(value) for value in inputs]
+            self.merkle.add_computation(op_code, operands, results[gate_id])
+
+        final_values = {var_name: value_of(value)
+                        for var_name, value in schedule.bindings.items()}
+        for var_name, var_data in final_values.items():
+            self.program.set_variable_data(var_name, var_data)
+        self.program.set_exec_index(schedule.end - 1)
+
+    def _execute_gate_batch(self, op_code, operand_lists):
+        """
+        Runs the gate `op_code` once over every operand tuple in
+        `operand_lists` and returns the list of results. Operands must all
+        share the same shape.
+        """
+        backend = self.backend
+        key = self.program.key
+        if len(operand_lists) == 1:
+            result = backend.empty(key, result_shape(operand_lists[0]))
+            backend.gate(key, op_code, result, *operand_lists[0], tuning=self._tuning(result))
+            return [result]
+
+        stacked_operands = [backend.stack(key, operands) for operands in zip(*operand_lists)]
+        result = backend.empty(key, stacked_operands[0].shape)
+        backend.gate(key, op_code, result, *stacked_operands, tuning=self._tuning(result))
+        return backend.unstack(result)
+
+    def _tuning(self, result):
+        """
+        Returns the tuning to compute the gate result `result` with.
+        """
+        if self.autotuner is None:
+            return None
+        return self.autotuner.select(self.backend, self.program.key, tuple(result.shape))
+
     def EXEC(self, args, **kwargs):
         """
         Sputnik Program entrance OPCODE. Sets up the variables to be used during
         execution by checking the global kwargs for the entrance variables.
         """
         entrance_vars = dict()
-        for var_name in args:
+        for slot in args:
+            var_name = self.program.names[slot]
             var_data = kwargs.get(var_name, None)
             if var_data is None:
                 continue
@@ -118,7 +568,8 @@ class Sputnik:
     def KEY(self, args, **kwargs):
         """
         Sets the bootstrapping key to use for encrypted computations and set
-        an empty encrypted STATE.
+        an empty encrypted STATE. A `sputnik.keystore.KeyFile` is loaded
+        here, the first time the key is needed.
         """
         if self.program.key is not None:
             raise RuntimeError("Can't set KEY more than once!")
@@ -127,189 +578,159 @@ class Sputnik:
         if not bootstrap_key:
             raise SyntaxError("No key defined as {}".format(args[0]))
 
-        self.program.key = bootstrap_key
+        self.program.key = resolve_key(bootstrap_key, self.backend)
+        self.program.key_name = args[0]
 
     def PUSH(self, args, **kwargs):
         """
         Pushes the left value to the right value
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        self.program.set_variable_data(right_name, left)
+        left, right = args
+        registers = self.program.registers
+        registers[right] = registers[left]
 
     def NAND(self, args, **kwargs):
         """
         Performs a logical NAND on two bits.
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_nand(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('NAND', args)
 
     def OR(self, args, **kwargs):
         """
         Performs a logical OR on two bits.
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_or(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('OR', args)
 
     def AND(self, args, **kwargs):
         """
         Performs a logical AND on two bits.
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_and(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('AND', args)
 
     def XOR(self, args, **kwargs):
         """
         Performs a logical XOR on two bits.
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_xor(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
-
-        self._merkleize_computation(pickle.dumps((left.a.get(), left.b.get())),
-                                    pickle.dumps((right.a.get(), right.b.get())),
-                                    pickle.dumps((result.a.get(), result.b.get())))
+        self._gate('XOR', args)
 
     def XNOR(self, args, **kwargs):
         """
         Performs a logical XNOR on two bits.
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_xnor(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('XNOR', args)
 
     def NOT(self, args, **kwargs):
         """
         Performs a logical NOT on one bit.
         IN: A
         """
-        left_name = args
-        left = self.program.get_variable_data(left_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_not(self.thr, self.program.key, result, left, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('NOT', args)
 
     def COPY(self, args, **kwargs):
         """
-        wtf is this?
+        Copies a variable into STATE. Unlike PUSH, STATE gets its own
+        ciphertext. No bootstrapping required.
         IN: A
         """
-        pass
+        source_slot, = args
+        source = self.program.registers[source_slot]
+
+        result = self.allocator.empty(self.program.key, source.shape)
+        self.backend.copy(self.program.key, result, source)
+        self.program.state = result
 
     def CONST(self, args, **kwargs):
         """
-        wtf is this?
-        IN: A
+        Sets STATE to a trivial (noiseless) encryption of the integer constant,
+        with bit i of STATE being bit i of the constant. Negative constants are
+        two's complement, so `CONST -1` sets every bit. Needs SIZE to be set.
+        No bootstrapping required.
+        IN: N
         """
-        pass
+        if self.program.size is None:
+            raise RuntimeError("CONST needs the SIZE to be set")
+
+        value, = args
+        bits = constant_bits(value, self.program.size)
+        if self.bits is not None:
+            bits = bits[slice(*self.bits)]
+        result = self.allocator.empty(self.program.key, bits.shape)
+        self.backend.constant(self.program.key, result, bits)
+        self.program.state = result
 
     def NOR(self, args, **kwargs):
         """
         Performs a logical NOR on two bits.
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_nor(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('NOR', args)
 
     def ANDNY(self, args, **kwargs):
         """
         Performs a logical AndNY on two bits (NOT(A) AND B)
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_andny(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('ANDNY', args)
 
     def ANDYN(self, args, **kwargs):
         """
         Performs a logical AndYN on two bits (A and NOT(B))
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_andyn(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('ANDYN', args)
 
     def ORNY(self, args, **kwargs):
         """
         Performs a logical OrNY on two bits (NOT(A) OR B)
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_orny(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('ORNY', args)
 
     def ORYN(self, args, **kwargs):
         """
         Performs a logical OrYN on two bits (A OR NOT(B))
         IN: A, B
         """
-        left_name, right_name = args
-        left = self.program.get_variable_data(left_name)
-        right = self.program.get_variable_data(right_name)
-
-        result = nufhe.empty_ciphertext(self.thr, self.program.key.params, left.shape)
-        nufhe.gate_oryn(self.thr, self.program.key, result, left, right, perf_params=self.pp)
-        self.program.set_variable_data('STATE', result)
+        self._gate('ORYN', args)
 
     def MUX(self, args, **kwargs):
         """
         Performs a logical ternary multiplexer (A?B:C = A*B + NOT(A)*C)
+        with a single bootstrap.
         IN: A, B, C
         """
-        pass
+        self._gate('MUX', args)
+
+    def SHL(self, args, **kwargs):
+        """
+        Shifts the bits of a variable N places towards the most significant
+        bit into STATE, shifting in zeros. No bootstrapping required.
+        IN: A, N
+        """
+        self._shift(args[0], args[1])
+
+    def SHR(self, args, **kwargs):
+        """
+        Shifts the bits of a variable N places towards the least significant
+        bit into STATE, shifting in zeros. No bootstrapping required.
+        IN: A, N
+        """
+        self._shift(args[0], -args[1])
 
     def HALT(self, args, **kwargs):
         """
         Kills program execution and dumps all program information. Mostly used
-        for debugging.
+        for debugging. If the engine has a checkpoint file, the program is
+        also checkpointed so it can be RECOVERed.
         """
         self.program.is_halted = True
+        if self.checkpointer is not None:
+            self.checkpoint()
         halt_info = self.program.freeze()
         return halt_info
 
@@ -321,28 +742,111 @@ class Sputnik:
         # TODO: Probably need an error for empty state...
         self.program.is_killed = True
 
-        # Generate the merkle-tree
-        self.merkle.make_tree()
-        return self.program.state, self.merkle
+        # Wait for the merkle-tree pipeline to hash the remaining leaves, and
+        # finish the leaf log with them
+        self.merkle.close_log()
+        return self.program.state, self.merkle.tree
 
     def RECOVER(self, args, **kwargs):
         """
         Recovers a program at any point by loading the entire program
-        state information.
+        state information from the latest checkpoint. Execution continues
+        right after the operation the checkpoint was taken at.
+        """
+        if self.checkpointer is None:
+            raise RuntimeError("No checkpoint file to RECOVER from")
+        self.checkpointer.restore(self.program, self.backend, self.merkle, **kwargs)
+
+    def SLICE(self, args, **kwargs):
+        """
+        Makes a variable of bits START to STOP (exclusive) of another. The
+        new variable is a view of the same ciphertext, so nothing is copied
+        or bootstrapped, and gates over it only bootstrap those bits.
+        IN: A, START, STOP, B
+        """
+        source_slot, start, stop, target_slot = args
+        registers = self.program.registers
+        source = registers[source_slot]
+        width = source.shape[-1]
+        if not 0 <= start < stop <= width:
+            raise IndexError("Bits {} to {} are out of a {}-bit variable".format(
+                             start, stop, width))
+        registers[target_slot] = source[bit_index(source.shape, start, stop)]
+
+    def CONCAT(self, args, **kwargs):
+        """
+        Makes a variable of the bits of A followed by those of B, so bit 0
+        of B becomes the bit right after the most significant bit of A. The
+        bits are copied into a new ciphertext. No bootstrapping required.
+        IN: A, B, C
         """
-        # TODO: This would be neat to recover from a HALT, but it's gonna
-        #       take a little refactoring.
-        pass
+        low_slot, high_slot, target_slot = args
+        registers = self.program.registers
+        low, high = registers[low_slot], registers[high_slot]
+        low_width = low.shape[-1]
+        width = low_width + high.shape[-1]
+        shape = low.shape[:-1] + (width,)
 
-    def _merkleize_computation(self, *args):
+        key = self.program.key
+        result = self.allocator.empty(key, shape)
+        self.backend.copy(key, result[bit_index(shape, 0, low_width)], low)
+        self.backend.copy(key, result[bit_index(shape, low_width, width)], high)
+        registers[target_slot] = result
+
+    def _shift(self, source_slot, bits):
         """
-        Converts each arg into a bytestring, then makes each one a leaf on the
-        merkle tree.
+        Shifts the variable in `source_slot` by `bits` into STATE.
         """
-        encoded_args = list()
-        for arg in args:
-            encoded_args.append(hexlify(arg).decode())
-        self.merkle.add_leaf(encoded_args)
+        source = self.program.registers[source_slot]
+        result = self.allocator.empty(self.program.key, source.shape)
+        self.backend.shift(self.program.key, result, source, bits)
+        self.program.state = result
+
+    def _gate(self, op_code, args):
+        """
+        Runs the bootstrapped gate `op_code` over the variables in the `args`
+        slots, stores the result in STATE and adds it to the merkle-tree.
+        """
+        registers = self.program.registers
+        inputs = [registers[slot] for slot in args]
+
+        key = self.program.key
+        result = self.allocator.empty(key, result_shape(inputs))
+        cache = self.gate_cache
+        if cache is None:
+            self.backend.gate(key, op_code, result, *inputs, tuning=self._tuning(result))
+        else:
+            # Uncached gates still get an address, so their results are
+            # known without hashing them
+            address = cache.address(self.backend, key, op_code, inputs)
+            cached = None
+            if op_code in CACHED_OP_CODES:
+                cached = cache.get(self.backend, key, address)
+            if cached is None:
+                self.backend.gate(key, op_code, result, *inputs, tuning=self._tuning(result))
+                if op_code in CACHED_OP_CODES:
+                    cache.put(self.backend, key, address, result)
+            else:
+                self.backend.copy(key, result, cached)
+            cache.remember(result, address)
+        registers[STATE_SLOT] = result
+        self.merkle.add_computation(op_code, inputs, result)
+
+
+def result_shape(inputs):
+    """
+    Returns the shape of a gate's result: its inputs' shapes broadcast
+    together, so batched and shared inputs can be mixed.
+    """
+    return numpy.broadcast_shapes(*(ciphertext.shape for ciphertext in inputs))
+
+
+def constant_bits(value, size):
+    """
+    Returns the `size` lowest bits of the integer `value` as a bool array,
+    least significant bit first.
+    """
+    return numpy.array([(value >> bit) & 1 for bit in range(size)], dtype=bool)
 
 
 class Program:
@@ -357,34 +861,95 @@ class Program:
         This object should be retrieved via the Sputnik Parser.
         """
         self.operations = operations
-        self.state = None
-        self.variables = dict()
+        self.bytecode = None
+
+        # Variables live in registers, addressed by slot. STATE is slot 0.
+        self.names = ['STATE']
+        self.slots = {'STATE': STATE_SLOT}
+        self.registers = [None]
+
+        self.exec_index = None
+        self.key = None
+        self.key_name = None
+        self.size = None
+        self.is_halted = False
+        self.is_killed = False
+
+    @property
+    def state(self):
+        return self.registers[STATE_SLOT]
+
+    @state.setter
+    def state(self, var_data):
+        self.registers[STATE_SLOT] = var_data
+
+    @property
+    def variables(self):
+        """
+        Returns a dict of all the defined variables, excluding STATE.
+        """
+        return {var_name: self.registers[slot]
+                for var_name, slot in self.slots.items()
+                if slot != STATE_SLOT and self.registers[slot] is not None}
+
+    def compile(self):
+        """
+        Compiles the operations into `Bytecode` for execution. This validates
+        the whole program, so errors are raised before any gate runs.
+        """
+        self.bytecode = compile_program(self.operations, self.slot_of)
+
+    def reset(self):
+        """
+        Clears the variables, key and status of the program, keeping its
+        compiled bytecode and slots.
+        """
+        self.registers = [None] * len(self.registers)
         self.exec_index = None
         self.key = None
+        self.key_name = None
         self.size = None
         self.is_halted = False
         self.is_killed = False
 
+    def slot_of(self, var_name):
+        """
+        Returns the register slot for `var_name`, allocating one if needed.
+        """
+        slot = self.slots.get(var_name)
+        if slot is None:
+            slot = len(self.names)
+            self.slots[var_name] = slot
+            self.names.append(var_name)
+            self.registers.append(None)
+        return slot
+
     def get_variable_data(self, var_name):
         """
         Returns the data for the variable identified by `var_name`.
         If the var is the global STATE, then it will return it instead.
         """
-        if var_name == 'STATE':
-            return self.state
-
-        var = self.variables.get(var_name, None)
-        return var
+        slot = self.slots.get(var_name)
+        if slot is None:
+            return None
+        return self.registers[slot]
 
     def set_variable_data(self, var_name, var_data):
         """
         Sets the data for the variable identified by `var_name`.
         if the var is the global STATE, then it will set the STATE instead.
         """
-        if var_name == 'STATE':
-            self.state = var_data
-        else:
-            self.variables[var_name] = var_data
+        self.registers[self.slot_of(var_name)] = var_data
+
+    def find_key_name(self):
+        """
+        Returns the name the bootstrapping key is looked up by, from the first
+        KEY operation, or None if the program has no KEY.
+        """
+        for op_code, *args in self.operations:
+            if op_code == 'KEY':
+                return args[0]
+        return None
 
     def find_entrance(self):
         """
@@ -400,7 +965,8 @@ class Program:
         Sets the program's entrance variables during a BOOTSTRAP call.
         """
         # TODO: Error if empty?
-        self.variables.update(kwargs)
+        for var_name, var_data in kwargs.items():
+            self.set_variable_data(var_name, var_data)
 
     def set_exec_index(self, exec_index):
         """
@@ -433,7 +999,7 @@ class Program:
         state_info = dict()
         state_info['operations'] = self.operations.copy()
         state_info['state'] = self.state
-        state_info['variables'] = self.variables.copy()
+        state_info['variables'] = self.variables
         state_info['exec_index'] = self.exec_index
         state_info['size'] = self.size
         state_info['key'] = self.key
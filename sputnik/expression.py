@@ -0,0 +1,238 @@
+from sputnik.engine import Program, Sputnik
+from sputnik.optimizer import optimize
+
+
+# Name of the bootstrapping key in generated programs
+KEY_NAME = 'key'
+
+# Names inputs can't have: those of the program, and the options of
+# `Word.evaluate`, which takes inputs as keyword arguments
+RESERVED_NAMES = ('STATE', KEY_NAME, 'backend', 'size', 'schedule')
+
+
+class Word:
+    """
+    An encrypted word in a lazily evaluated expression.
+
+    Words are combined with `&`, `|`, `^`, `~`, `<<` and `>>` (and `mux`),
+    which build a graph of the expression rather than computing anything.
+    Integers mixed in are constants. `evaluate` lowers the whole graph to a
+    Sputnik program at once, so common subexpressions, dead code and
+    negations are optimized across all of it (see `sputnik.optimizer`),
+    and runs it; values are only computed as the program needs them.
+
+        a, b = word('a', a_ciphertext), word('b', b_ciphertext)
+        carry = (a & b) | ((a ^ b) & word('c'))
+        result = carry.evaluate(key, c=c_ciphertext)
+    """
+
+    __slots__ = ('op_code', 'args', '_operations')
+
+    def __init__(self, op_code, args=()):
+        """
+        Makes the node computing `op_code` over `args`: Words for gates, the
+        name and bound ciphertext for IN, the integer for CONST and the Word
+        and number of bits for SHL and SHR. Use `word`, `constant` and the
+        operators instead.
+        """
+        self.op_code = op_code
+        self.args = args
+        # Lowered operations, by SIZE
+        self._operations = dict()
+
+    def __and__(self, other):
+        return Word('AND', (self, _word(other)))
+
+    def __or__(self, other):
+        return Word('OR', (self, _word(other)))
+
+    def __xor__(self, other):
+        return Word('XOR', (self, _word(other)))
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __invert__(self):
+        return Word('NOT', (self,))
+
+    def __lshift__(self, bits):
+        return Word('SHL', (self, int(bits)))
+
+    def __rshift__(self, bits):
+        return Word('SHR', (self, int(bits)))
+
+    def __bool__(self):
+        raise TypeError("An encrypted word has no truth value, use mux()")
+
+    def __repr__(self):
+        if self.op_code == 'IN':
+            return 'word({!r})'.format(self.args[0])
+        if self.op_code == 'CONST':
+            return 'constant({})'.format(self.args[0])
+        return '<Word {}>'.format(self.op_code)
+
+    def inputs(self):
+        """
+        Returns the input Words the expression depends on, by name.
+        """
+        return {node.args[0]: node for node in _postorder(self) if node.op_code == 'IN'}
+
+    def operations(self, size=None):
+        """
+        Returns the operations of the unoptimized program computing the
+        expression: every node the result depends on, once, in dependency
+        order. Programs set SIZE if `size` is given, which constants need.
+        """
+        operations = self._operations.get(size)
+        if operations is None:
+            operations = self._operations[size] = _lower(self, size)
+        return operations
+
+    def to_program(self, size=None, optimized=True):
+        """
+        Returns a Program computing the expression into STATE, optimized by
+        default, with the bootstrapping key named `key` and the inputs
+        named as given to `word`.
+        """
+        program = Program(list(self.operations(size)))
+        if optimized:
+            program, _ = optimize(program)
+        return program
+
+    def source(self, size=None, optimized=True):
+        """
+        Returns the expression as the source of a .sputnik file.
+        """
+        operations = self.to_program(size, optimized).operations
+        return ''.join(' '.join(operation) + '\n' for operation in operations)
+
+    def evaluate(self, key, backend=None, size=None, schedule=False, **inputs):
+        """
+        Computes the expression with the bootstrapping `key` on `backend` (by
+        default the shared nufhe context) and returns the resulting
+        ciphertext.
+
+        Ciphertexts for the inputs are taken from `inputs` by name, falling
+        back to those bound by `word`. `size` is the word size in bits,
+        needed for constants; it's taken from the last dimension of the
+        inputs if not given.
+
+        Temporaries are dropped after their last use, and their ciphertexts
+        reused for later results, unless the program is run with
+        `schedule`, which launches independent gates of the same type
+        together instead.
+        """
+        for var_name, node in self.inputs().items():
+            if inputs.get(var_name) is None:
+                if node.args[1] is None:
+                    raise ValueError("No ciphertext for input {}".format(var_name))
+                inputs[var_name] = node.args[1]
+        if size is None and inputs:
+            size = next(iter(inputs.values())).shape[-1]
+
+        with Sputnik(self.to_program(size), None, backend=backend, schedule=schedule,
+                     reuse_buffers=not schedule) as engine:
+            state, _ = engine.execute_program(**{KEY_NAME: key}, **inputs)
+        return state
+
+
+def word(name, ciphertext=None):
+    """
+    Returns an input Word named `name`, optionally bound to its ciphertext.
+    """
+    if not name.isidentifier() or name in RESERVED_NAMES:
+        raise ValueError("{!r} can't name an input".format(name))
+    return Word('IN', (name, ciphertext))
+
+
+def constant(value):
+    """
+    Returns a Word holding the integer `value`, least significant bit first.
+    """
+    return Word('CONST', (int(value),))
+
+
+def mux(select, when_true, when_false):
+    """
+    Returns a Word taking each bit from `when_true` where `select` is set and
+    from `when_false` elsewhere.
+    """
+    return Word('MUX', (_word(select), _word(when_true), _word(when_false)))
+
+
+def _word(value):
+    if isinstance(value, Word):
+        return value
+    if isinstance(value, int):
+        return constant(value)
+    raise TypeError("Can't combine an encrypted word with {!r}".format(value))
+
+
+def _operands(node):
+    if node.op_code in ('IN', 'CONST'):
+        return ()
+    if node.op_code in ('SHL', 'SHR'):
+        return node.args[:1]
+    return node.args
+
+
+def _postorder(output):
+    """
+    Yields every node `output` depends on once, operands before their users.
+    Iterative, so deep expressions don't hit the recursion limit.
+    """
+    visited = set()
+    stack = [(output, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+            continue
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        stack.append((node, True))
+        for operand in reversed(_operands(node)):
+            if id(operand) not in visited:
+                stack.append((operand, False))
+
+
+def _lower(output, size):
+    nodes = list(_postorder(output))
+    inputs = dict()
+    for node in nodes:
+        if node.op_code != 'IN':
+            continue
+        var_name = node.args[0]
+        if inputs.setdefault(var_name, node) is not node and \
+                inputs[var_name].args[1] is not node.args[1]:
+            raise ValueError("Input {} is bound to different ciphertexts".format(var_name))
+
+    operations = [('EXEC',) + tuple(inputs), ('KEY', KEY_NAME)]
+    if size is not None:
+        operations.append(('SIZE', str(size)))
+    elif any(node.op_code == 'CONST' for node in nodes):
+        raise ValueError("Constants need the word size")
+
+    names = dict()
+    for index, node in enumerate(nodes):
+        if node.op_code == 'IN':
+            names[id(node)] = node.args[0]
+            continue
+        if node.op_code == 'CONST':
+            operations.append(('CONST', str(node.args[0])))
+        elif node.op_code in ('SHL', 'SHR'):
+            operations.append((node.op_code, names[id(node.args[0])], str(node.args[1])))
+        else:
+            operations.append((node.op_code,) + tuple(names[id(arg)] for arg in node.args))
+        # Temporaries are named apart from the inputs
+        var_name = '_e{}'.format(index)
+        while var_name in inputs:
+            var_name = '_' + var_name
+        names[id(node)] = var_name
+        operations.append(('PUSH', 'STATE', var_name))
+
+    operations.append(('PUSH', names[id(output)], 'STATE'))
+    operations.append(('EXIT',))
+    return operations
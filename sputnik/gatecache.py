@@ -0,0 +1,234 @@
+import hashlib
+import weakref
+from collections import OrderedDict
+
+from sputnik.analyzer import BOOTSTRAPPED_OP_CODES
+
+
+# Gates worth caching: a bootstrap costs far more than a hash and a copy,
+# while NOT is cheaper than either
+CACHED_OP_CODES = BOOTSTRAPPED_OP_CODES
+
+# Gates whose inputs can be swapped, so `a AND b` and `b AND a` share a result
+SYMMETRIC_OP_CODES = ('AND', 'OR', 'XOR', 'NAND', 'NOR', 'XNOR')
+
+
+class GateCacheStats:
+    """
+    Counters of a `GateCache`.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        # Ciphertexts hashed for their digest
+        self.hashed = 0
+
+    @property
+    def lookups(self):
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions,
+            'spills': self.spills,
+            'hashed': self.hashed,
+        }
+
+    def __repr__(self):
+        return "<GateCacheStats hits {}, misses {} ({:.1%} hit rate), evictions {}, spills {}>".format(
+               self.hits, self.misses, self.hit_rate, self.evictions, self.spills)
+
+
+class _Entry:
+
+    __slots__ = ('ciphertext', 'arrays', 'nbytes')
+
+    def __init__(self, ciphertext, nbytes):
+        self.ciphertext = ciphertext
+        # Host arrays, once spilled
+        self.arrays = None
+        self.nbytes = nbytes
+
+
+class GateCache:
+    """
+    Memoizes gate results by content, so a gate over inputs it has already
+    seen costs a hash and a copy instead of a bootstrap.
+
+    A result is addressed by the digest of its OPCODE, a fingerprint of the
+    bootstrapping key and the digests of its inputs. Inputs the engine
+    computed are known by the address they were computed at, so only the
+    ciphertexts that enter a program are hashed, once per run; the rest of
+    the chain costs a hash of a few digests per gate.
+
+    Results are kept on the device up to `device_bytes`, then the least
+    recently used ones are spilled to host memory, and beyond `max_bytes`
+    in all they're evicted. The cache can be shared by engines running on
+    the same backend.
+    """
+
+    def __init__(self, max_bytes, device_bytes=None):
+        self.max_bytes = max_bytes
+        self.device_bytes = max_bytes if device_bytes is None else min(device_bytes, max_bytes)
+        self.stats = GateCacheStats()
+
+        # Address -> _Entry, least recently used first
+        self._entries = OrderedDict()
+        self.used_bytes = 0
+        self.used_device_bytes = 0
+
+        # id(ciphertext) -> (weak reference, digest)
+        self._digests = dict()
+        # id(key) -> (key, fingerprint)
+        self._fingerprints = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def fingerprint(self, backend, key):
+        """
+        Returns a digest of the bootstrapping `key`, computed once per key.
+        """
+        known = self._fingerprints.get(id(key))
+        if known is not None and known[0] is key:
+            return known[1]
+        fingerprint = hashlib.sha256(backend.dump_key(key)).digest()
+        self._fingerprints[id(key)] = (key, fingerprint)
+        return fingerprint
+
+    def digest(self, backend, ciphertext):
+        """
+        Returns the digest of `ciphertext`: the address it was computed at,
+        if it's a remembered result, or else a hash of its contents.
+        """
+        known = self._digests.get(id(ciphertext))
+        if known is not None and known[0]() is ciphertext:
+            return known[1]
+
+        arrays = backend.to_host_async(ciphertext)
+        backend.synchronize()
+        hasher = hashlib.sha256(repr(tuple(ciphertext.shape)).encode())
+        for array in arrays:
+            hasher.update(array.tobytes())
+        self.stats.hashed += 1
+        digest = hasher.digest()
+        self.remember(ciphertext, digest)
+        return digest
+
+    def address(self, backend, key, op_code, inputs):
+        """
+        Returns the address of the result of the gate `op_code` over
+        `inputs`.
+        """
+        digests = [self.digest(backend, ciphertext) for ciphertext in inputs]
+        if op_code in SYMMETRIC_OP_CODES:
+            digests.sort()
+        hasher = hashlib.sha256(op_code.encode())
+        hasher.update(self.fingerprint(backend, key))
+        for digest in digests:
+            hasher.update(digest)
+        return hasher.digest()
+
+    def remember(self, ciphertext, digest):
+        """
+        Records `digest` as the digest of `ciphertext`, for as long as it
+        lives or until it's `forget`-ten.
+        """
+        ciphertext_id = id(ciphertext)
+
+        def expire(_, ciphertext_id=ciphertext_id):
+            known = self._digests.get(ciphertext_id)
+            if known is not None and known[0]() is None:
+                del self._digests[ciphertext_id]
+
+        self._digests[ciphertext_id] = (weakref.ref(ciphertext, expire), digest)
+
+    def forget(self, ciphertext):
+        """
+        Forgets the digest of `ciphertext`, whose buffer is about to be
+        written with another value.
+        """
+        known = self._digests.get(id(ciphertext))
+        if known is not None and known[0]() is ciphertext:
+            del self._digests[id(ciphertext)]
+
+    def forget_all(self):
+        """
+        Forgets every digest, e.g. before a run whose inputs may have been
+        written in place since the last one. Cached results are kept.
+        """
+        self._digests.clear()
+
+    def get(self, backend, key, address):
+        """
+        Returns the cached result at `address` as a ciphertext on the
+        device, or None. The ciphertext belongs to the cache and must be
+        copied, not written to.
+        """
+        entry = self._entries.get(address)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self._entries.move_to_end(address)
+        ciphertext = entry.ciphertext
+        if ciphertext is None:
+            ciphertext = entry.ciphertext = backend.load(key, entry.arrays)
+            entry.arrays = None
+            self.used_device_bytes += entry.nbytes
+            self._trim(backend)
+        return ciphertext
+
+    def put(self, backend, key, address, ciphertext):
+        """
+        Caches a copy of the result `ciphertext` at `address`.
+        """
+        if address in self._entries:
+            return
+        nbytes = backend.nbytes(ciphertext)
+        if nbytes > self.max_bytes:
+            return
+        copied = backend.empty(key, ciphertext.shape)
+        backend.copy(key, copied, ciphertext)
+        self._entries[address] = _Entry(copied, nbytes)
+        self.used_bytes += nbytes
+        self.used_device_bytes += nbytes
+        self._trim(backend)
+
+    def clear(self):
+        """
+        Drops every cached result and digest.
+        """
+        self._entries.clear()
+        self._digests.clear()
+        self.used_bytes = 0
+        self.used_device_bytes = 0
+
+    def _trim(self, backend):
+        if self.used_device_bytes > self.device_bytes:
+            for entry in self._entries.values():
+                if self.used_device_bytes <= self.device_bytes:
+                    break
+                if entry.ciphertext is None:
+                    continue
+                entry.arrays = backend.dump(entry.ciphertext)
+                entry.ciphertext = None
+                self.used_device_bytes -= entry.nbytes
+                self.stats.spills += 1
+
+        while self.used_bytes > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self.used_bytes -= entry.nbytes
+            if entry.ciphertext is not None:
+                self.used_device_bytes -= entry.nbytes
+            self.stats.evictions += 1
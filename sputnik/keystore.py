@@ -0,0 +1,168 @@
+import io
+import json
+import mmap
+import numpy
+import os
+import pickle
+
+from sputnik.wire import (
+    check_file_header,
+    map_buffers,
+    read_footer,
+    write_buffers,
+    write_file_header,
+    write_footer,
+)
+
+
+MAGIC = b'SPTNKKEY'
+VERSION = 2
+
+
+class _KeyPickler(pickle.Pickler):
+    """
+    Pickles a key with its arrays left out, to be stored raw. Each array is
+    replaced by its index in `arrays`.
+    """
+
+    def __init__(self, file, backend):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.backend = backend
+        self.arrays = list()
+        self._indices = dict()
+
+    def persistent_id(self, obj):
+        index = self._indices.get(id(obj))
+        if index is not None:
+            return index
+        array = self.backend.host_array(obj)
+        if array is None:
+            return None
+        index = len(self.arrays)
+        self.arrays.append(numpy.ascontiguousarray(array))
+        # Arrays referenced more than once are stored once.
+        self._indices[id(obj)] = index
+        return index
+
+    def reducer_override(self, obj):
+        return self.backend.reduce_key_object(obj)
+
+
+class _KeyUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, load_array):
+        super().__init__(file)
+        self.load_array = load_array
+
+    def persistent_load(self, index):
+        return self.load_array(index)
+
+
+def save_key(key, path, backend):
+    """
+    Writes `key`, which belongs to `backend`, to a key file at `path`.
+
+    A key file is a `sputnik.wire` container holding the raw arrays of the
+    key, each aligned for mapping, a pickle of the rest of the key that
+    refers to the arrays by index, and a JSON manifest locating both.
+    """
+    skeleton = io.BytesIO()
+    pickler = _KeyPickler(skeleton, backend)
+    pickler.dump(key)
+    skeleton = skeleton.getvalue()
+
+    with open(path, 'wb') as f:
+        write_file_header(f, MAGIC, VERSION)
+        entries = write_buffers(f, pickler.arrays)
+        skeleton_offset = f.tell()
+        f.write(skeleton)
+
+        manifest = {
+            'backend': type(backend).__name__,
+            'arrays': entries,
+            'skeleton': {'offset': skeleton_offset, 'length': len(skeleton)},
+        }
+        manifest_data = json.dumps(manifest).encode()
+        manifest_offset = f.tell()
+        f.write(manifest_data)
+        write_footer(f, manifest_offset, len(manifest_data), MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class KeyFile:
+    """
+    A bootstrapping key in a key file written by `save_key`.
+
+    It can be passed wherever a key is, and is only read when the key is
+    first needed, usually by KEY. The file is memory-mapped read-only, so
+    every process using the same key file shares the page cache holding it
+    rather than keeping its own copy. Backends that compute on the host use
+    the mapped arrays as they are; the others copy them to the device once
+    per backend. A KeyFile pickles as just its path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+        self._data = None
+
+        # id(backend) -> (backend, key)
+        self._loaded = dict()
+
+    def _map(self):
+        if self._data is not None:
+            return
+        with open(self.path, 'rb') as f:
+            check_file_header(f, MAGIC, VERSION, self.path, 'key file')
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        footer = read_footer(data, MAGIC)
+        if footer is None:
+            raise ValueError("{} is incomplete".format(self.path))
+        manifest_offset, manifest_length = footer
+        self.manifest = json.loads(data[manifest_offset:manifest_offset + manifest_length].decode())
+        self._data = data
+
+    def arrays(self):
+        """
+        Returns the arrays of the key as read-only numpy arrays over the
+        mapping.
+        """
+        self._map()
+        return map_buffers(self._data, self.manifest['arrays'])
+
+    def load(self, backend):
+        """
+        Returns the key, with its arrays stored by `backend`. The key is
+        only built once per backend.
+        """
+        loaded = self._loaded.get(id(backend))
+        if loaded is not None:
+            return loaded[1]
+
+        arrays = self.arrays()
+        skeleton = self.manifest['skeleton']
+        start = skeleton['offset']
+        data = io.BytesIO(self._data[start:start + skeleton['length']])
+        key = _KeyUnpickler(data, lambda index: backend.device_array(arrays[index])).load()
+        self._loaded[id(backend)] = (backend, key)
+        return key
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __repr__(self):
+        return 'KeyFile({!r})'.format(self.path)
+
+
+def resolve_key(key, backend):
+    """
+    Returns `key`, loaded for `backend` if it's a `KeyFile`.
+    """
+    if isinstance(key, KeyFile):
+        return key.load(backend)
+    return key
@@ -0,0 +1,155 @@
+"""
+Arithmetic macros, expanded by the parser into plain Sputnik operations.
+
+Gates work on all the bits of their operands at once, so carries are
+propagated with bit shifts, which are free, and MUX, which takes a single
+bootstrap: the carry out of bit i is `p[i] ? carry[i - 1] : g[i]`, where
+`p` is the propagate vector (a XOR b) and `g` the generate vector (a AND b).
+Adding SIZE-bit operands takes either SIZE - 1 ripple steps of one MUX each,
+or a Kogge-Stone prefix of log2(SIZE) levels of one MUX and one AND each,
+whichever bootstraps less. Every macro leaves its result in STATE.
+"""
+
+
+def ripple_steps(size):
+    """
+    Returns the number of bootstrapped gates the ripple carry chain takes.
+    """
+    return size - 1
+
+
+def prefix_steps(size):
+    """
+    Returns the number of bootstrapped gates the Kogge-Stone prefix takes.
+    """
+    levels = (size - 1).bit_length()
+    return max(2 * levels - 1, 0)
+
+
+def uses_prefix(size):
+    """
+    Returns True if carries over `size` bits are cheaper with the
+    Kogge-Stone prefix than with ripple carry. Ties go to the prefix, which
+    has the shorter critical path.
+    """
+    return prefix_steps(size) <= ripple_steps(size)
+
+
+def _carries(propagate, generate, select, size, temp):
+    """
+    Returns operations that leave the carry out of every bit in STATE.
+    `select` is an operand that equals the generate bit wherever the
+    propagate bit is clear.
+    """
+    carries = temp('carries')
+    operations = [('PUSH', generate, carries)]
+    if uses_prefix(size):
+        group_propagate = temp('propagate')
+        operations.append(('PUSH', propagate, group_propagate))
+        distance = 1
+        while distance < size:
+            operations += [
+                ('SHL', carries, str(distance)),
+                ('MUX', group_propagate, 'STATE', carries),
+                ('PUSH', 'STATE', carries),
+            ]
+            if distance * 2 < size:
+                operations += [
+                    ('SHL', group_propagate, str(distance)),
+                    ('AND', group_propagate, 'STATE'),
+                    ('PUSH', 'STATE', group_propagate),
+                ]
+            distance *= 2
+    else:
+        for _ in range(ripple_steps(size)):
+            operations += [
+                ('SHL', carries, '1'),
+                ('MUX', propagate, 'STATE', select),
+                ('PUSH', 'STATE', carries),
+            ]
+    operations.append(('PUSH', carries, 'STATE'))
+    return operations
+
+
+def _snapshot_state(args, temp):
+    """
+    Saves STATE to a temporary if it's an operand, as the expansion
+    overwrites it. Returns the operations and the operands to use.
+    """
+    if 'STATE' not in args:
+        return [], args
+    state = temp('state')
+    return [('PUSH', 'STATE', state)], [state if arg == 'STATE' else arg for arg in args]
+
+
+def _add(args, size, temp, invert_left=False):
+    operations, (left, right) = _snapshot_state(args, temp)
+    propagate, generate = temp('p'), temp('g')
+    operations += [
+        ('XNOR' if invert_left else 'XOR', left, right),
+        ('PUSH', 'STATE', propagate),
+        ('ANDNY' if invert_left else 'AND', left, right),
+        ('PUSH', 'STATE', generate),
+    ]
+    operations += _carries(propagate, generate, right, size, temp)
+    return operations, propagate
+
+
+def add(args, size, temp):
+    """
+    ADD A B -- A + B, modulo 2**SIZE.
+    """
+    operations, propagate = _add(args, size, temp)
+    return operations + [
+        ('SHL', 'STATE', '1'),
+        ('XOR', propagate, 'STATE'),
+    ]
+
+
+def sub(args, size, temp):
+    """
+    SUB A B -- A - B, modulo 2**SIZE, computed as NOT(NOT(A) + B).
+    """
+    operations, propagate = _add(args, size, temp, invert_left=True)
+    return operations + [
+        ('SHL', 'STATE', '1'),
+        ('XOR', propagate, 'STATE'),
+        ('NOT', 'STATE'),
+    ]
+
+
+def compare(args, size, temp):
+    """
+    CMP A B -- 1 if A < B as unsigned integers, else 0. A < B exactly when
+    NOT(A) + B carries out of the top bit.
+    """
+    operations, _ = _add(args, size, temp, invert_left=True)
+    return operations + [
+        ('SHR', 'STATE', str(size - 1)),
+    ]
+
+
+# Macro name -> (number of arguments, expander)
+MACROS = {
+    'ADD': (2, add),
+    'SUB': (2, sub),
+    'CMP': (2, compare),
+}
+
+
+def expand_macro(op_code, args, size, prefix):
+    """
+    Returns the operations the macro `op_code` over `args` expands to, for
+    SIZE-bit operands. Temporaries are named after `prefix`, which must be
+    unique per expansion.
+    """
+    arity, expander = MACROS[op_code]
+    if len(args) != arity:
+        raise SyntaxError("{} expects {} arguments, got {}".format(op_code, arity, len(args)))
+    if size is None:
+        raise SyntaxError("{} needs the SIZE to be set first".format(op_code))
+
+    def temp(name):
+        return '{}.{}'.format(prefix, name)
+
+    return expander(list(args), size, temp)
@@ -0,0 +1,312 @@
+import asyncio
+import hashlib
+import numpy
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sputnik.opcodes import OP_CODE_IDS
+
+
+# Computation trace modes
+TRACE_OFF = 'off'
+TRACE_SAMPLED = 'sampled'
+TRACE_FULL = 'full'
+TRACE_MODES = (TRACE_OFF, TRACE_SAMPLED, TRACE_FULL)
+
+
+class MerkleAccumulator:
+    """
+    Builds a SHA256 merkle-tree incrementally, one leaf at a time, keeping
+    only the roots of the perfect subtrees seen so far. The resulting root
+    is the same as the one MerkleTools computes for the same leaves, where
+    an odd node at the end of a level is promoted to the next level as is.
+    """
+
+    def __init__(self):
+        # (height, digest) pairs, with strictly decreasing heights
+        self.frontier = list()
+        self.leaf_count = 0
+
+    def add_leaf(self, digest):
+        """
+        Adds a leaf `digest` (bytes) to the tree.
+        """
+        height = 0
+        node = digest
+        while self.frontier and self.frontier[-1][0] == height:
+            _, left = self.frontier.pop()
+            node = hashlib.sha256(left + node).digest()
+            height += 1
+        self.frontier.append((height, node))
+        self.leaf_count += 1
+
+    def get_merkle_root(self):
+        """
+        Returns the hex encoded merkle root, or None if there are no leaves.
+        """
+        if not self.frontier:
+            return None
+        node = self.frontier[-1][1]
+        for _, left in reversed(self.frontier[:-1]):
+            node = hashlib.sha256(left + node).digest()
+        return node.hex()
+
+
+class MerkleTree:
+    """
+    A SHA256 merkle-tree over a list of leaf digests, with every level kept
+    so inclusion proofs can be made. Odd nodes are promoted like in
+    `MerkleAccumulator`, so both give the same root.
+    """
+
+    def __init__(self, digests):
+        self.levels = [list(digests)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            parents = [hashlib.sha256(level[idx] + level[idx + 1]).digest()
+                       for idx in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                parents.append(level[-1])
+            self.levels.append(parents)
+
+    @property
+    def leaf_count(self):
+        return len(self.levels[0])
+
+    def get_merkle_root(self):
+        """
+        Returns the hex encoded merkle root, or None if there are no leaves.
+        """
+        if not self.levels[0]:
+            return None
+        return self.levels[-1][0].hex()
+
+    def get_proof(self, index):
+        """
+        Returns the inclusion proof of leaf `index`: the sibling of its node
+        on every level where it has one, as `(is_left, digest)` pairs from
+        the bottom up.
+        """
+        proof = list()
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                proof.append((sibling < index, level[sibling]))
+            index //= 2
+        return proof
+
+
+def verify_proof(digest, proof, root):
+    """
+    Returns True if `proof` shows that the leaf `digest` is in the tree with
+    the hex encoded `root`.
+    """
+    node = digest
+    for is_left, sibling in proof:
+        if is_left:
+            node = hashlib.sha256(sibling + node).digest()
+        else:
+            node = hashlib.sha256(node + sibling).digest()
+    return node.hex() == root
+
+
+class MerklePipeline:
+    """
+    Merkleizes the computation trace off the critical path of execution.
+
+    Every gate is one leaf: a digest of its OPCODE, input and result
+    ciphertexts. With `mode` set to TRACE_SAMPLED only every `sample_every`
+    gate is a leaf, and TRACE_OFF disables the trace altogether.
+
+    Adding a computation only queues non-blocking device to host copies of
+    the ciphertexts. Once `batch_size` leaves are queued, the batch is handed
+    to a worker pool that waits for the copies and hashes the leaves. Digests
+    are folded into a `MerkleAccumulator` in submission order, so the root
+    doesn't depend on the order the workers finish in.
+
+    If `log` is a `sputnik.tracelog.TraceLogWriter`, hashed leaves are also
+    recorded to it. `finalize` only waits for them to be written; the log is
+    finished by `close_log`, or `close`.
+
+    The worker pool lives as long as the pipeline; `close` shuts it down.
+
+    After `split`, the leaves of a batched execution are also merkleized per
+    job, into `job_trees`, as each job would have been on its own.
+    """
+
+    def __init__(self, backend, mode=TRACE_FULL, sample_every=1, workers=2, batch_size=64,
+                 log=None):
+        if mode not in TRACE_MODES:
+            raise ValueError("Trace mode must be one of {}".format(TRACE_MODES))
+        if sample_every < 1:
+            raise ValueError("Can't sample less than every gate")
+
+        self.backend = backend
+        self.mode = mode
+        self.sample_every = sample_every
+        self.batch_size = batch_size
+        self.tree = MerkleAccumulator()
+        self.gate_count = 0
+        self.log = log
+
+        # (job count, rank of stacked ciphertexts) while split, and a tree
+        # per job
+        self.jobs = None
+        self.job_trees = None
+
+        # If set to a list, the (start, end, thread id, leaves) span of every
+        # hashed batch
+        self.spans = None
+
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = list()
+        self._batches = deque()
+
+    def add_computation(self, op_code, inputs, result):
+        """
+        Queues the gate `op_code` over the `inputs` ciphertexts with the
+        `result` ciphertext as a leaf of the merkle-tree, if it's traced.
+        """
+        gate_index = self.gate_count
+        self.gate_count += 1
+        if self.mode == TRACE_OFF:
+            return
+        if self.mode == TRACE_SAMPLED and gate_index % self.sample_every:
+            return
+
+        buffers = [self.backend.to_host_async(ciphertext)
+                   for ciphertext in list(inputs) + [result]]
+        self._pending.append((OP_CODE_IDS[op_code], buffers, gate_index,
+                              [ciphertext.shape for ciphertext in list(inputs) + [result]]))
+        if len(self._pending) >= self.batch_size:
+            self._submit_batch()
+
+    def split(self, job_count, rank):
+        """
+        Merkleizes every one of `job_count` jobs of a batched execution into
+        a tree of its own as well. Ciphertexts of at least `rank` dimensions
+        are stacked, holding each job's ciphertext along their leading axis;
+        the others, or all of them if `rank` is None, are shared by all
+        jobs.
+        """
+        self.jobs = (job_count, rank)
+        self.job_trees = [MerkleAccumulator() for _ in range(job_count)]
+
+    def finalize(self):
+        """
+        Waits for all queued leaves to be hashed, and logged, and returns the
+        tree.
+        """
+        if self._pending:
+            self._submit_batch()
+        self._drain(block=True)
+        if self.log is not None:
+            self.log.flush()
+        return self.tree
+
+    def close_log(self):
+        """
+        Waits for queued leaves and finishes the log with them. Later leaves
+        aren't logged.
+        """
+        self.finalize()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def reset(self):
+        """
+        Waits for queued leaves and starts a new, empty tree.
+        """
+        self.finalize()
+        self.tree = MerkleAccumulator()
+        self.gate_count = 0
+        self.jobs = None
+        self.job_trees = None
+
+    def close(self):
+        """
+        Waits for queued leaves, finishes the log and shuts down the worker
+        pool. The pipeline can't be used afterwards.
+        """
+        if self._pool is None:
+            return
+        self.close_log()
+        self._pool.shutdown()
+        self._pool = None
+
+    async def finalize_async(self):
+        """
+        Like `finalize`, but waits for the hashing without blocking the
+        event loop.
+        """
+        if self._pending:
+            self._submit_batch()
+        while self._batches:
+            await asyncio.wrap_future(self._batches[0][0])
+            self._drain(block=False)
+        if self.log is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.log.flush)
+        return self.tree
+
+    def _submit_batch(self):
+        batch, self._pending = self._pending, list()
+        self._batches.append((self._pool.submit(self._hash_batch, batch, self.jobs), batch))
+        self._drain(block=False)
+
+    def _hash_batch(self, batch, jobs):
+        start = time.perf_counter()
+        # Wait for the queued transfers to land in host memory.
+        self.backend.synchronize()
+        digests = [hash_leaf(op_id, buffers) for op_id, buffers, _, _ in batch]
+        job_digests = None
+        if jobs is not None:
+            job_digests = [[hash_leaf(op_id, job_buffers)
+                            for job_buffers in split_leaf(buffers, shapes, *jobs)]
+                           for op_id, buffers, _, shapes in batch]
+        if self.spans is not None:
+            self.spans.append((start, time.perf_counter(), threading.get_ident(), len(batch)))
+        return digests, job_digests
+
+    def _drain(self, block):
+        while self._batches and (block or self._batches[0][0].done()):
+            future, batch = self._batches.popleft()
+            digests, job_digests = future.result()
+            for digest in digests:
+                self.tree.add_leaf(digest)
+            for leaf_digests in job_digests or ():
+                for tree, digest in zip(self.job_trees, leaf_digests):
+                    tree.add_leaf(digest)
+            if self.log is not None:
+                self.log.append(batch)
+
+
+def hash_leaf(op_id, buffers):
+    """
+    Returns the leaf digest of a gate from its OPCODE id and the host arrays
+    of its input and result ciphertexts (`a` and `b` for LWE ciphertexts).
+    The digest covers the shapes and raw buffer contents, without
+    serializing them first.
+    """
+    leaf = hashlib.sha256(struct.pack('<BB', op_id, len(buffers)))
+    for arrays in buffers:
+        for array in arrays:
+            array = numpy.ascontiguousarray(array)
+            leaf.update(struct.pack('<B', array.ndim))
+            leaf.update(struct.pack('<{}Q'.format(array.ndim), *array.shape))
+            leaf.update(array.data)
+    return leaf.digest()
+
+
+def split_leaf(buffers, shapes, job_count, rank):
+    """
+    Returns the host buffers of a leaf of a batched execution as they are
+    for each of its `job_count` jobs: the job's slice of the ciphertexts of
+    at least `rank` dimensions, which are stacked, and all of the others.
+    """
+    return [[tuple(array[job] for array in arrays)
+             if rank is not None and len(shape) >= rank else arrays
+             for arrays, shape in zip(buffers, shapes)]
+            for job in range(job_count)]
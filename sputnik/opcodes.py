@@ -0,0 +1,82 @@
+# Operand kinds
+VAR = 'var'     # Reads a variable (or STATE)
+DEF = 'def'     # Writes a variable (or STATE)
+INT = 'int'     # Integer literal
+NAME = 'name'   # Name of an execution keyword argument, e.g. the key
+
+OP_CODES = [
+    'EXEC',
+    'SIZE',
+    'KEY',
+    'PUSH',
+    'NAND',
+    'OR',
+    'AND',
+    'XOR',
+    'XNOR',
+    'NOT',
+    'COPY',
+    'CONST',
+    'NOR',
+    'ANDNY',
+    'ANDYN',
+    'ORNY',
+    'ORYN',
+    'MUX',
+    'HALT',
+    'EXIT',
+    'RECOVER',
+    'SHL',
+    'SHR',
+    'SLICE',
+    'CONCAT',
+]
+
+OP_CODE_IDS = {op_code: op_id for op_id, op_code in enumerate(OP_CODES)}
+
+# The operand kinds of every OPCODE. EXEC is variadic; each of its arguments
+# declares an entrance variable.
+SIGNATURES = {
+    'EXEC': None,
+    'SIZE': (INT,),
+    'KEY': (NAME,),
+    'PUSH': (VAR, DEF),
+    'NAND': (VAR, VAR),
+    'OR': (VAR, VAR),
+    'AND': (VAR, VAR),
+    'XOR': (VAR, VAR),
+    'XNOR': (VAR, VAR),
+    'NOT': (VAR,),
+    'COPY': (VAR,),
+    'CONST': (INT,),
+    'NOR': (VAR, VAR),
+    'ANDNY': (VAR, VAR),
+    'ANDYN': (VAR, VAR),
+    'ORNY': (VAR, VAR),
+    'ORYN': (VAR, VAR),
+    'MUX': (VAR, VAR, VAR),
+    'HALT': (),
+    'EXIT': (),
+    'RECOVER': (),
+    'SHL': (VAR, INT),
+    'SHR': (VAR, INT),
+    'SLICE': (VAR, INT, INT, DEF),
+    'CONCAT': (VAR, VAR, DEF),
+}
+
+# Gates; each one writes its result to STATE. All of them but NOT are
+# bootstrapped.
+GATE_OP_CODES = (
+    'NAND',
+    'OR',
+    'AND',
+    'XOR',
+    'XNOR',
+    'NOT',
+    'NOR',
+    'ANDNY',
+    'ANDYN',
+    'ORNY',
+    'ORYN',
+    'MUX',
+)
@@ -0,0 +1,127 @@
+"""
+Bit-range and concatenation operands, expanded by the parser into SLICE and
+CONCAT operations.
+
+Any operand an operation reads can be written as
+
+    a[4:8]      bits 4 to 7 of `a`, least significant first
+    a[:8]       bits 0 to 7 of `a`
+    a[3]        bit 3 of `a`
+    {a,b[0:4]}  the bits of `a` followed by bits 0 to 3 of `b`
+
+Bit ranges become views of the variable's ciphertext, so they cost nothing
+and gates over them only bootstrap the selected bits. Concatenations copy
+their parts into a new ciphertext, except for adjacent ranges of the same
+variable, like `{a[0:4],a[4:8]}`, which are merged into a single view.
+"""
+import itertools
+import re
+
+from sputnik.opcodes import DEF, SIGNATURES, VAR
+
+
+BIT_RANGE = re.compile(r'^(?P<name>[^\[\]{},:]+)'
+                       r'\[(?:(?P<start>\d*):(?P<stop>\d+)|(?P<bit>\d+))\]$')
+
+
+def is_plain(arg):
+    """
+    Returns True if `arg` uses neither bit ranges nor concatenation.
+    """
+    return not any(char in arg for char in '[]{}')
+
+
+def parse_part(arg):
+    """
+    Returns `(name, start, stop)` for a bit range operand, where `start` and
+    `stop` are None for a whole variable. Raises a SyntaxError for
+    malformed operands.
+    """
+    if not arg:
+        raise SyntaxError("Empty operand")
+    if is_plain(arg):
+        return arg, None, None
+    match = BIT_RANGE.match(arg)
+    if match is None:
+        raise SyntaxError("{} is not a valid operand".format(arg))
+    if match.group('bit') is not None:
+        start = int(match.group('bit'))
+        return match.group('name'), start, start + 1
+    start, stop = int(match.group('start') or 0), int(match.group('stop'))
+    if start >= stop:
+        raise SyntaxError("{} selects no bits".format(arg))
+    return match.group('name'), start, stop
+
+
+def parse_operand(arg):
+    """
+    Returns the parts of an operand as a list of `(name, start, stop)`, with
+    adjacent ranges of the same variable merged.
+    """
+    if arg.startswith('{') and arg.endswith('}'):
+        parts = [parse_part(part) for part in arg[1:-1].split(',')]
+    else:
+        parts = [parse_part(arg)]
+
+    merged = [parts[0]]
+    for name, start, stop in parts[1:]:
+        last_name, last_start, last_stop = merged[-1]
+        if name == last_name and start is not None and start == last_stop:
+            merged[-1] = (name, last_start, stop)
+        else:
+            merged.append((name, start, stop))
+    return merged
+
+
+def expand_operands(operation, prefix, arity=None):
+    """
+    Returns the operations `operation` expands to: a SLICE or CONCAT for
+    every bit range and concatenation it reads, followed by the operation
+    over the temporaries they define. Temporaries are named after `prefix`,
+    which must be unique per expansion. STATE is left untouched.
+
+    `arity` is the number of arguments of a macro, all of which it reads;
+    other operations are expanded following their signature.
+    """
+    op_code, *args = operation
+    if all(is_plain(arg) for arg in args):
+        return [operation]
+
+    if arity is not None:
+        signature = (VAR,) * arity
+    else:
+        signature = SIGNATURES.get(op_code) or (DEF,) * len(args)
+    if len(args) != len(signature):
+        # The compiler reports the wrong argument count
+        signature = (VAR,) * len(args)
+
+    operations = list()
+    temporaries = itertools.count()
+
+    def temp():
+        return '{}.{}'.format(prefix, next(temporaries))
+
+    def view(name, start, stop):
+        if start is None:
+            return name
+        var_name = temp()
+        operations.append(('SLICE', name, str(start), str(stop), var_name))
+        return var_name
+
+    expanded = [op_code]
+    for kind, arg in zip(signature, args):
+        if is_plain(arg):
+            expanded.append(arg)
+            continue
+        if kind != VAR:
+            raise SyntaxError("{} can only be read".format(arg))
+        parts = parse_operand(arg)
+        var_name = view(*parts[0])
+        for part in parts[1:]:
+            part_name = view(*part)
+            joined = temp()
+            operations.append(('CONCAT', var_name, part_name, joined))
+            var_name = joined
+        expanded.append(var_name)
+    operations.append(tuple(expanded))
+    return operations
@@ -0,0 +1,147 @@
+from array import array
+
+from sputnik.opcodes import OP_CODE_IDS, OP_CODES
+
+
+class Operations:
+    """
+    A compact, array-backed list of operations.
+
+    Every token is interned once in `symbols`, and operations are stored as
+    integers: `op_ids` holds the OPCODE id of each operation and `arg_ids`
+    the symbol ids of all arguments back to back, with `offsets` marking
+    where each operation's arguments start. Operations with an unknown
+    OPCODE keep it as `-(symbol id + 1)` in `op_ids`, for the compiler to
+    report. `line_numbers` keeps the source line of every operation.
+
+    Indexing still returns operations as tuples of strings, so this can be
+    used wherever a list of operations is.
+    """
+
+    def __init__(self, operations=()):
+        self.symbols = list()
+        self.symbol_ids = dict()
+
+        self.op_ids = array('i')
+        self.offsets = array('Q', [0])
+        self.arg_ids = array('I')
+        self.line_numbers = array('I')
+
+        for operation in operations:
+            self.append(operation)
+
+    def intern(self, token):
+        """
+        Returns the symbol id of `token`, adding it to the symbols if needed.
+        """
+        symbol_id = self.symbol_ids.get(token)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbol_ids[token] = symbol_id
+            self.symbols.append(token)
+        return symbol_id
+
+    def encode(self, operation):
+        """
+        Returns the OPCODE id and argument symbol ids of an operation given
+        as a tuple of strings.
+        """
+        op_code, *args = operation
+        op_id = OP_CODE_IDS.get(op_code)
+        if op_id is None:
+            op_id = -(self.intern(op_code) + 1)
+        return op_id, array('I', [self.intern(arg) for arg in args])
+
+    def append(self, operation, line_number=0):
+        """
+        Appends an operation given as a tuple of strings.
+        """
+        op_id, arg_ids = self.encode(operation)
+        self.op_ids.append(op_id)
+        self.arg_ids.extend(arg_ids)
+        self.offsets.append(len(self.arg_ids))
+        self.line_numbers.append(line_number)
+
+    def insert(self, index, operation, line_number=0):
+        """
+        Inserts an operation given as a tuple of strings before `index`.
+        """
+        index = min(max(index + len(self) if index < 0 else index, 0), len(self))
+        op_id, arg_ids = self.encode(operation)
+
+        start = self.offsets[index]
+        self.op_ids.insert(index, op_id)
+        self.line_numbers.insert(index, line_number)
+        self.arg_ids[start:start] = arg_ids
+        self.offsets.insert(index + 1, start)
+        for idx in range(index + 1, len(self.offsets)):
+            self.offsets[idx] += len(arg_ids)
+
+    def op_code(self, index):
+        """
+        Returns the OPCODE of the operation at `index` as a string.
+        """
+        op_id = self.op_ids[index]
+        if op_id < 0:
+            return self.symbols[-op_id - 1]
+        return OP_CODES[op_id]
+
+    def args(self, index):
+        """
+        Returns the symbol ids of the arguments of the operation at `index`.
+        """
+        return self.arg_ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def __len__(self):
+        return len(self.op_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("operation index out of range")
+        symbols = self.symbols
+        return (self.op_code(index),) + tuple(symbols[arg_id] for arg_id in self.args(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __delitem__(self, index):
+        if index < 0:
+            index += len(self)
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        del self.op_ids[index]
+        del self.line_numbers[index]
+        del self.arg_ids[start:stop]
+        del self.offsets[index + 1]
+        for idx in range(index + 1, len(self.offsets)):
+            self.offsets[idx] -= stop - start
+
+    def index(self, operation):
+        """
+        Returns the index of the first operation equal to `operation`.
+        """
+        operation = tuple(operation)
+        for index, other in enumerate(self):
+            if other == operation:
+                return index
+        raise ValueError("{} is not in the operations".format(operation))
+
+    def remove(self, operation):
+        """
+        Removes the first operation equal to `operation`.
+        """
+        del self[self.index(operation)]
+
+    def copy(self):
+        copied = Operations()
+        copied.symbols = list(self.symbols)
+        copied.symbol_ids = dict(self.symbol_ids)
+        copied.op_ids = array('i', self.op_ids)
+        copied.offsets = array('Q', self.offsets)
+        copied.arg_ids = array('I', self.arg_ids)
+        copied.line_numbers = array('I', self.line_numbers)
+        return copied
@@ -0,0 +1,383 @@
+from collections import Counter
+
+from sputnik.analyzer import BOOTSTRAPPED_OP_CODES
+from sputnik.engine import Program
+
+
+# The negation of every lowered two input gate, for fusing a NOT into it
+NEGATED_GATES = {
+    'AND': 'NAND',
+    'OR': 'NOR',
+    'XOR': 'XNOR',
+    'NAND': 'AND',
+    'NOR': 'OR',
+    'XNOR': 'XOR',
+    'ANDNY': 'ORYN',
+    'ANDYN': 'ORNY',
+    'ORNY': 'ANDYN',
+    'ORYN': 'ANDNY',
+}
+
+
+class OptimizationReport:
+    """
+    Summary of what the optimizer changed in a program.
+    """
+
+    def __init__(self):
+        self.bootstraps_before = 0
+        self.bootstraps_after = 0
+        self.operations_before = 0
+        self.operations_after = 0
+
+        # Number of times each rewrite was applied
+        self.rewrites = Counter()
+
+    @property
+    def bootstraps_saved(self):
+        return self.bootstraps_before - self.bootstraps_after
+
+    def __repr__(self):
+        return "<OptimizationReport bootstraps {} -> {}, operations {} -> {}, {}>".format(
+            self.bootstraps_before, self.bootstraps_after,
+            self.operations_before, self.operations_after, dict(self.rewrites))
+
+
+class _Graph:
+    """
+    Hash-consed dataflow graph of a straight-line Sputnik program. Gates are
+    canonicalized into AND, OR, XOR and NOT so that equivalent expressions
+    written with different gates share a node, and constants are folded
+    through them as the graph is built.
+    """
+
+    def __init__(self, size, report):
+        self.mask = None if size is None else (1 << size) - 1
+        self.report = report
+        self.nodes = list()
+        self.index = dict()
+
+    def make(self, op, *args):
+        key = (op,) + args
+        node = self.index.get(key)
+        if node is not None:
+            if op not in ('IN', 'CONST'):
+                self.report.rewrites['cse'] += 1
+            return node
+        node = len(self.nodes)
+        self.nodes.append(key)
+        self.index[key] = node
+        return node
+
+    def const_value(self, node):
+        """
+        Returns the value of a constant node, if it can be folded.
+        """
+        op, *args = self.nodes[node]
+        if op == 'CONST' and self.mask is not None:
+            return args[0]
+        return None
+
+    def negated(self, node):
+        """
+        Returns the node negated by `node` if it's a NOT, else None.
+        """
+        op, *args = self.nodes[node]
+        if op == 'NOT':
+            return args[0]
+        return None
+
+    def const(self, value):
+        if self.mask is not None:
+            value &= self.mask
+        return self.make('CONST', value)
+
+    def folded(self, value):
+        self.report.rewrites['folded'] += 1
+        return self.const(value)
+
+    def not_(self, node):
+        inner = self.negated(node)
+        if inner is not None:
+            self.report.rewrites['folded'] += 1
+            return inner
+        value = self.const_value(node)
+        if value is not None:
+            return self.folded(~value)
+        return self.make('NOT', node)
+
+    def and_(self, left, right):
+        return self._absorbing('AND', left, right, absorbing=0)
+
+    def or_(self, left, right):
+        return self._absorbing('OR', left, right, absorbing=self.mask)
+
+    def _absorbing(self, op, left, right, absorbing):
+        # AND and OR both have an absorbing and an identity constant, and
+        # x op NOT(x) is always the absorbing constant.
+        left_value, right_value = self.const_value(left), self.const_value(right)
+        if left_value is not None and right_value is not None:
+            if op == 'AND':
+                return self.folded(left_value & right_value)
+            return self.folded(left_value | right_value)
+        for value, other in ((left_value, right), (right_value, left)):
+            if value is None:
+                continue
+            if value == absorbing:
+                return self.folded(absorbing)
+            if value == absorbing ^ self.mask:
+                self.report.rewrites['folded'] += 1
+                return other
+        if left == right:
+            self.report.rewrites['folded'] += 1
+            return left
+        if self.mask is not None and (self.negated(left) == right or self.negated(right) == left):
+            return self.folded(absorbing)
+        return self.make(op, *sorted((left, right)))
+
+    def xor_(self, left, right):
+        # Pull negations out, so XNOR and XOR with a NOT share nodes.
+        for node, other in ((left, right), (right, left)):
+            inner = self.negated(node)
+            if inner is not None:
+                return self.not_(self.xor_(inner, other))
+
+        left_value, right_value = self.const_value(left), self.const_value(right)
+        if left_value is not None and right_value is not None:
+            return self.folded(left_value ^ right_value)
+        for value, other in ((left_value, right), (right_value, left)):
+            if value == 0:
+                self.report.rewrites['folded'] += 1
+                return other
+            if value is not None and value == self.mask:
+                self.report.rewrites['folded'] += 1
+                return self.not_(other)
+        if left == right and self.mask is not None:
+            return self.folded(0)
+        return self.make('XOR', *sorted((left, right)))
+
+    def mux(self, select, when_true, when_false):
+        value = self.const_value(select)
+        if value is not None and value == self.mask:
+            self.report.rewrites['folded'] += 1
+            return when_true
+        if value == 0:
+            self.report.rewrites['folded'] += 1
+            return when_false
+        if when_true == when_false:
+            self.report.rewrites['folded'] += 1
+            return when_true
+        return self.make('MUX', select, when_true, when_false)
+
+    def shift(self, op_code, node, bits):
+        if bits < 0:
+            op_code, bits = ('SHR' if op_code == 'SHL' else 'SHL'), -bits
+        if bits == 0:
+            self.report.rewrites['folded'] += 1
+            return node
+        value = self.const_value(node)
+        if value is not None:
+            if op_code == 'SHL':
+                return self.folded(value << bits)
+            return self.folded(value >> bits)
+        return self.make(op_code, node, bits)
+
+    def gate(self, op_code, args):
+        """
+        Returns the canonical node for the gate `op_code` over `args` nodes.
+        """
+        if op_code == 'NOT':
+            return self.not_(*args)
+        if op_code == 'MUX':
+            return self.mux(*args)
+
+        left, right = args
+        if op_code == 'AND':
+            return self.and_(left, right)
+        if op_code == 'OR':
+            return self.or_(left, right)
+        if op_code == 'XOR':
+            return self.xor_(left, right)
+        if op_code == 'NAND':
+            return self.not_(self.and_(left, right))
+        if op_code == 'NOR':
+            return self.not_(self.or_(left, right))
+        if op_code == 'XNOR':
+            return self.not_(self.xor_(left, right))
+        if op_code == 'ANDNY':
+            return self.and_(self.not_(left), right)
+        if op_code == 'ANDYN':
+            return self.and_(left, self.not_(right))
+        if op_code == 'ORNY':
+            return self.or_(self.not_(left), right)
+        if op_code == 'ORYN':
+            return self.or_(left, self.not_(right))
+        raise SyntaxError("{} can't be optimized".format(op_code))
+
+    def lower(self, node):
+        """
+        Returns the OPCODE and operand nodes that compute `node`, fusing NOT
+        operands into ANDNY/ANDYN/ORNY/ORYN/NAND/NOR.
+        """
+        op, *args = self.nodes[node]
+        if op == 'CONST':
+            return 'CONST', ()
+        if op in ('SHL', 'SHR'):
+            return op, (args[0],)
+        if op not in ('AND', 'OR'):
+            return op, tuple(args)
+
+        left, right = args
+        left_inner, right_inner = self.negated(left), self.negated(right)
+        if left_inner is not None and right_inner is not None:
+            return ('NOR' if op == 'AND' else 'NAND'), (left_inner, right_inner)
+        if left_inner is not None:
+            return op + 'NY', (left_inner, right)
+        if right_inner is not None:
+            return op + 'YN', (left, right_inner)
+        return op, (left, right)
+
+
+def optimize(program):
+    """
+    Optimizes the straight-line part of `program` between EXEC and EXIT and
+    returns a new Program along with an `OptimizationReport`.
+
+    The pass performs common-subexpression elimination, dead-code
+    elimination (only STATE at EXIT is kept alive), fusion of negations into
+    the ANDNY/ANDYN/ORNY/ORYN/NAND/NOR gates and constant folding through
+    CONST. Programs that HALT or RECOVER before EXIT are returned unchanged,
+    since every variable is observable there, and so are programs that SLICE
+    or CONCAT, whose words aren't all SIZE bits wide.
+    """
+    if program.bytecode is None:
+        program.compile()
+
+    report = OptimizationReport()
+    operations = program.operations
+    entrance = program.find_entrance()
+
+    exit_index = None
+    size = None
+    for op_index in range(entrance, len(operations)):
+        op_code = operations[op_index][0]
+        if op_code == 'SIZE':
+            size = int(operations[op_index][1])
+        if op_code in ('EXIT', 'HALT', 'RECOVER'):
+            exit_index = op_index
+            break
+    if exit_index is None or operations[exit_index][0] != 'EXIT':
+        return program, report
+    if any(operations[op_index][0] in ('SLICE', 'CONCAT')
+           for op_index in range(entrance, exit_index)):
+        return program, report
+
+    region = operations[entrance:exit_index]
+    report.operations_before = len(region)
+    report.bootstraps_before = sum(op[0] in BOOTSTRAPPED_OP_CODES for op in region)
+
+    # Build the graph
+    graph = _Graph(size, report)
+    bindings = {var_name: graph.make('IN', var_name) for var_name in region[0][1:]}
+    setup = list()
+    for op_code, *args in region[1:]:
+        if op_code in ('KEY', 'SIZE'):
+            setup.append((op_code,) + tuple(args))
+        elif op_code == 'PUSH':
+            left_name, right_name = args
+            bindings[right_name] = bindings[left_name]
+        elif op_code == 'COPY':
+            bindings['STATE'] = bindings[args[0]]
+        elif op_code == 'CONST':
+            bindings['STATE'] = graph.const(int(args[0]))
+        elif op_code in ('SHL', 'SHR'):
+            bindings['STATE'] = graph.shift(op_code, bindings[args[0]], int(args[1]))
+        else:
+            bindings['STATE'] = graph.gate(op_code, [bindings[arg] for arg in args])
+
+    # Lower the live part of the graph, from the output backwards
+    output = bindings.get('STATE')
+    lowered = dict()
+    uses = Counter()
+    for node in range(len(graph.nodes) - 1, -1, -1):
+        if node != output and uses[node] == 0:
+            continue
+        if graph.nodes[node][0] == 'IN':
+            continue
+        lowered[node] = graph.lower(node)
+        for operand in lowered[node][1]:
+            uses[operand] += 1
+
+    # Fuse a NOT into the gate it negates, if it's the gate's only user
+    for node in sorted(lowered):
+        op_code, operands = lowered[node]
+        if op_code != 'NOT':
+            continue
+        inner, = operands
+        if inner == output or uses[inner] != 1 or inner not in lowered:
+            continue
+        inner_op_code, inner_operands = lowered[inner]
+        if inner_op_code not in NEGATED_GATES:
+            continue
+        lowered[node] = (NEGATED_GATES[inner_op_code], inner_operands)
+        del lowered[inner]
+        report.rewrites['fused'] += 1
+
+    # Emit the lowered nodes. Each one leaves its result in STATE, which is
+    # PUSHed to a temporary unless the very next operation consumes it. An
+    # output that is an entrance variable is COPYed to STATE instead, so
+    # STATE doesn't alias the caller's ciphertext.
+    order = sorted(lowered)
+    position = {node: idx for idx, node in enumerate(order)}
+    consumers = dict()
+    for node in order:
+        for operand in lowered[node][1]:
+            consumers.setdefault(operand, set()).add(position[node])
+
+    temporaries = dict()
+    for idx, node in enumerate(order):
+        is_late_output = node == output and idx != len(order) - 1
+        if consumers.get(node, {idx + 1}) != {idx + 1} or is_late_output:
+            temporaries[node] = _temporary_name(program, node)
+
+    def ref(node, state):
+        op, *args = graph.nodes[node]
+        if op == 'IN':
+            return args[0]
+        if node == state:
+            return 'STATE'
+        return temporaries[node]
+
+    optimized = [operations[entrance]] + setup
+    state = None
+    for node in order:
+        op_code, operands = lowered[node]
+        if op_code == 'CONST':
+            optimized.append(('CONST', str(graph.nodes[node][1])))
+        elif op_code in ('SHL', 'SHR'):
+            optimized.append((op_code, ref(operands[0], state), str(graph.nodes[node][2])))
+        else:
+            optimized.append((op_code,) + tuple(ref(operand, state) for operand in operands))
+        state = node
+        if node in temporaries:
+            optimized.append(('PUSH', 'STATE', temporaries[node]))
+    if output is not None and graph.nodes[output][0] == 'IN':
+        optimized.append(('COPY', ref(output, state)))
+    elif output is not None and output != state:
+        optimized.append(('PUSH', ref(output, state), 'STATE'))
+
+    report.operations_after = len(optimized)
+    report.bootstraps_after = sum(op[0] in BOOTSTRAPPED_OP_CODES for op in optimized)
+
+    operations = operations[:entrance] + optimized + operations[exit_index:]
+    return Program(operations), report
+
+
+def _temporary_name(program, node):
+    """
+    Returns a variable name for `node` that the program doesn't use.
+    """
+    var_name = '_t{}'.format(node)
+    while var_name in program.slots:
+        var_name = '_' + var_name
+    return var_name
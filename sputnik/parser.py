@@ -1,4 +1,7 @@
 from sputnik.engine import Program
+from sputnik.macros import MACROS, expand_macro
+from sputnik.operands import expand_operands
+from sputnik.operations import Operations
 
 
 class Parser:
@@ -6,29 +9,64 @@ class Parser:
     Sputnik parser to parse .sputnik files and format opcodes into a more useful
     format for machine reading.
 
+    The file is read line by line into compact `Operations`, so only one
+    copy of the program, with every name interned, is held in memory.
+    Arithmetic macros, like `ADD a b`, are expanded into plain operations
+    over the SIZE set before them (see `sputnik.macros`), and bit-range and
+    concatenation operands, like `a[0:8]`, into SLICE and CONCAT (see
+    `sputnik.operands`).
+
     TODO:
         - Any pre-processing?
-        - Is there a better way to parse? Probably. Is it more complex? Probably.
     """
 
     def __init__(self, file_path: str):
         # TODO: If there is any pre-processing stuff, do it here.
-        # Open the file, parse the contents into a digestable format
+        self.file_path = file_path
+        self.operations = Operations()
+        size = None
         with open(file_path, 'r') as f:
-            # Structure the raw data into lines
-            self.raw_data = f.read()
-            self.lines = self.raw_data.split('\n')[:-1]
-
-            # Format each line as a tuple-structured operation
-            self.operations = list()
-            for line in self.lines:
+            for line_number, line in enumerate(f, 1):
+                line = line.rstrip('\n')
                 # Skip lines that begin with `;` -- they're comments
                 if line.startswith(';'):
                     continue
                 # Skip lines that are empty - Hacky af
                 if len(line) == 0:
                     continue
-                self.operations.append(tuple(line.split(' ')))
+                operation = tuple(line.split(' '))
+                op_code, *args = operation
+                if op_code == 'SIZE' and len(args) == 1 and args[0].isdigit():
+                    size = int(args[0])
+
+                prefix = '{}@{}'.format(op_code, line_number)
+                try:
+                    arity = MACROS[op_code][0] if op_code in MACROS else None
+                    *expansion, operation = expand_operands(operation, prefix, arity)
+                    if op_code in MACROS:
+                        expansion += expand_macro(op_code, operation[1:], size, prefix)
+                    else:
+                        expansion.append(operation)
+                except SyntaxError as error:
+                    raise SyntaxError("Line {} `{}`: {}".format(line_number, line, error.msg))
+                for expanded in expansion:
+                    self.operations.append(expanded, line_number)
+
+    @property
+    def raw_data(self):
+        """
+        Returns the contents of the parsed file. It's read again on access,
+        as the parser doesn't keep it.
+        """
+        with open(self.file_path, 'r') as f:
+            return f.read()
+
+    @property
+    def lines(self):
+        """
+        Returns the lines of the parsed file, read again on access.
+        """
+        return self.raw_data.split('\n')[:-1]
 
     def get_program(self):
         """
@@ -0,0 +1,180 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+from sputnik.backends import TransferCounter
+
+
+class Profiler:
+    """
+    Records where the time of a Sputnik execution goes, per operation.
+
+    The device is synchronized before and after every profiled operation, so
+    its work isn't attributed to a neighbour. The time until the handler
+    returns is the host overhead of issuing the operation; the time spent
+    waiting for the device afterwards is its device time. Profiling
+    therefore serializes execution, and totals are higher than unprofiled.
+
+    Merkle hashing runs on worker threads, so it's recorded as separate spans
+    rather than charged to the gates that queued it. Bytes moved are counted
+    by the backend's transfer methods, in both directions: the copies queued
+    for the trace, input uploads, checkpoints and key loads alike. Those
+    made outside any operation, like uploading the inputs before the
+    program runs, only show in the totals.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.backend = None
+        self.merkle = None
+        self.transfers = None
+
+        # Counter values when profiling started
+        self._transfers_origin = (0, 0)
+
+        # (name, op_index, start, host seconds, device seconds, bytes to
+        # host, bytes to device)
+        self.events = list()
+
+    def attach(self, backend, merkle):
+        """
+        Starts profiling an engine's `backend` and merkle-tree pipeline.
+        """
+        self.backend = backend
+        self.merkle = merkle
+        if merkle.spans is None:
+            merkle.spans = list()
+        if backend.transfers is None:
+            backend.transfers = TransferCounter()
+        self.transfers = backend.transfers
+        self._transfers_origin = (self.transfers.to_host, self.transfers.to_device)
+
+    def profile(self, name, op_index, call, *args, **kwargs):
+        """
+        Calls `call` with the given arguments and records it as operation
+        `name` at `op_index`. Returns whatever `call` returns.
+        """
+        backend = self.backend
+        transfers = self.transfers
+        backend.synchronize()
+        to_host, to_device = transfers.to_host, transfers.to_device
+
+        start = time.perf_counter()
+        result = call(*args, **kwargs)
+        issued = time.perf_counter()
+        backend.synchronize()
+        end = time.perf_counter()
+
+        self.events.append((name, op_index, start, issued - start, end - issued,
+                            transfers.to_host - to_host, transfers.to_device - to_device))
+        return result
+
+    def summary(self):
+        """
+        Returns the totals per OPCODE, as an ordered dict of dicts with the
+        number of `calls`, `host` and `device` seconds and `bytes` moved,
+        split into `to_host` and `to_device`, the most expensive OPCODE
+        first.
+        """
+        totals = dict()
+        for name, _, _, host, device, to_host, to_device in self.events:
+            total = totals.setdefault(name, {'calls': 0, 'host': 0.0, 'device': 0.0, 'bytes': 0,
+                                             'to_host': 0, 'to_device': 0})
+            total['calls'] += 1
+            total['host'] += host
+            total['device'] += device
+            total['bytes'] += to_host + to_device
+            total['to_host'] += to_host
+            total['to_device'] += to_device
+        return OrderedDict(sorted(totals.items(),
+                                  key=lambda item: item[1]['host'] + item[1]['device'],
+                                  reverse=True))
+
+    @property
+    def merkle_seconds(self):
+        """
+        Returns the time the merkle-tree workers spent hashing.
+        """
+        if self.merkle is None or not self.merkle.spans:
+            return 0.0
+        return sum(end - start for start, end, _, _ in self.merkle.spans)
+
+    @property
+    def bytes_to_host(self):
+        """
+        Returns the bytes copied to host memory since profiling started.
+        """
+        if self.transfers is None:
+            return 0
+        return self.transfers.to_host - self._transfers_origin[0]
+
+    @property
+    def bytes_to_device(self):
+        """
+        Returns the bytes copied to the device since profiling started.
+        """
+        if self.transfers is None:
+            return 0
+        return self.transfers.to_device - self._transfers_origin[1]
+
+    def format_summary(self):
+        """
+        Returns the summary as a text table.
+        """
+        lines = ["{:<10} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+                 'OPCODE', 'calls', 'total ms', 'host ms', 'device ms', 'bytes')]
+        for name, total in self.summary().items():
+            lines.append("{:<10} {:>8} {:>12.3f} {:>12.3f} {:>12.3f} {:>12}".format(
+                         name, total['calls'], (total['host'] + total['device']) * 1000,
+                         total['host'] * 1000, total['device'] * 1000, total['bytes']))
+        lines.append("Merkle hashing: {:.3f} ms on worker threads".format(
+                     self.merkle_seconds * 1000))
+        lines.append("Transfers: {} bytes to host, {} bytes to device in total".format(
+                     self.bytes_to_host, self.bytes_to_device))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """
+        Returns the recorded operations and merkle hashing spans in the
+        Chrome trace event format, for chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = list()
+        for name, op_index, start, host, device, to_host, to_device in self.events:
+            events.append({
+                'name': name,
+                'cat': 'operation',
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': (host + device) * 1e6,
+                'pid': pid,
+                'tid': 0,
+                'args': {
+                    'op_index': op_index,
+                    'host_us': host * 1e6,
+                    'device_us': device * 1e6,
+                    'bytes_to_host': to_host,
+                    'bytes_to_device': to_device,
+                },
+            })
+        spans = self.merkle.spans if self.merkle is not None and self.merkle.spans else ()
+        for start, end, thread_id, leaves in spans:
+            events.append({
+                'name': 'merkle',
+                'cat': 'merkle',
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': pid,
+                'tid': thread_id,
+                'args': {'leaves': leaves},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the Chrome trace JSON to `path`.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
@@ -0,0 +1,80 @@
+from sputnik.compiler import get_signature
+from sputnik.opcodes import GATE_OP_CODES
+
+
+# Operations that only move references around and can be resolved while
+# building the schedule, without touching the device.
+ALIAS_OP_CODES = ('PUSH',)
+
+
+class Schedule:
+    """
+    A levelized view of a straight-line block of Sputnik gates.
+
+    Every gate writes STATE and `PUSH` renames values, so the program order
+    hides a lot of parallelism behind false dependencies on STATE. The
+    schedule gives every gate result its own value number, which leaves
+    only the true data dependencies. Gates are then grouped into levels
+    where every gate in a level only depends on gates in earlier levels and
+    can be launched together with the others.
+    """
+
+    def __init__(self, operations, start):
+        """
+        Builds the schedule for the block of operations beginning at `start`.
+        The block ends at the first operation that is neither a gate nor an
+        alias, which is left for the interpreter to execute.
+        """
+        self.start = start
+        self.gates = list()
+        self.levels = list()
+
+        # Maps a variable name to the value it holds at the current point in
+        # the block. Values are either an int (index of the producing gate in
+        # `self.gates`) or a str (a variable as it was before the block).
+        self.bindings = dict()
+
+        depths = list()
+        op_index = start
+        while op_index < len(operations):
+            op_code, *args = operations[op_index]
+            if op_code in ALIAS_OP_CODES:
+                left_name, right_name = args
+                self.bindings[right_name] = self._resolve(left_name)
+            elif op_code in GATE_OP_CODES:
+                get_signature(op_code, args)
+                inputs = tuple(self._resolve(arg) for arg in args)
+                depth = 1 + max((depths[value] for value in inputs
+                                 if isinstance(value, int)), default=-1)
+                gate_id = len(self.gates)
+                self.gates.append((op_index, op_code, inputs))
+                depths.append(depth)
+                if depth == len(self.levels):
+                    self.levels.append(list())
+                self.levels[depth].append(gate_id)
+                self.bindings['STATE'] = gate_id
+            else:
+                break
+            op_index += 1
+        self.end = op_index
+
+    def _resolve(self, var_name):
+        """
+        Returns the value currently bound to `var_name` within the block.
+        """
+        return self.bindings.get(var_name, var_name)
+
+    @property
+    def depth(self):
+        """
+        Returns the number of gate levels, i.e. the number of sequential
+        bootstrapping rounds needed by the block.
+        """
+        return len(self.levels)
+
+
+def is_schedulable(op_code):
+    """
+    Returns True if the operation can be part of a scheduled block.
+    """
+    return op_code in GATE_OP_CODES or op_code in ALIAS_OP_CODES
@@ -0,0 +1,522 @@
+import asyncio
+import json
+import numpy
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sputnik.context import batch_shapes, default_pool
+from sputnik.engine import Program, Sputnik
+from sputnik.keystore import KeyFile
+from sputnik.parser import Parser
+
+
+# Header length. Every message is the length, a JSON header, and the raw
+# buffers of the variables the header lists, back to back.
+FRAME = struct.Struct('<I')
+
+# Latencies kept for the percentiles in the metrics
+LATENCY_WINDOW = 1024
+
+
+def encode_message(header, variables=None):
+    """
+    Returns the bytes of a message with the `header` dict and `variables`,
+    a dict of variable names to tuples of host arrays as dumped by a backend.
+    """
+    arrays = list()
+    layout = dict()
+    for var_name, var_arrays in (variables or dict()).items():
+        layout[var_name] = list()
+        for array in var_arrays:
+            array = numpy.ascontiguousarray(array)
+            layout[var_name].append({'dtype': array.dtype.str, 'shape': array.shape})
+            arrays.append(array)
+    header = dict(header, variables=layout, payload=sum(array.nbytes for array in arrays))
+    header_data = json.dumps(header).encode()
+    return b''.join([FRAME.pack(len(header_data)), header_data] +
+                    [array.data.tobytes() for array in arrays])
+
+
+def decode_variables(header, payload):
+    """
+    Returns the variables of a message as arrays over its `payload` bytes.
+    Raises ValueError if they don't match the payload.
+    """
+    variables = dict()
+    offset = 0
+    try:
+        for var_name, entries in header['variables'].items():
+            arrays = list()
+            for entry in entries:
+                dtype = numpy.dtype(entry['dtype'])
+                count = int(numpy.prod(entry['shape']))
+                array = numpy.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+                arrays.append(array.reshape(entry['shape']))
+                offset += count * dtype.itemsize
+            variables[var_name] = tuple(arrays)
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        raise ValueError("Malformed variables: {}".format(error))
+    return variables
+
+
+async def read_message(reader):
+    """
+    Reads a message from an asyncio stream. Returns the header and the
+    payload bytes, for `decode_variables`, or None if the stream ended
+    between messages.
+
+    Raises ConnectionError if the stream ends within a message, and
+    ValueError if the header can't be decoded, which leaves the rest of the
+    stream unframed.
+    """
+    try:
+        frame = await reader.readexactly(FRAME.size)
+    except asyncio.IncompleteReadError as error:
+        if not error.partial:
+            return None
+        raise ConnectionError("The stream ended within a message")
+
+    header_length, = FRAME.unpack(frame)
+    try:
+        header_data = await reader.readexactly(header_length)
+        try:
+            header = json.loads(header_data.decode())
+            payload_length = int(header['payload'])
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError("Malformed header: {}".format(error))
+        if payload_length < 0:
+            raise ValueError("Malformed header: negative payload")
+        payload = await reader.readexactly(payload_length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("The stream ended within a message")
+    return header, payload
+
+
+class Job:
+    """
+    A request to run a program once over a set of entrance variables.
+    """
+
+    def __init__(self, job_id, program_path, key_name, inputs):
+        self.id = job_id
+        self.program_path = program_path
+        self.key_name = key_name
+        self.inputs = inputs
+        self.future = asyncio.get_running_loop().create_future()
+        self.received = time.perf_counter()
+        self.started = None
+
+    @property
+    def group(self):
+        """
+        Jobs in the same group can run batched: they share a program and key,
+        and their inputs have the same shapes and dtypes, so a job with inputs
+        of another dtype fails on its own instead of failing its batch.
+        """
+        layout = tuple(sorted(
+            (var_name, tuple((array.dtype.str, array.shape) for array in arrays))
+            for var_name, arrays in self.inputs.items()))
+        return (self.program_path, self.key_name, layout)
+
+
+class Server:
+    """
+    A job daemon that keeps engines, compiled programs and bootstrapping
+    keys resident, serving jobs over a Unix socket.
+
+    Jobs name a program file and, optionally, a key by the name it's
+    registered under in `keys`, a dict of names to key files; the server
+    never loads keys its clients point it at. Both are read once and kept.
+    Jobs that arrive within `batch_window` seconds of
+    each other and share a program, key and input shapes are merged into one
+    `Sputnik.execute_batch` call of at most `max_batch` jobs, so every gate
+    runs once for all of them. Engines run on a single thread, off the event
+    loop, so new jobs are read and results are written while gates run.
+
+    At most `max_queue` jobs are queued or running at once. Beyond that the
+    server stops reading from its connections until jobs complete, so
+    clients block on sending instead of the queue growing without bounds.
+
+    Every job is answered with its own merkle root, the one executing it on
+    its own gives, even when it ran batched with others.
+
+    Engines launch gates with the settings `autotuner` picks for the shape
+    of every batch, if given, and share `gate_cache`, a
+    `sputnik.gatecache.GateCache`, so jobs repeating gates over the same
+    ciphertexts skip their bootstraps.
+
+    Before listening, the server compiles the gate kernels for every
+    registered key and every word size in `warmup_sizes`, alone and in
+    batches of up to `max_batch`, so the first jobs don't pay for it.
+    """
+
+    def __init__(self, path, backend=None, schedule=False, max_batch=16, max_queue=256,
+                 batch_window=0.002, autotuner=None, gate_cache=None, keys=None,
+                 warmup_sizes=()):
+        self.path = path
+        self.key_paths = dict(keys or dict())
+        self.warmup_sizes = tuple(warmup_sizes)
+        self.backend = backend
+        self.autotuner = autotuner
+        self.gate_cache = gate_cache
+        self.schedule = schedule
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.batch_window = batch_window
+
+        # Resident parsed programs, key files and engines
+        self.programs = dict()
+        self.keys = dict()
+        self.engines = dict()
+
+        # Group -> deque of queued jobs, the oldest group first
+        self._groups = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._loop = None
+        self._stopped = None
+        self._wakeup = None
+        self._slots = None
+        self._ready = threading.Event()
+
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._queue_waits = deque(maxlen=LATENCY_WINDOW)
+
+    def serve(self):
+        """
+        Runs the server until `stop` is called.
+        """
+        asyncio.run(self.serve_forever())
+
+    async def serve_forever(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_queue)
+        if self.backend is None:
+            self.backend = default_pool().shared()
+        await self._loop.run_in_executor(self._executor, self._warmup)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        dispatcher = asyncio.ensure_future(self._dispatch())
+        self._ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            dispatcher.cancel()
+            server.close()
+            await server.wait_closed()
+            self._executor.shutdown()
+            for engine in self.engines.values():
+                engine.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _warmup(self):
+        shapes = batch_shapes([(size,) for size in self.warmup_sizes],
+                              range(1, self.max_batch + 1))
+        for key_name in self.key_paths:
+            key = self._load_key(key_name).load(self.backend)
+            for shape in shapes:
+                self.backend.warmup(key, shape)
+
+    def _load_key(self, key_name):
+        key_file = self.keys.get(key_name)
+        if key_file is None:
+            key_file = self.keys[key_name] = KeyFile(self.key_paths[key_name])
+        return key_file
+
+    def wait_ready(self, timeout=None):
+        """
+        Waits until the server listens on its socket.
+        """
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        """
+        Stops the server. Safe to call from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def metrics(self):
+        """
+        Returns the queue depth, job counts and latency percentiles, in
+        seconds, of the most recent jobs, and the gate cache counters.
+        """
+        def percentiles(values):
+            if not values:
+                return {'p50': None, 'p95': None, 'p99': None}
+            values = numpy.array(values)
+            return {'p50': float(numpy.percentile(values, 50)),
+                    'p95': float(numpy.percentile(values, 95)),
+                    'p99': float(numpy.percentile(values, 99))}
+
+        gate_cache = None
+        if self.gate_cache is not None:
+            gate_cache = dict(self.gate_cache.stats.as_dict(), bytes=self.gate_cache.used_bytes)
+        return {
+            'gate_cache': gate_cache,
+            'queue_depth': self.queue_depth,
+            'peak_queue_depth': self.peak_queue_depth,
+            'completed': self.completed,
+            'failed': self.failed,
+            'batches': self.batches,
+            'mean_batch_size': (self.completed + self.failed) / self.batches if self.batches else 0.0,
+            'latency': percentiles(self._latencies),
+            'queue_wait': percentiles(self._queue_waits),
+        }
+
+    async def _handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        responses = set()
+        try:
+            while True:
+                try:
+                    message = await read_message(reader)
+                except ConnectionError:
+                    break
+                except ValueError as error:
+                    # The rest of the stream can't be framed
+                    await self._reply(writer, lock, {'id': None, 'status': 'error',
+                                                     'error': str(error)})
+                    break
+                if message is None:
+                    break
+                header, payload = message
+
+                if header.get('type') == 'metrics':
+                    await self._reply(writer, lock, {'id': header.get('id'), 'status': 'ok',
+                                                     'metrics': self.metrics()})
+                    continue
+
+                # The message was framed, so only this job is rejected if
+                # anything is wrong with it
+                program_path, key_name = header.get('program'), header.get('key')
+                error = None
+                if not isinstance(program_path, str):
+                    error = "The job names no program"
+                elif key_name is not None and key_name not in self.key_paths:
+                    error = "No key registered as {}".format(key_name)
+                else:
+                    try:
+                        variables = decode_variables(header, payload)
+                    except ValueError as decode_error:
+                        error = str(decode_error)
+                if error is not None:
+                    await self._reply(writer, lock, {'id': header.get('id'), 'status': 'error',
+                                                     'error': error})
+                    continue
+
+                # Backpressure: stop reading while the queue is full
+                await self._slots.acquire()
+                try:
+                    job = Job(header.get('id'), program_path, key_name, variables)
+                    self._enqueue(job)
+                    response = asyncio.ensure_future(self._respond(job, writer, lock))
+                except BaseException:
+                    self._slots.release()
+                    raise
+                responses.add(response)
+                response.add_done_callback(responses.discard)
+            if responses:
+                await asyncio.wait(list(responses))
+        finally:
+            writer.close()
+
+    async def _reply(self, writer, lock, header, variables=None):
+        async with lock:
+            writer.write(encode_message(header, variables))
+            await writer.drain()
+
+    def _enqueue(self, job):
+        self._groups.setdefault(job.group, deque()).append(job)
+        self.queue_depth += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        self._wakeup.set()
+
+    async def _respond(self, job, writer, lock):
+        try:
+            try:
+                state, root = await job.future
+                header = {'id': job.id, 'status': 'ok', 'merkle_root': root}
+                variables = None if state is None else {'STATE': state}
+            except Exception as error:
+                header = {'id': job.id, 'status': 'error', 'error': str(error)}
+                variables = None
+            await self._reply(writer, lock, header, variables)
+        finally:
+            self._slots.release()
+
+    async def _dispatch(self):
+        while True:
+            while not self._groups:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            group, queue = next(iter(self._groups.items()))
+            if len(queue) < self.max_batch and self.batch_window:
+                # Give concurrent jobs of the group a moment to arrive
+                await asyncio.sleep(self.batch_window)
+            jobs = [queue.popleft() for _ in range(min(len(queue), self.max_batch))]
+            if queue:
+                # Let the other groups go first
+                self._groups.move_to_end(group)
+            else:
+                del self._groups[group]
+            self.queue_depth -= len(jobs)
+
+            started = time.perf_counter()
+            for job in jobs:
+                job.started = started
+            try:
+                results = await self._loop.run_in_executor(self._executor, self._run_batch,
+                                                           group, jobs)
+            except Exception as error:
+                self.failed += len(jobs)
+                for job in jobs:
+                    job.future.set_exception(error)
+            else:
+                self.completed += len(jobs)
+                for job, result in zip(jobs, results):
+                    job.future.set_result(result)
+
+            self.batches += 1
+            finished = time.perf_counter()
+            for job in jobs:
+                self._latencies.append(finished - job.received)
+                self._queue_waits.append(job.started - job.received)
+
+    def _engine(self, program_path, key_name):
+        """
+        Returns the resident engine for a program and key, creating it the
+        first time.
+        """
+        engine = self.engines.get((program_path, key_name))
+        if engine is None:
+            operations = self.programs.get(program_path)
+            if operations is None:
+                operations = self.programs[program_path] = Parser(program_path).operations
+            # Engines own their Program, which they compile once and reset per batch.
+            engine = Sputnik(Program(operations), None, backend=self.backend,
+                             schedule=self.schedule, autotuner=self.autotuner,
+                             gate_cache=self.gate_cache)
+            self.engines[(program_path, key_name)] = engine
+        return engine
+
+    def _run_batch(self, group, jobs):
+        """
+        Runs a batch of jobs on the engine's thread. Returns the dumped STATE
+        and merkle root of every job.
+        """
+        program_path, key_name, _ = group
+        engine = self._engine(program_path, key_name)
+        engine.reset()
+
+        kwargs = dict()
+        key = None
+        program_key_name = engine.program.find_key_name()
+        if key_name is not None:
+            key_file = self._load_key(key_name)
+            key = key_file.load(self.backend)
+            if program_key_name is not None:
+                kwargs[program_key_name] = key_file
+
+        batch = [{var_name: self.backend.load(key, arrays)
+                  for var_name, arrays in job.inputs.items()} for job in jobs]
+        exec_condition = engine.execute_batch(batch, **kwargs)
+        if not engine.program.is_killed:
+            raise RuntimeError("The program halted")
+
+        states, _ = exec_condition
+        roots = [tree.get_merkle_root() for tree in engine.merkle.job_trees]
+        return [(None if state is None else self.backend.dump(state), root)
+                for state, root in zip(states, roots)]
+
+
+class Client:
+    """
+    A blocking client for a `Server`. Jobs can be submitted ahead of
+    collecting their results, to have several of them in flight.
+    """
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self._file = self.socket.makefile('rb')
+        self._next_id = 0
+        self._results = dict()
+
+    def submit(self, program_path, inputs, key_name=None):
+        """
+        Sends a job running the program at `program_path` over `inputs`, a
+        dict of variable names to host arrays as dumped by a backend, with
+        the key the server has registered as `key_name`. Returns the job id.
+        """
+        job_id = self._next_id
+        self._next_id += 1
+        header = {'type': 'run', 'id': job_id, 'program': program_path, 'key': key_name}
+        self.socket.sendall(encode_message(header, inputs))
+        return job_id
+
+    def result(self, job_id):
+        """
+        Waits for the job `job_id` and returns its dumped STATE and the
+        merkle root of its execution. Raises RuntimeError if the job failed.
+        """
+        while job_id not in self._results:
+            header, variables = self._receive()
+            self._results[header['id']] = (header, variables)
+        header, variables = self._results.pop(job_id)
+        if header['status'] != 'ok':
+            raise RuntimeError(header['error'])
+        return variables.get('STATE'), header['merkle_root']
+
+    def run(self, program_path, inputs, key_name=None):
+        """
+        Runs a job and returns its dumped STATE and merkle root.
+        """
+        return self.result(self.submit(program_path, inputs, key_name))
+
+    def metrics(self):
+        """
+        Returns the server's metrics.
+        """
+        self.socket.sendall(encode_message({'type': 'metrics', 'id': 'metrics'}))
+        while 'metrics' not in self._results:
+            header, variables = self._receive()
+            self._results[header['id']] = (header, variables)
+        header, _ = self._results.pop('metrics')
+        return header['metrics']
+
+    def close(self):
+        self._file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _receive(self):
+        header_length, = FRAME.unpack(self._read(FRAME.size))
+        header = json.loads(self._read(header_length).decode())
+        return header, decode_variables(header, self._read(header['payload']))
+
+    def _read(self, size):
+        data = self._file.read(size)
+        if len(data) != size:
+            raise ConnectionError("The server closed the connection")
+        return data
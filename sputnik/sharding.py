@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sputnik.backends import NufheBackend
+from sputnik.keystore import KeyFile, resolve_key
+
+
+# Per-process state of a shard worker, set up once by `_init_worker`
+_worker = dict()
+
+
+def shard_ranges(size, shards):
+    """
+    Splits `size` bits into at most `shards` contiguous, non-empty
+    `(start, stop)` ranges of nearly equal width.
+    """
+    shards = max(1, min(shards, size))
+    width, extra = divmod(size, shards)
+    ranges = list()
+    start = 0
+    for shard in range(shards):
+        stop = start + width + (shard < extra)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+class ShardPool:
+    """
+    A pool of worker processes for running a program sharded by bits.
+
+    Every Sputnik gate is bitwise, so the bits of STATE can be split into
+    independent ranges and computed by different processes, each with its
+    own backend. Every worker creates its backend and loads the
+    bootstrapping key once, when it starts, and then runs any number of
+    shards. A `sputnik.keystore.KeyFile` is mapped by every worker rather
+    than sent to it.
+    """
+
+    def __init__(self, bootstrapping_key, workers=None, backend=NufheBackend):
+        """
+        Starts `workers` processes, by default one per CPU core, running
+        gates with the `backend` class and the given bootstrapping key.
+        """
+        self.backend = backend()
+        self.workers = workers or os.cpu_count()
+        self.key = resolve_key(bootstrapping_key, self.backend)
+
+        if bootstrapping_key is None or isinstance(bootstrapping_key, KeyFile):
+            key_data = bootstrapping_key
+        else:
+            key_data = self.backend.dump_key(bootstrapping_key)
+        # Workers are spawned, as forking would share the parent's device context.
+        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker,
+                                         initargs=(backend, key_data))
+
+    def map(self, shards):
+        """
+        Runs every `(operations, bits, inputs, kwargs, trace, trace_every)`
+        shard in the workers and returns their results in order.
+        """
+        return list(self._pool.map(_run_shard, shards))
+
+    def map_with(self, function, items):
+        """
+        Calls `function(backend, key, item)` in the workers for every item,
+        with each worker's backend and key, and returns the results in
+        order. `function` must be importable by the workers.
+        """
+        return list(self._pool.map(_call_with_worker, [(function, item) for item in items]))
+
+    def shutdown(self):
+        """
+        Stops the worker processes.
+        """
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def _init_worker(backend, key_data):
+    _worker['backend'] = backend()
+    backend = _worker['backend']
+    if key_data is None or isinstance(key_data, KeyFile):
+        _worker['key'] = resolve_key(key_data, backend)
+    else:
+        _worker['key'] = backend.load_key(key_data)
+
+
+def _call_with_worker(work):
+    function, item = work
+    return function(_worker['backend'], _worker['key'], item)
+
+
+def _run_shard(shard):
+    # Imported here, as the engine imports this module.
+    from sputnik.engine import Program, Sputnik
+
+    operations, bits, inputs, kwargs, trace, trace_every = shard
+    backend = _worker['backend']
+    key = _worker['key']
+
+    program = Program(operations)
+    program.compile()
+    key_name = program.find_key_name()
+    if key_name is not None and key is not None:
+        kwargs = dict(kwargs, **{key_name: key})
+    for var_name, arrays in inputs.items():
+        kwargs[var_name] = backend.load(key, arrays)
+
+    with Sputnik(program, key, backend=backend, trace=trace, trace_every=trace_every,
+                 bits=bits) as engine:
+        state, merkle = engine.execute_program(**kwargs)
+    return (None if state is None else backend.dump(state)), merkle.get_merkle_root()
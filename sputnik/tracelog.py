@@ -0,0 +1,149 @@
+import mmap
+import numpy
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from sputnik.merkle import hash_leaf
+from sputnik.opcodes import GATE_OP_CODES, OP_CODES, SIGNATURES
+from sputnik.wire import (ALIGNMENT, align_file, check_file_header, read_ciphertext,
+                          read_footer, write_arrays, write_file_header, write_footer)
+
+
+MAGIC = b'SPTNKLOG'
+VERSION = 2
+
+
+class TraceLogWriter:
+    """
+    Records every leaf of the merkle-tree to a leaf log file: the OPCODE of
+    the gate, its index among the executed gates and the host copies of its
+    input and result ciphertexts, exactly as they were hashed. With the log,
+    a committed root can be recomputed and any gate re-executed, see
+    `sputnik.verifier`.
+
+    The log is a `sputnik.wire` container file, and every ciphertext is
+    stored in the wire format. Leaves are written in order on a thread of
+    their own, and `close` appends an index of the leaves and a footer
+    pointing at it, with the leaf count as its length. The log is written
+    next to `path` and only renamed to it once closed, so readers never see
+    a log that is being written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._temp_path = path + '.tmp'
+        self._file = open(self._temp_path, 'wb')
+        write_file_header(self._file, MAGIC, VERSION)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._writes = list()
+
+        self.op_ids = array('B')
+        self.gate_indices = array('Q')
+        self.offsets = array('Q')
+
+    def append(self, batch):
+        """
+        Queues a batch of hashed `(op_id, buffers, gate_index, shapes)`
+        leaves to be written.
+        """
+        self._writes.append(self._writer.submit(self._write, batch))
+        # Surface write errors early, and don't keep finished writes around.
+        while self._writes and self._writes[0].done():
+            self._writes.pop(0).result()
+
+    def flush(self):
+        """
+        Waits for queued leaves to be written.
+        """
+        if self._file is None:
+            return
+        writes, self._writes = self._writes, list()
+        for write in writes:
+            write.result()
+        self._file.flush()
+
+    def close(self):
+        """
+        Waits for queued leaves, writes the index and closes the file.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._writer.shutdown()
+
+        f = self._file
+        index_offset = align_file(f)
+        for index in (self.op_ids, self.gate_indices, self.offsets):
+            align_file(f)
+            f.write(index.tobytes())
+        write_footer(f, index_offset, len(self.op_ids), MAGIC)
+        f.close()
+        self._file = None
+        os.replace(self._temp_path, self.path)
+
+    def _write(self, batch):
+        f = self._file
+        for op_id, buffers, gate_index, shapes in batch:
+            self.op_ids.append(op_id)
+            self.gate_indices.append(gate_index)
+            self.offsets.append(align_file(f))
+            for arrays, shape in zip(buffers, shapes):
+                align_file(f)
+                write_arrays(f, [numpy.ascontiguousarray(array) for array in arrays], shape)
+
+
+class TraceLog:
+    """
+    A leaf log written by `TraceLogWriter`, memory-mapped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            check_file_header(f, MAGIC, VERSION, path, 'leaf log')
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        footer = read_footer(self.data, MAGIC)
+        if footer is None:
+            raise ValueError("{} is incomplete".format(path))
+        index_offset, leaf_count = footer
+
+        self.leaf_count = leaf_count
+        offset = index_offset
+        indices = list()
+        for dtype in (numpy.uint8, numpy.uint64, numpy.uint64):
+            offset += -offset % ALIGNMENT
+            indices.append(numpy.frombuffer(self.data, dtype=dtype, count=leaf_count,
+                                            offset=offset))
+            offset += leaf_count * numpy.dtype(dtype).itemsize
+        self.op_ids, self.gate_indices, self.offsets = indices
+
+    def __len__(self):
+        return self.leaf_count
+
+    def leaf(self, index):
+        """
+        Returns the OPCODE, gate index and ciphertext buffers of leaf
+        `index`. The buffers are a tuple of host arrays per ciphertext, the
+        result last, as arrays over the mapping. Raises ValueError if the
+        leaf isn't a gate.
+        """
+        op_id = int(self.op_ids[index])
+        op_code = OP_CODES[op_id] if op_id < len(OP_CODES) else None
+        if op_code not in GATE_OP_CODES:
+            raise ValueError("Leaf {} has OPCODE id {}, which isn't a gate".format(index, op_id))
+        offset = int(self.offsets[index])
+        buffers = list()
+        for _ in range(len(SIGNATURES[op_code]) + 1):
+            offset += -offset % ALIGNMENT
+            _, arrays, offset = read_ciphertext(self.data, offset)
+            buffers.append(tuple(arrays))
+        return op_code, int(self.gate_indices[index]), buffers
+
+    def digest(self, index):
+        """
+        Returns the leaf digest of leaf `index`, recomputed from its buffers.
+        """
+        _, _, buffers = self.leaf(index)
+        return hash_leaf(int(self.op_ids[index]), buffers)
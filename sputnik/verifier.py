@@ -0,0 +1,171 @@
+"""
+Audits an execution from its leaf log, written with the engine's
+`trace_log`, against a committed merkle root.
+
+The root is recomputed from the logged ciphertexts, and the leaves are
+checked against the gates of the program. A random sample of leaves is
+then checked in depth: an inclusion proof for each one is verified
+against the root, and its gate is executed again from the logged inputs
+and must give the logged result. Hashing is cheap next to bootstrapping,
+so auditing a sample of gates costs a fraction of running them all.
+"""
+import math
+import numpy
+import os
+
+from sputnik.engine import result_shape
+from sputnik.merkle import MerkleTree, verify_proof
+from sputnik.opcodes import GATE_OP_CODES, OP_CODE_IDS
+from sputnik.tracelog import TraceLog
+
+
+# Leaf logs opened by this process, by path, with the identity of the file
+# they were opened from, so a log recorded again at the same path is opened
+# again
+_logs = dict()
+
+
+class VerificationReport:
+    """
+    The outcome of `verify`. Leaves are referred to by their index in the
+    log.
+    """
+
+    def __init__(self, leaf_count, root, expected_root):
+        self.leaf_count = leaf_count
+        self.root = root
+        self.expected_root = expected_root
+
+        # Leaves that aren't the gate the program runs at their gate index
+        self.unexpected_leaves = list()
+
+        self.proofs_checked = 0
+        self.invalid_proofs = list()
+
+        self.gates_checked = 0
+        self.invalid_gates = list()
+
+    @property
+    def root_matches(self):
+        return self.root == self.expected_root
+
+    @property
+    def ok(self):
+        return (self.root_matches and not self.unexpected_leaves and
+                not self.invalid_proofs and not self.invalid_gates)
+
+
+def program_gates(program):
+    """
+    Returns the OPCODE ids of the gates of `program` in execution order,
+    which is the order they're merkleized in.
+    """
+    return numpy.array([OP_CODE_IDS[operation[0]] for operation in program.operations
+                        if operation[0] in GATE_OP_CODES], dtype=numpy.uint8)
+
+
+def verify(program, log_path, root, pool, sample=0.01, seed=None):
+    """
+    Verifies the leaf log at `log_path` of an execution of `program`, as it
+    was executed, optimized or not, against the hex encoded merkle `root`.
+    `pool` is a `sputnik.sharding.ShardPool` holding the bootstrapping key,
+    whose workers hash leaves and execute the sampled gates again. `sample`
+    is the fraction of leaves checked in depth, at least one.
+
+    Returns a `VerificationReport`.
+    """
+    log = TraceLog(log_path)
+    leaf_count = len(log)
+
+    # Recompute the root
+    chunk = max(1, math.ceil(leaf_count / (pool.workers * 4)))
+    ranges = [(log_path, start, min(start + chunk, leaf_count))
+              for start in range(0, leaf_count, chunk)]
+    digests = [digest for digests in pool.map_with(_hash_leaves, ranges) for digest in digests]
+    # Leaves that aren't gates can't be read, and stand in the tree as zeros
+    unreadable = [index for index, digest in enumerate(digests) if digest is None]
+    digests = [bytes(32) if digest is None else digest for digest in digests]
+    tree = MerkleTree(digests)
+    report = VerificationReport(leaf_count, tree.get_merkle_root(), root)
+
+    # Match the leaves with the gates of the program
+    expected = program_gates(program)
+    gate_indices = log.gate_indices
+    in_program = gate_indices < len(expected)
+    matches = numpy.zeros(leaf_count, dtype=bool)
+    matches[in_program] = expected[gate_indices[in_program].astype(numpy.intp)] == \
+        log.op_ids[in_program]
+    # Gates are merkleized in order, each once
+    matches[1:] &= gate_indices[1:] > gate_indices[:-1]
+    matches[unreadable] = False
+    report.unexpected_leaves = [int(index) for index in numpy.flatnonzero(~matches)]
+
+    if leaf_count == 0:
+        return report
+
+    rng = numpy.random.RandomState(seed)
+    count = min(leaf_count, max(1, math.ceil(sample * leaf_count)))
+    sampled = sorted(int(index) for index in rng.choice(leaf_count, size=count, replace=False))
+
+    for index in sampled:
+        if not verify_proof(digests[index], tree.get_proof(index), root):
+            report.invalid_proofs.append(index)
+    report.proofs_checked = len(sampled)
+
+    chunk = max(1, math.ceil(len(sampled) / pool.workers))
+    batches = [(log_path, sampled[start:start + chunk])
+               for start in range(0, len(sampled), chunk)]
+    report.invalid_gates = [index for invalid in pool.map_with(_replay_gates, batches)
+                            for index in invalid]
+    report.gates_checked = len(sampled)
+    return report
+
+
+def _open_log(log_path):
+    stat = os.stat(log_path)
+    identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    cached = _logs.get(log_path)
+    if cached is None or cached[0] != identity:
+        cached = _logs[log_path] = (identity, TraceLog(log_path))
+    return cached[1]
+
+
+def _hash_leaves(backend, key, work):
+    """
+    Returns the digests of the given leaves, or None for the ones that
+    aren't gates.
+    """
+    log_path, start, stop = work
+    log = _open_log(log_path)
+    digests = list()
+    for index in range(start, stop):
+        try:
+            digests.append(log.digest(index))
+        except ValueError:
+            digests.append(None)
+    return digests
+
+
+def _replay_gates(backend, key, work):
+    """
+    Executes the gates of the given leaves again from their logged inputs.
+    Returns the leaves whose result differs from the logged one.
+    """
+    log_path, indices = work
+    log = _open_log(log_path)
+    invalid = list()
+    for index in indices:
+        try:
+            op_code, _, buffers = log.leaf(index)
+        except ValueError:
+            invalid.append(index)
+            continue
+        inputs = [backend.load_traced(key, arrays) for arrays in buffers[:-1]]
+        result = backend.empty(key, result_shape(inputs))
+        backend.gate(key, op_code, result, *inputs)
+        computed = backend.to_host_async(result)
+        backend.synchronize()
+        if len(computed) != len(buffers[-1]) or not all(
+                numpy.array_equal(array, logged) for array, logged in zip(computed, buffers[-1])):
+            invalid.append(index)
+    return invalid
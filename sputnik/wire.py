@@ -0,0 +1,226 @@
+import json
+import mmap
+import numpy
+import struct
+
+
+MAGIC = b'SPTNKCTX'
+VERSION = 1
+
+# Buffers are aligned so they can be mapped straight into numpy arrays.
+ALIGNMENT = 64
+
+# Buffers are written in chunks of at most this many bytes
+CHUNK_SIZE = 1 << 20
+
+# Magic, version, header length
+HEADER = struct.Struct('<8sHI')
+
+# Sputnik files (checkpoints, key files and leaf logs) are containers of
+# aligned buffers: a FILE_HEADER with the magic and version of the file
+# type, the buffers, and a FOOTER ending the file that points at a
+# manifest or index of them. The footer repeats the magic, so incomplete
+# files and files of another type are told apart.
+
+# Magic, version
+FILE_HEADER = struct.Struct('<8sH')
+
+# Manifest offset, manifest length, magic
+FOOTER = struct.Struct('<QQ8s')
+
+
+def _align(offset):
+    return offset + (-offset % ALIGNMENT)
+
+
+def align_file(f):
+    """
+    Pads the binary file `f` with zeros up to a multiple of ALIGNMENT and
+    returns the new position.
+    """
+    f.write(b'\0' * (-f.tell() % ALIGNMENT))
+    return f.tell()
+
+
+def write_file_header(f, magic, version):
+    """
+    Starts a container file of the type `magic`.
+    """
+    f.write(FILE_HEADER.pack(magic, version))
+
+
+def check_file_header(f, magic, version, path, kind):
+    """
+    Reads the header of the container file `f`, opened at its start, and
+    raises ValueError unless it's a `kind` file of the type `magic` and
+    `version`.
+    """
+    header = f.read(FILE_HEADER.size)
+    if len(header) != FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != magic:
+        raise ValueError("{} is not a Sputnik {}".format(path, kind))
+    file_version = FILE_HEADER.unpack(header)[1]
+    if file_version != version:
+        raise ValueError("Unsupported {} version {}".format(kind, file_version))
+
+
+def write_footer(f, offset, length, magic):
+    """
+    Ends a container file of the type `magic` with a footer pointing at
+    `length` bytes at `offset`.
+    """
+    f.write(FOOTER.pack(offset, length, magic))
+
+
+def read_footer(buffer, magic):
+    """
+    Returns the `(offset, length)` of the footer ending `buffer`, or None if
+    it doesn't end with the footer of a file of the type `magic`.
+    """
+    if len(buffer) < FILE_HEADER.size + FOOTER.size:
+        return None
+    offset, length, footer_magic = FOOTER.unpack_from(buffer, len(buffer) - FOOTER.size)
+    if footer_magic != magic:
+        return None
+    return offset, length
+
+
+def write_buffers(f, arrays):
+    """
+    Writes the host `arrays` to the binary file `f`, each aligned. Returns
+    the absolute offset, dtype and shape of every buffer, for `map_buffers`.
+    """
+    entries = list()
+    for array in arrays:
+        array = numpy.ascontiguousarray(array)
+        entries.append({'offset': align_file(f), 'dtype': array.dtype.str, 'shape': array.shape})
+        _write_chunked(f, array)
+    return entries
+
+
+def map_buffers(buffer, entries, base=0):
+    """
+    Returns the buffers described by `entries`, at their offset from `base`
+    in `buffer`, as numpy arrays over it, without copying them.
+    """
+    arrays = list()
+    for entry in entries:
+        dtype = numpy.dtype(entry['dtype'])
+        count = int(numpy.prod(entry['shape']))
+        array = numpy.frombuffer(buffer, dtype=dtype, count=count, offset=base + entry['offset'])
+        arrays.append(array.reshape(entry['shape']))
+    return arrays
+
+
+def _write_chunked(f, array):
+    data = memoryview(array).cast('B')
+    for chunk_start in range(0, len(data), CHUNK_SIZE):
+        f.write(data[chunk_start:chunk_start + CHUNK_SIZE])
+
+
+def write_ciphertext(f, backend, key, ciphertext):
+    """
+    Writes `ciphertext` to the binary file `f` at its current position,
+    which should be aligned to ALIGNMENT.
+
+    A ciphertext is a small header and a JSON description with the backend,
+    its encryption parameters, the ciphertext's shape and the layout of its
+    buffers, followed by the raw, aligned buffers as `backend.dump` returns
+    them. Buffers are written in chunks straight from host memory.
+
+    Returns the absolute offset, dtype and shape of every buffer.
+    """
+    arrays = [numpy.ascontiguousarray(array) for array in backend.dump(ciphertext)]
+    return write_arrays(f, arrays, ciphertext.shape, backend.ciphertext_params(key),
+                        type(backend).__name__)
+
+
+def write_arrays(f, arrays, shape, params=None, backend=None):
+    """
+    Writes a ciphertext of `shape` from the host `arrays` dumped by a
+    backend. See `write_ciphertext`.
+    """
+    entries = list()
+    offset = 0
+    for array in arrays:
+        offset = _align(offset)
+        entries.append({
+            'offset': offset,
+            'dtype': array.dtype.str,
+            'shape': array.shape,
+        })
+        offset += array.nbytes
+    header = json.dumps({
+        'backend': backend,
+        'params': params or dict(),
+        'shape': tuple(shape),
+        'buffers': entries,
+        'length': offset,
+    }).encode()
+
+    start = f.tell()
+    f.write(HEADER.pack(MAGIC, VERSION, len(header)))
+    f.write(header)
+    data_offset = start + _align(HEADER.size + len(header))
+
+    buffers = list()
+    for entry, array in zip(entries, arrays):
+        f.write(b'\0' * (data_offset + entry['offset'] - f.tell()))
+        buffers.append(dict(entry, offset=f.tell()))
+        _write_chunked(f, array)
+    return buffers
+
+
+def read_ciphertext(buffer, offset=0):
+    """
+    Reads a ciphertext written by `write_ciphertext` at `offset` in
+    `buffer`, which can be bytes, a memoryview or a mmap. Returns the
+    ciphertext's description, its buffers as numpy arrays over `buffer`,
+    without copying them, and the offset right after it.
+    """
+    magic, version, header_length = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError("No Sputnik ciphertext at offset {}".format(offset))
+    if version != VERSION:
+        raise ValueError("Unsupported ciphertext version {}".format(version))
+    header_start = offset + HEADER.size
+    header = json.loads(bytes(buffer[header_start:header_start + header_length]).decode())
+
+    data_offset = offset + _align(HEADER.size + header_length)
+    arrays = map_buffers(buffer, header['buffers'], data_offset)
+    return header, arrays, data_offset + header['length']
+
+
+def load_ciphertext(backend, key, header, arrays):
+    """
+    Returns the ciphertext read by `read_ciphertext` as one of `backend`.
+    Raises ValueError if it was encrypted with other parameters than `key`
+    uses.
+    """
+    if header['params'] != backend.ciphertext_params(key):
+        raise ValueError("The ciphertext was encrypted with parameters {}, not {}".format(
+                         header['params'], backend.ciphertext_params(key)))
+    ciphertext = backend.load(key, arrays)
+    if tuple(ciphertext.shape) != tuple(header['shape']):
+        raise ValueError("The ciphertext buffers don't match its shape {}".format(
+                         header['shape']))
+    return ciphertext
+
+
+def save_ciphertext(path, backend, key, ciphertext):
+    """
+    Writes `ciphertext` to a file at `path`.
+    """
+    with open(path, 'wb') as f:
+        write_ciphertext(f, backend, key, ciphertext)
+
+
+def open_ciphertext(path, backend, key):
+    """
+    Returns the ciphertext in the file at `path` as one of `backend`. The
+    file is memory-mapped copy-on-write, so backends that compute on the
+    host use its pages as they are.
+    """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header, arrays, _ = read_ciphertext(data)
+    return load_ciphertext(backend, key, header, arrays)
@@ -0,0 +1,40 @@
+from sputnik.analyzer import Analysis, calibrate
+from sputnik.backends import NumpyBackend
+from sputnik.opcodes import GATE_OP_CODES
+from sputnik.parser import Parser
+
+
+def test_analyze_xor_combo():
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    analysis = Analysis(SputnikParser.get_program(), size=8)
+
+    assert analysis.histogram['PUSH'] == 3
+    assert analysis.histogram['AND'] == 2
+    assert analysis.bootstrapped == 5
+    assert analysis.bootstrap_free == 3
+    assert analysis.depth == 3
+
+    # a, b, orResult and andResult are all still needed by the second XOR
+    assert analysis.peak_live == 5
+    assert analysis.peak_live_bytes == 5 * 8 * (500 + 2) * 4
+
+
+def test_analyze_size():
+    SputnikParser = Parser('contracts/otp.sputnik')
+    analysis = Analysis(SputnikParser.get_program())
+
+    assert analysis.size == 32
+    assert analysis.depth == 1
+
+
+def test_predict_runtime():
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    analysis = Analysis(SputnikParser.get_program())
+
+    timings = {op_code: 1.0 for op_code in GATE_OP_CODES}
+    assert analysis.predict_runtime(timings) == 5.0
+    assert analysis.predict_runtime(timings, scheduled=True) == 5.0
+
+    timings = calibrate(NumpyBackend(), None, 8, repeats=1)
+    assert set(timings) == set(GATE_OP_CODES)
+    assert analysis.predict_runtime(timings, scheduled=True) <= analysis.predict_runtime(timings)
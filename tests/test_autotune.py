@@ -0,0 +1,112 @@
+import json
+import numpy
+import time
+
+from sputnik.autotune import Autotuner, TuningCache, tune
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.parser import Parser
+
+
+class TunableBackend(NumpyBackend):
+    """
+    Gates get slower the further their tuning is from the best one for the
+    shape: wide words like more work per block.
+    """
+
+    def __init__(self):
+        self.launches = list()
+
+    def tuning_candidates(self):
+        return [{'per_block': per_block} for per_block in (1, 2, 4)] + [{'broken': True}]
+
+    def gate(self, key, op_code, result, *inputs, tuning=None):
+        if tuning and tuning.get('broken'):
+            raise RuntimeError("Not supported on this device")
+        self.launches.append((tuple(result.shape), tuning))
+        if tuning is not None:
+            best = 4 if result.shape[-1] >= 16 else 1
+            time.sleep(0.002 * abs(tuning['per_block'] - best))
+        super().gate(key, op_code, result, *inputs)
+
+
+def test_tune():
+    backend = TunableBackend()
+    timings = tune(backend, None, (8,), repeats=1)
+    assert [tuning for _, tuning in timings][0] == {'per_block': 1}
+    assert len(timings) == 3
+    assert timings == sorted(timings, key=lambda timing: timing[0])
+
+    timings = tune(backend, None, (2, 32), repeats=1)
+    assert timings[0][1] == {'per_block': 4}
+
+
+def test_tuning_cache(tmp_path):
+    path = str(tmp_path / 'cache' / 'tuning.json')
+    cache = TuningCache(path)
+    assert cache.get('device', {'size': 500}, (8,)) is None
+    cache.put('device', {'size': 500}, (8,), [(0.001, {'per_block': 1}), (0.002, {})])
+    cache.save()
+
+    # Another process tunes another shape meanwhile
+    other = TuningCache(path)
+    other.put('device', {'size': 500}, (2, 8), [(0.001, {'per_block': 2})])
+    other.save()
+    cache.save()
+
+    cache = TuningCache(path)
+    assert cache.get('device', {'size': 500}, (8,)) == {'per_block': 1}
+    assert cache.get('device', {'size': 500}, (2, 8)) == {'per_block': 2}
+    assert cache.get('device', {'size': 630}, (8,)) is None
+    assert cache.get('other device', {'size': 500}, (8,)) is None
+
+    # Caches of another version are ignored
+    with open(path, 'w') as f:
+        json.dump({'version': 0, 'devices': {}}, f)
+    assert TuningCache(path).get('device', {'size': 500}, (8,)) is None
+
+
+def test_autotuner(tmp_path):
+    path = str(tmp_path / 'tuning.json')
+    backend = TunableBackend()
+    autotuner = Autotuner(TuningCache(path), repeats=1)
+    assert autotuner.select(backend, None, (32,)) == {'per_block': 4}
+    assert TuningCache(path).get('TunableBackend', {}, (32,)) == {'per_block': 4}
+
+    # Choices are remembered, without measuring again
+    backend.launches.clear()
+    assert autotuner.select(backend, None, (32,)) == {'per_block': 4}
+    assert not backend.launches
+
+    # Shapes that weren't tuned run with the defaults
+    autotuner = Autotuner(TuningCache(path), tune_missing=False)
+    assert autotuner.select(backend, None, (32,)) == {'per_block': 4}
+    assert autotuner.select(backend, None, (8,)) is None
+
+    # Backends with a single setting are never measured
+    assert Autotuner(TuningCache(path)).select(NumpyBackend(), None, (8,)) == {}
+
+
+def test_engine_autotune(tmp_path):
+    cache = TuningCache(str(tmp_path / 'tuning.json'))
+    cache.put('TunableBackend', {}, (8,), [(0.001, {'per_block': 2})])
+    cache.put('TunableBackend', {}, (2, 8), [(0.001, {'per_block': 4})])
+    autotuner = Autotuner(cache, tune_missing=False)
+
+    path = tmp_path / 'ands.sputnik'
+    path.write_text('EXEC a b c\nAND a b\nPUSH STATE x\nAND b c\nXOR x STATE\nEXIT\n')
+    rng = numpy.random.RandomState(0)
+    inputs = {var_name: rng.randint(0, 2, size=8).astype(bool) for var_name in 'abc'}
+
+    backend = TunableBackend()
+    sputnik = Sputnik(Parser(str(path)).get_program(), None, backend=backend,
+                      autotuner=autotuner)
+    sputnik.execute_program(**inputs)
+    assert backend.launches == [((8,), {'per_block': 2})] * 3
+
+    # The scheduler stacks both ANDs into one launch
+    backend = TunableBackend()
+    sputnik = Sputnik(Parser(str(path)).get_program(), None, backend=backend, schedule=True,
+                      autotuner=autotuner)
+    sputnik.execute_program(**inputs)
+    assert backend.launches == [((2, 8), {'per_block': 4}), ((8,), {'per_block': 2})]
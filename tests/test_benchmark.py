@@ -0,0 +1,77 @@
+import copy
+import pytest
+
+from sputnik.analyzer import Analysis
+from sputnik.backends import NumpyBackend
+from sputnik.benchmark import (
+    LOWER_IS_BETTER, HIGHER_IS_BETTER, compare_results, generate_circuit, load_results,
+    run_suite, save_results)
+from sputnik.parser import Parser
+
+
+def test_generate_circuit(tmp_path):
+    source = generate_circuit(16, depth=5, width=3, seed=1)
+    assert source == generate_circuit(16, depth=5, width=3, seed=1)
+
+    path = tmp_path / 'circuit.sputnik'
+    path.write_text(source)
+    analysis = Analysis(Parser(str(path)).get_program())
+    assert analysis.size == 16
+    assert analysis.bootstrapped + analysis.histogram['NOT'] == 15
+    assert analysis.depth == 5
+
+
+def test_generate_circuit_mix(tmp_path):
+    source = generate_circuit(8, depth=4, width=4, mix={'NAND': 1})
+    gates = [line.split(' ')[0] for line in source.splitlines()
+             if not line.startswith(('EXEC', 'KEY', 'SIZE', 'PUSH', 'EXIT'))]
+    assert gates == ['NAND'] * 16
+
+
+def test_run_suite(tmp_path):
+    results = run_suite('numpy', NumpyBackend, sizes=[8], depths=[3], widths=[2], repeats=1)
+    benchmark, = results['benchmarks']
+    assert benchmark['name'] == 'size8-depth3-width2'
+    assert benchmark['gates'] == 6
+    for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        assert metric in benchmark
+
+    path = str(tmp_path / 'results.json')
+    save_results(results, path)
+    assert load_results(path) == results
+
+
+def test_compare_results():
+    baseline = {'benchmarks': [{
+        'name': 'size8-depth3-width2',
+        'parse_seconds': 1.0,
+        'startup_seconds': 1.0,
+        'run_seconds': 1.0,
+        'bootstrap_latency': 1.0,
+        'merkle_overhead': 0.5,
+        'gates_per_second': 100.0,
+    }]}
+    assert compare_results(baseline, baseline) == []
+
+    current = copy.deepcopy(baseline)
+    current['benchmarks'][0]['run_seconds'] = 1.5
+    current['benchmarks'][0]['gates_per_second'] = 50.0
+    # Getting faster isn't a regression
+    current['benchmarks'][0]['parse_seconds'] = 0.5
+    regressions = compare_results(baseline, current, threshold=0.1)
+    assert [(name, metric) for name, metric, _, _, _ in regressions] == [
+        ('size8-depth3-width2', 'run_seconds'),
+        ('size8-depth3-width2', 'gates_per_second'),
+    ]
+    assert compare_results(baseline, current, threshold=0.6) == []
+
+    # The merkle overhead doubling from 2% to 4% of the run time is noise,
+    # going up by 10 points isn't
+    baseline['benchmarks'][0]['merkle_overhead'] = 0.02
+    current = copy.deepcopy(baseline)
+    current['benchmarks'][0]['merkle_overhead'] = 0.04
+    assert compare_results(baseline, current) == []
+    current['benchmarks'][0]['merkle_overhead'] = 0.12
+    regressions = compare_results(baseline, current)
+    assert [metric for _, metric, _, _, _ in regressions] == ['merkle_overhead']
+    assert regressions[0][4] == pytest.approx(0.1)
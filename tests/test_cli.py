@@ -0,0 +1,50 @@
+import numpy
+from click.testing import CliRunner
+
+from cli.main import cli
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.optimizer import optimize
+from sputnik.parser import Parser
+
+
+def record(tmp_path, sputnik_filepath, optimize_program=False):
+    log_path = str(tmp_path / 'trace.log')
+    rng = numpy.random.RandomState(0)
+    inputs = {var_name: rng.randint(0, 2, size=8).astype(bool) for var_name in 'abc'}
+    program = Parser(sputnik_filepath).get_program()
+    if optimize_program:
+        program, _ = optimize(program)
+    with Sputnik(program, None, backend=NumpyBackend(), trace_log=log_path) as sputnik:
+        _, merkle = sputnik.execute_program(**inputs)
+    return log_path, merkle.get_merkle_root()
+
+
+def test_verify(tmp_path):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    result = CliRunner().invoke(cli, ['verify', 'tests/xor-combo.sputnik', log_path, root,
+                                      '--backend', 'numpy', '--sample', '1', '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Verified.' in result.output
+
+
+def test_verify_needs_key(tmp_path):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    # Gates can't be re-executed homomorphically without the key
+    result = CliRunner().invoke(cli, ['verify', 'tests/xor-combo.sputnik', log_path, root])
+    assert result.exit_code == 2
+    assert '--key is needed' in result.output
+
+
+def test_verify_optimized(tmp_path):
+    log_path, root = record(tmp_path, 'tests/redundant.sputnik', optimize_program=True)
+    args = ['verify', 'tests/redundant.sputnik', log_path, root,
+            '--backend', 'numpy', '--sample', '1', '--workers', '1']
+    # The optimized program runs other gates than the one parsed
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 1
+    assert '--optimize' in result.output
+
+    result = CliRunner().invoke(cli, args + ['--optimize'])
+    assert result.exit_code == 0, result.output
+    assert 'Verified.' in result.output
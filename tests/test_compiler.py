@@ -0,0 +1,63 @@
+import pytest
+
+from sputnik.engine import Program
+from sputnik.opcodes import OP_CODE_IDS
+from sputnik.parser import Parser
+
+
+def test_compile_program():
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    proggy = SputnikParser.get_program()
+    proggy.compile()
+
+    bytecode = proggy.bytecode
+    assert len(bytecode) == len(proggy.operations)
+    assert bytecode.op_ids[0] == OP_CODE_IDS['EXEC']
+    assert bytecode.operands[0] == (proggy.slot_of('a'), proggy.slot_of('b'))
+
+    # PUSH STATE orResult
+    assert bytecode.operands[2] == (0, proggy.slot_of('orResult'))
+
+
+def test_compile_errors():
+    with pytest.raises(SyntaxError, match='not a valid OPCODE'):
+        Program([('EXEC', 'a'), ('END',)]).compile()
+
+    with pytest.raises(SyntaxError, match='expects 2 arguments'):
+        Program([('EXEC', 'a', 'b'), ('XOR', 'a', 'b', '0'), ('EXIT',)]).compile()
+
+    with pytest.raises(SyntaxError, match='c is used before it is defined'):
+        Program([('EXEC', 'a', 'b'), ('XOR', 'a', 'b'), ('AND', 'STATE', 'c'),
+                 ('EXIT',)]).compile()
+
+    with pytest.raises(SyntaxError, match='expects an integer'):
+        Program([('EXEC', 'a'), ('SIZE', 'a'), ('EXIT',)]).compile()
+
+
+def test_program_slots():
+    proggy = Program([('EXEC', 'a'), ('EXIT',)])
+    proggy.set_variable_data('a', 1)
+    proggy.set_variable_data('STATE', 2)
+
+    assert proggy.registers[proggy.slot_of('a')] == 1
+    assert proggy.state == 2
+    assert proggy.variables == {'a': 1}
+    assert proggy.get_variable_data('missing') is None
+
+
+def test_bytecode_is_packed():
+    big = str(1 << 100)
+    proggy = Program([('EXEC', 'a'), ('KEY', 'test_key'), ('SIZE', '128'), ('CONST', big),
+                      ('SHL', 'STATE', '3'), ('XOR', 'a', 'STATE'), ('EXIT',)])
+    proggy.compile()
+
+    bytecode = proggy.bytecode
+    assert bytecode.op_ids.typecode == 'B'
+    assert bytecode.values.typecode == 'q'
+    # Names and literals of any size are pooled
+    assert bytecode.operands[1] == ('test_key',)
+    assert bytecode.operands[3] == (1 << 100,)
+    assert bytecode.operands[4] == (0, 3)
+    assert bytecode.operands[5] == (proggy.slot_of('a'), 0)
+    assert bytecode.operands[6] == ()
+    assert len(bytecode.values) == 8
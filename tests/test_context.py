@@ -0,0 +1,83 @@
+import pytest
+import threading
+
+from sputnik.backends import NumpyBackend
+from sputnik.context import ContextPool, default_pool
+
+
+class CountingBackend(NumpyBackend):
+    def __init__(self):
+        self.warmed = list()
+
+    def warmup(self, key, shape):
+        super().warmup(key, shape)
+        self.warmed.append(shape)
+
+
+def test_shared_context():
+    pool = ContextPool(factory=NumpyBackend)
+    assert pool.shared() is pool.shared()
+    assert len(pool.contexts) == 1
+
+    # The shared context is never handed out, so whoever checks a context
+    # out has it to themselves
+    assert pool.acquire() is not pool.shared()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    assert default_pool() is default_pool()
+
+
+def test_acquire_release():
+    pool = ContextPool(size=2, factory=NumpyBackend)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    assert len(pool.contexts) == 2
+
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+
+    releaser = threading.Timer(0.05, pool.release, (first,))
+    releaser.start()
+    assert pool.acquire(timeout=5) is first
+    releaser.join()
+
+    pool.release(first)
+    pool.release(second)
+    with pool.context() as context:
+        assert context in (first, second)
+    assert len(pool.contexts) == 2
+
+
+def test_warmup():
+    pool = ContextPool(size=2, factory=CountingBackend)
+    pool.warmup(None, [(8,), (16,)])
+    assert len(pool.contexts) == 2
+    for context in pool.contexts:
+        assert context.warmed == [(8,), (16,)]
+
+    # Shapes that are already warm aren't compiled again
+    pool.warmup(None, [(8,), (32,)])
+    for context in pool.contexts:
+        assert context.warmed == [(8,), (16,), (32,)]
+
+
+class Key:
+    pass
+
+
+def test_warmup_keys():
+    pool = ContextPool(factory=CountingBackend)
+    shared = pool.shared()
+    first = Key()
+    pool.warmup(first, [(8,)], batch_sizes=[1, 4])
+    # The shared context is warmed up too, along with the pooled one
+    assert len(pool.contexts) == 2
+    for context in pool.contexts:
+        assert context.warmed == [(8,), (4, 8)]
+
+    # Every key object has kernels of its own, even one that takes the
+    # place of a key that is gone
+    del first
+    pool.warmup(Key(), [(8,)])
+    assert shared.warmed == [(8,), (4, 8), (8,)]
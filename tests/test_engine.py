@@ -1,10 +1,13 @@
+import asyncio
 import nufhe
 import numpy
 import pickle
 import pytest
 
 from reikna.cluda import any_api
-from sputnik.engine import Sputnik
+from sputnik.backends import NumpyBackend
+from sputnik.checkpoint import Checkpoint
+from sputnik.engine import Program, Sputnik, constant_bits
 from sputnik.parser import Parser
 
 
@@ -59,61 +62,296 @@ def test_homomorphic_otp():
     assert (plain ^ pad).all() == dec_otp.all()
 
 
-#def test_engine_halt():
-#    SputnikParser = Parser('tests/abc.sputnik')
-#    proggy = SputnikParser.get_program()
-#    sputnik = Sputnik(proggy, None)
-#    output = sputnik.execute_program(a=1, b=2, c=3)
-#
-# 
-#def test_engine_OR():
-#    SputnikParser = Parser('tests/or.sputnik')
-#    proggy = SputnikParser.get_program()
-#
-#    sputnik = Sputnik(proggy, None)
-#    var1 = 10
-#    var2 = 21
-#    sputnik.execute_program(a=var1, b=var2)
-#    assert sputnik.program.state == (var1 | var2)
-#
-#
-#def test_engine_AND():
-#    SputnikParser = Parser('tests/and.sputnik')
-#    proggy = SputnikParser.get_program()
-#
-#    sputnik = Sputnik(proggy, None)
-#    var1 = 12
-#    var2 = 13
-#    sputnik.execute_program(a=var1, b=var2)
-#    assert sputnik.program.state == (var1 & var2)
-#
-#
-#def test_engine_XOR():
-#    SputnikParser = Parser('tests/xor.sputnik')
-#    proggy = SputnikParser.get_program()
-#
-#    sputnik = Sputnik(proggy, None)
-#    var1 = 5
-#    var2 = 55
-#    sputnik.execute_program(a=var1, b=var2)
-#    assert sputnik.program.state == (var1 ^ var2)
-#
-#
-#def test_engine_XOR_combo():
-#    SputnikParser = Parser('tests/xor-combo.sputnik')
-#    proggy = SputnikParser.get_program()
-#
-#    sputnik = Sputnik(proggy, None)
-#    var1 = 7
-#    var2 = 17
-#    sputnik.execute_program(a=var1, b=var2)
-#    assert sputnik.program.state == ((var1 | var2) ^ (var1 & var2)) & (var1 ^ var2)
-#
-#
-#def test_engine_entrance():
-#    SputnikParser = Parser('tests/entrance_vars.sputnik')
-#    proggy = SputnikParser.get_program()
-#
-#    sputnik = Sputnik(proggy, None)
-#    sputnik.execute_program(test_key='test')
-#    assert sputnik.program.state == None
+def test_engine_abc():
+    SputnikParser = Parser('tests/abc.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    a, b, c = (constant_bits(var, 8) for var in (1, 2, 3))
+    state, merkle = sputnik.execute_program(a=a, b=b, c=c)
+    assert (state == ((b | c) & (a ^ b ^ c))).all()
+    assert merkle.leaf_count == 4
+
+
+def test_engine_OR():
+    SputnikParser = Parser('tests/or.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    var1 = constant_bits(10, 8)
+    var2 = constant_bits(21, 8)
+    sputnik.execute_program(a=var1, b=var2)
+    assert (sputnik.program.state == (var1 | var2)).all()
+
+
+def test_engine_AND():
+    SputnikParser = Parser('tests/and.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    var1 = constant_bits(12, 8)
+    var2 = constant_bits(13, 8)
+    sputnik.execute_program(a=var1, b=var2)
+    assert (sputnik.program.state == (var1 & var2)).all()
+
+
+def test_engine_XOR():
+    SputnikParser = Parser('tests/xor.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    var1 = constant_bits(5, 8)
+    var2 = constant_bits(55, 8)
+    sputnik.execute_program(a=var1, b=var2)
+    assert (sputnik.program.state == (var1 ^ var2)).all()
+
+
+def test_engine_XOR_combo():
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    var1 = constant_bits(7, 8)
+    var2 = constant_bits(17, 8)
+    sputnik.execute_program(a=var1, b=var2)
+    assert (sputnik.program.state == ((var1 | var2) ^ (var1 & var2)) & (var1 ^ var2)).all()
+
+
+def test_engine_scheduled():
+    var1 = constant_bits(7, 8)
+    var2 = constant_bits(17, 8)
+
+    outputs = list()
+    for schedule in (False, True):
+        SputnikParser = Parser('tests/xor-combo.sputnik')
+        proggy = SputnikParser.get_program()
+
+        sputnik = Sputnik(proggy, None, backend=NumpyBackend(), schedule=schedule)
+        state, merkle = sputnik.execute_program(a=var1, b=var2)
+        outputs.append((state, merkle.get_merkle_root(), proggy.variables))
+
+    (state, root, variables), (scheduled_state, scheduled_root, scheduled_variables) = outputs
+    assert (state == scheduled_state).all()
+    assert root == scheduled_root
+    assert variables.keys() == scheduled_variables.keys()
+
+
+def test_engine_trace_modes():
+    roots = dict()
+    for trace, trace_every in (('full', 1), ('sampled', 2), ('off', 1)):
+        SputnikParser = Parser('tests/xor-combo.sputnik')
+        proggy = SputnikParser.get_program()
+
+        sputnik = Sputnik(proggy, None, backend=NumpyBackend(),
+                          trace=trace, trace_every=trace_every)
+        _, merkle = sputnik.execute_program(a=constant_bits(7, 8), b=constant_bits(17, 8))
+        roots[trace] = (merkle.leaf_count, merkle.get_merkle_root())
+
+    assert roots['full'][0] == 5
+    assert roots['sampled'][0] == 3
+    assert roots['off'] == (0, None)
+
+
+def test_engine_const_copy():
+    SputnikParser = Parser('tests/const.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    var1 = constant_bits(12, 8)
+    state, _ = sputnik.execute_program(a=var1, test_key='test')
+    assert (state == (var1 ^ constant_bits(5, 8))).all()
+    assert state is not proggy.variables['b']
+    assert (state == proggy.variables['b']).all()
+
+
+def test_engine_mux_shift():
+    SputnikParser = Parser('tests/mux.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    s, a, b = (constant_bits(var, 8) for var in (0b00001111, 0b10101010, 0b01010101))
+    state, merkle = sputnik.execute_program(s=s, a=a, b=b)
+    assert (proggy.variables['selected'] == constant_bits(0b01011010, 8)).all()
+    assert (proggy.variables['left'] == constant_bits(0b01101000, 8)).all()
+    assert (state == constant_bits(0b00001011, 8)).all()
+    assert merkle.leaf_count == 1
+
+
+
+class MarkedBackend(NumpyBackend):
+
+    def __init__(self):
+        self.markers = 0
+        self.waits = list()
+
+    def marker(self):
+        self.markers += 1
+        return self.markers
+
+    def wait(self, marker):
+        self.waits.append(marker)
+
+
+def test_engine_async():
+    var1 = constant_bits(7, 8)
+    var2 = constant_bits(17, 8)
+    proggy = Parser('tests/xor-combo.sputnik').get_program()
+    expected, expected_merkle = Sputnik(proggy, None, backend=NumpyBackend()).execute_program(
+        a=var1, b=var2)
+
+    for schedule in (False, True):
+        backend = MarkedBackend()
+        proggy = Parser('tests/xor-combo.sputnik').get_program()
+        sputnik = Sputnik(proggy, None, backend=backend, schedule=schedule, max_in_flight=2)
+        ticks = list()
+
+        async def ticker():
+            while not proggy.is_killed:
+                ticks.append(proggy.exec_index)
+                await asyncio.sleep(0)
+
+        async def main():
+            task = asyncio.ensure_future(ticker())
+            result = await sputnik.execute_program_async(a=var1, b=var2)
+            await task
+            return result
+
+        state, merkle = asyncio.run(main())
+        assert (state == expected).all()
+        assert merkle.get_merkle_root() == expected_merkle.get_merkle_root()
+        # The other task ran while the program executed. A schedule runs
+        # all the gates of xor-combo in one step, so it only yields once.
+        assert len(set(ticks)) > (1 if not schedule else 0)
+        # Every wait was for the marker placed one yield earlier
+        assert backend.waits == list(range(1, backend.markers))
+
+
+def test_engine_operation_async():
+    sputnik = Sputnik(Parser('tests/xor-combo.sputnik').get_program(), None,
+                      backend=NumpyBackend())
+    sputnik.program.compile()
+    sputnik.program.set_variable_data('a', constant_bits(7, 8))
+    sputnik.program.set_variable_data('b', constant_bits(17, 8))
+
+    async def main():
+        await sputnik.execute_operation_async('XOR', ('a', 'b'))
+        return await sputnik.execute_operation_async('EXIT', ())
+
+    state, merkle = asyncio.run(main())
+    assert (state == constant_bits(7 ^ 17, 8)).all()
+    assert merkle.leaf_count == 1
+
+def test_engine_entrance():
+    SputnikParser = Parser('tests/entrance_vars.sputnik')
+    proggy = SputnikParser.get_program()
+
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    sputnik.execute_program(test_key='test')
+    assert sputnik.program.state == None
+    assert sputnik.program.size == 32
+
+
+def test_engine_halt_recover(tmp_path):
+    checkpoint = str(tmp_path / 'halt.ckpt')
+    var1 = constant_bits(5, 8)
+    var2 = constant_bits(55, 8)
+
+    SputnikParser = Parser('tests/halt.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                      checkpoint=checkpoint)
+    halt_info = sputnik.execute_program(a=var1, b=var2)
+    assert halt_info['is_halted']
+    assert halt_info['exec_index'] == 3
+
+    # A fresh engine resumes after the HALT without redoing the XOR
+    SputnikParser = Parser('tests/halt.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                      checkpoint=checkpoint)
+    state, merkle = sputnik.recover()
+    assert ((var1 ^ var2) & var1 | var2 == state).all()
+    assert merkle.leaf_count == 3
+
+    # The trace matches an uninterrupted run
+    proggy = Parser('tests/halt.sputnik').get_program()
+    proggy.operations.remove(('HALT',))
+    _, uninterrupted = Sputnik(proggy, None, backend=NumpyBackend()).execute_program(
+        a=var1, b=var2)
+    assert merkle.get_merkle_root() == uninterrupted.get_merkle_root()
+
+
+def test_engine_incremental_checkpoints(tmp_path):
+    checkpoint = str(tmp_path / 'combo.ckpt')
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                      checkpoint=checkpoint, checkpoint_every=1)
+    sputnik.execute_program(a=constant_bits(7, 8), b=constant_bits(17, 8))
+
+    # Unchanged variables point back into the first checkpoint
+    variables = Checkpoint(checkpoint).manifest['variables']
+    assert variables['a'][0]['offset'] < variables['orResult'][0]['offset']
+    assert variables['orResult'][0]['offset'] < variables['xorResult'][0]['offset']
+    assert (Checkpoint(checkpoint).arrays('b')[0] == constant_bits(17, 8)).all()
+
+
+def test_engine_batch():
+    rng = numpy.random.RandomState(0)
+    batch = [{'a': rng.randint(0, 2, size=8).astype(bool),
+              'b': rng.randint(0, 2, size=8).astype(bool)} for _ in range(5)]
+
+    for schedule in (False, True):
+        SputnikParser = Parser('tests/xor-combo.sputnik')
+        sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                          schedule=schedule)
+        states, merkle = sputnik.execute_batch(batch)
+        assert len(states) == 5
+        assert merkle.leaf_count == 5
+
+        for request, state in zip(batch, states):
+            SputnikParser = Parser('tests/xor-combo.sputnik')
+            single = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend())
+            expected, _ = single.execute_program(**request)
+            assert (state == expected).all()
+
+
+def test_engine_batch_shared_input():
+    rng = numpy.random.RandomState(0)
+    pad = rng.randint(0, 2, size=32).astype(bool)
+    batch = [{'plain': rng.randint(0, 2, size=32).astype(bool)} for _ in range(3)]
+
+    SputnikParser = Parser('contracts/otp.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend())
+    states, _ = sputnik.execute_batch(batch, pad=pad, test_key='test')
+    for request, state in zip(batch, states):
+        assert state.shape == (32,)
+        assert (state == request['plain'] ^ pad).all()
+
+
+def test_engine_batch_unbatched_state():
+    # STATE doesn't depend on the batch, and the batch is as large as SIZE
+    program = Program([('EXEC', 'a'), ('SIZE', '4'), ('CONST', '5'), ('EXIT',)])
+    sputnik = Sputnik(program, None, backend=NumpyBackend())
+    batch = [{'a': numpy.zeros(4, dtype=bool)} for _ in range(4)]
+    states, _ = sputnik.execute_batch(batch)
+    assert len(states) == 4
+    for state in states:
+        assert state.tolist() == [True, False, True, False]
+
+
+def test_engine_batch_job_roots():
+    rng = numpy.random.RandomState(1)
+    pad = rng.randint(0, 2, size=32).astype(bool)
+    batch = [{'plain': rng.randint(0, 2, size=32).astype(bool)} for _ in range(3)]
+
+    sputnik = Sputnik(Parser('contracts/otp.sputnik').get_program(), None, backend=NumpyBackend())
+    _, merkle = sputnik.execute_batch(batch, pad=pad, test_key='test')
+    job_trees = sputnik.merkle.job_trees
+    assert len(job_trees) == 3
+
+    # Every request gets the root of executing it on its own
+    for request, tree in zip(batch, job_trees):
+        single = Sputnik(Parser('contracts/otp.sputnik').get_program(), None,
+                         backend=NumpyBackend())
+        _, expected = single.execute_program(pad=pad, test_key='test', **request)
+        assert tree.leaf_count == merkle.leaf_count
+        assert tree.get_merkle_root() == expected.get_merkle_root()
+    assert len({tree.get_merkle_root() for tree in job_trees}) == 3
@@ -0,0 +1,117 @@
+import numpy
+import pytest
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.expression import constant, mux, word
+from sputnik.opcodes import GATE_OP_CODES
+
+
+def bits(value):
+    return numpy.array([(value >> bit) & 1 for bit in range(8)], dtype=bool)
+
+
+def test_evaluate():
+    rng = numpy.random.RandomState(0)
+    a, b, c = (rng.randint(0, 2, size=8).astype(bool) for _ in range(3))
+    A, B, C = word('a', a), word('b', b), word('c')
+
+    carry = (A & B) | ((A ^ B) & C)
+    result = carry.evaluate('test', backend=NumpyBackend(), c=c)
+    assert (result == ((a & b) | ((a ^ b) & c))).all()
+
+    # Bound ciphertexts can be overridden
+    result = carry.evaluate('test', backend=NumpyBackend(), a=c, c=a)
+    assert (result == ((c & b) | ((c ^ b) & a))).all()
+
+    with pytest.raises(ValueError):
+        carry.evaluate('test', backend=NumpyBackend())
+
+
+def test_evaluate_constants_and_shifts():
+    a, b, c = bits(0b10110010), bits(0b01101100), bits(0b11110000)
+    A, B, C = word('a', a), word('b', b), word('c', c)
+
+    result = mux(C, A ^ 0b1010, ~B << 1).evaluate('test', backend=NumpyBackend())
+    expected = numpy.where(c, a ^ bits(0b1010), numpy.roll(~b, 1) & bits(0xfe))
+    assert (result == expected).all()
+
+    result = (0xff & (A >> 2)).evaluate('test', backend=NumpyBackend(), schedule=True)
+    assert (result == bits(0b00101100)).all()
+
+    with pytest.raises(ValueError):
+        (A & 1).source()
+    assert 'SIZE 8' in (A & 1).source(size=8)
+
+
+def test_lowering_is_global():
+    A, B, C = word('a'), word('b'), word('c')
+    # The same subexpression, built twice, and a negation to fuse
+    left = (A & B) ^ C
+    right = ~((A & B) ^ C)
+    unused = A | C
+    program = (left & right | (~A & B)).to_program()
+    op_codes = [operation[0] for operation in program.operations]
+    assert op_codes.count('AND') == 1
+    assert op_codes.count('XOR') == 1
+    assert op_codes.count('ANDYN') == 2
+    assert 'NOT' not in op_codes
+
+    # With the word size, x & ~x folds away
+    program = (left & right | (~A & B)).to_program(size=8)
+    assert [operation[0] for operation in program.operations] == \
+        ['EXEC', 'KEY', 'SIZE', 'ANDYN', 'EXIT']
+
+    unoptimized = (left & right | (~A & B)).to_program(optimized=False)
+    gates = [operation for operation in unoptimized.operations if operation[0] in GATE_OP_CODES]
+    assert len(gates) == 9
+    # Nodes that aren't used by the result are never lowered
+    assert ('OR', 'a', 'c') not in unoptimized.operations
+    assert unused.to_program().operations[-2] == ('OR', 'a', 'c')
+
+
+def test_constant_folding():
+    a = bits(0b10110010)
+    A = word('a', a)
+    expression = (A & constant(0xff)) ^ constant(0)
+    # Both constants fold away with the word size
+    program = expression.to_program(size=8)
+    assert [operation[0] for operation in program.operations] == \
+        ['EXEC', 'KEY', 'SIZE', 'COPY', 'EXIT']
+
+    result = expression.evaluate('test', backend=NumpyBackend())
+    assert (result == a).all()
+    assert not numpy.shares_memory(result, a)
+
+
+def test_source_runs():
+    A, B = word('a'), word('b')
+    program = ((A ^ B) & A).to_program()
+    state, _ = Sputnik(program, None, backend=NumpyBackend()).execute_program(
+        key='test', a=bits(0b1100), b=bits(0b1010))
+    assert (state == bits(0b0100)).all()
+
+
+def test_deep_expression():
+    A = word('a', bits(0b1))
+    result = A
+    for _ in range(5000):
+        result = result ^ A
+    # XOR of an even number of a's... plus one
+    assert (result.evaluate('test', backend=NumpyBackend()) == bits(0b1)).all()
+
+
+def test_invalid_words():
+    with pytest.raises(ValueError):
+        word('key')
+    with pytest.raises(ValueError):
+        word('STATE')
+    for name in ('backend', 'size', 'schedule'):
+        with pytest.raises(ValueError):
+            word(name)
+    with pytest.raises(TypeError):
+        word('a') & 'b'
+    with pytest.raises(TypeError):
+        bool(word('a'))
+    with pytest.raises(ValueError):
+        (word('a', bits(1)) & word('a', bits(2))).to_program()
@@ -0,0 +1,105 @@
+import numpy
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.gatecache import GateCache
+from sputnik.parser import Parser
+
+
+class CountingBackend(NumpyBackend):
+    def __init__(self):
+        self.gates = 0
+        self.loads = 0
+
+    def gate(self, key, op_code, result, *inputs, tuning=None):
+        self.gates += 1
+        super().gate(key, op_code, result, *inputs)
+
+    def load(self, key, arrays):
+        self.loads += 1
+        return super().load(key, arrays)
+
+
+def run(path, backend, gate_cache, key='test', **kwargs):
+    sputnik = Sputnik(Parser(path).get_program(), None, backend=backend, gate_cache=gate_cache,
+                      **kwargs.pop('engine_args', {}))
+    state, _ = sputnik.execute_program(test_key=key, **kwargs)
+    return state.copy()
+
+
+def test_repeated_runs():
+    rng = numpy.random.RandomState(0)
+    plain, pad = (rng.randint(0, 2, size=32).astype(bool) for _ in range(2))
+    backend = CountingBackend()
+    cache = GateCache(1 << 20)
+
+    first = run('contracts/otp.sputnik', backend, cache, plain=plain, pad=pad)
+    assert backend.gates == 1
+    assert (cache.stats.hits, cache.stats.misses) == (0, 1)
+
+    second = run('contracts/otp.sputnik', backend, cache, plain=plain, pad=pad)
+    assert backend.gates == 1
+    assert (second == first).all()
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    assert cache.stats.hit_rate == 0.5
+
+    # Inputs written in place since are hashed again
+    plain[0] = not plain[0]
+    third = run('contracts/otp.sputnik', backend, cache, plain=plain, pad=pad)
+    assert backend.gates == 2
+    assert (third == plain ^ pad).all()
+
+    # Another key doesn't share results
+    run('contracts/otp.sputnik', backend, cache, key='other', plain=plain, pad=pad)
+    assert backend.gates == 3
+
+
+def test_only_entrance_variables_are_hashed():
+    rng = numpy.random.RandomState(0)
+    inputs = {var_name: rng.randint(0, 2, size=8).astype(bool) for var_name in 'abc'}
+    backend = CountingBackend()
+    cache = GateCache(1 << 20)
+
+    expected = run('tests/redundant.sputnik', NumpyBackend(), None, **inputs)
+    for engine_args in ({}, {'reuse_buffers': True}):
+        state = run('tests/redundant.sputnik', backend, cache, engine_args=engine_args, **inputs)
+        assert (state == expected).all()
+    # redundant.sputnik computes the same XOR twice, with swapped inputs.
+    # The second run only computes its NOTs, which aren't worth caching.
+    assert (cache.stats.hits, cache.stats.misses) == (1 + 9, 8)
+    assert backend.gates == 8 + 2 * 2
+    # Only the entrance variables and CONST results are ever hashed
+    assert cache.stats.hashed == 2 * (len(inputs) + 2)
+
+
+def test_eviction_and_spill():
+    backend = CountingBackend()
+    # Room for four 8-bit results, two of them on the device
+    cache = GateCache(32, device_bytes=16)
+    ciphertexts = [numpy.array([bit] * 8, dtype=bool) for bit in (False, True)]
+    addresses = list()
+    for op_code in ('AND', 'OR', 'XOR', 'NAND', 'NOR'):
+        address = cache.address(backend, 'test', op_code, ciphertexts)
+        result = numpy.empty(8, dtype=bool)
+        backend.gate('test', op_code, result, *ciphertexts)
+        cache.put(backend, 'test', address, result)
+        addresses.append(address)
+
+    assert len(cache) == 4
+    assert cache.used_bytes == 32
+    assert cache.used_device_bytes == 16
+    assert cache.stats.evictions == 1
+    assert cache.stats.spills == 3
+
+    # The oldest result is gone, spilled ones are loaded back
+    assert cache.get(backend, 'test', addresses[0]) is None
+    assert (cache.get(backend, 'test', addresses[1]) == True).all()
+    assert backend.loads == 1
+    assert cache.used_device_bytes == 16
+    # The result just used isn't spilled again
+    assert (cache.get(backend, 'test', addresses[1]) == True).all()
+    assert backend.loads == 1
+
+    # Results over the whole budget aren't cached
+    cache.put(backend, 'test', b'big', numpy.zeros(64, dtype=bool))
+    assert cache.get(backend, 'test', b'big') is None
@@ -0,0 +1,90 @@
+import pickle
+
+import numpy
+import pytest
+
+from sputnik.backends import NumpyBackend
+from sputnik.checkpoint import Checkpoint
+from sputnik.engine import Sputnik, constant_bits
+from sputnik.keystore import KeyFile, save_key
+from sputnik.parser import Parser
+from sputnik.sharding import ShardPool
+
+
+def test_key_file(tmp_path):
+    backend = NumpyBackend()
+    shared = numpy.arange(12, dtype=numpy.int32).reshape(3, 4)
+    key = {
+        'params': ('NTT', 1024),
+        'bootstrap': numpy.linspace(0, 1, 7),
+        'keyswitch': [shared, shared[1:]],
+    }
+    path = str(tmp_path / 'test.key')
+    save_key(key, path, backend)
+
+    key_file = KeyFile(path)
+    loaded = key_file.load(backend)
+    assert loaded['params'] == ('NTT', 1024)
+    assert (loaded['bootstrap'] == key['bootstrap']).all()
+    assert (loaded['keyswitch'][0] == shared).all()
+    assert (loaded['keyswitch'][1] == shared[1:]).all()
+    # Arrays are read-only views of the mapped file
+    assert not loaded['bootstrap'].flags.writeable
+    assert not loaded['bootstrap'].flags.owndata
+    assert len(key_file.manifest['arrays']) == 3
+    for entry in key_file.manifest['arrays']:
+        assert entry['offset'] % 64 == 0
+
+    assert key_file.load(backend) is loaded
+    # Only the path is pickled
+    assert pickle.loads(pickle.dumps(key_file)).load(backend)['params'] == ('NTT', 1024)
+
+
+def test_key_file_invalid(tmp_path):
+    path = tmp_path / 'test.key'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        KeyFile(str(path)).load(NumpyBackend())
+
+
+def test_engine_key_file(tmp_path):
+    backend = NumpyBackend()
+    path = str(tmp_path / 'test.key')
+    save_key(None, path, backend)
+
+    key_file = KeyFile(path)
+    SputnikParser = Parser('tests/const.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=backend)
+    assert key_file.manifest is None
+
+    state, _ = sputnik.execute_program(a=constant_bits(3, 8), test_key=key_file)
+    assert (state == constant_bits(3 ^ 5, 8)).all()
+    assert sputnik.program.key_name == 'test_key'
+    assert key_file.manifest is not None
+
+
+def test_engine_sharded_key_file(tmp_path):
+    path = str(tmp_path / 'test.key')
+    # The numpy backend ignores keys, but KEY needs one
+    save_key('test', path, NumpyBackend())
+
+    SputnikParser = Parser('tests/const.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend())
+    with ShardPool(KeyFile(path), workers=2, backend=NumpyBackend) as pool:
+        state, _ = sputnik.execute_sharded(pool, a=constant_bits(3, 8))
+    assert (state == constant_bits(3 ^ 5, 8)).all()
+
+
+def test_key_file_type(tmp_path):
+    backend = NumpyBackend()
+    path = str(tmp_path / 'test.key')
+    save_key({'bootstrap': numpy.zeros(5)}, path, backend)
+    with pytest.raises(ValueError, match='not a Sputnik checkpoint'):
+        Checkpoint(path)
+
+    # A truncated key file is incomplete, not read past its end
+    with open(path, 'rb') as f:
+        data = f.read()
+    (tmp_path / 'truncated.key').write_bytes(data[:-8])
+    with pytest.raises(ValueError, match='incomplete'):
+        KeyFile(str(tmp_path / 'truncated.key')).arrays()
@@ -0,0 +1,45 @@
+import numpy
+import pytest
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik, constant_bits
+from sputnik.macros import expand_macro, uses_prefix
+from sputnik.parser import Parser
+
+
+def bits_value(bits):
+    return sum(int(bit) << idx for idx, bit in enumerate(bits))
+
+
+def test_carry_strategy():
+    # Ripple carry is cheaper for narrow operands, the prefix for wide ones
+    assert not uses_prefix(3)
+    assert not uses_prefix(5)
+    assert uses_prefix(8)
+    assert uses_prefix(32)
+
+
+def test_expand_macro():
+    operations = expand_macro('ADD', ['a', 'STATE'], 8, 'ADD@3')
+    assert operations[0] == ('PUSH', 'STATE', 'ADD@3.state')
+    assert operations[-1] == ('XOR', 'ADD@3.p', 'STATE')
+
+    with pytest.raises(SyntaxError, match='needs the SIZE'):
+        expand_macro('ADD', ['a', 'b'], None, 'ADD@3')
+    with pytest.raises(SyntaxError, match='expects 2 arguments'):
+        expand_macro('CMP', ['a'], 8, 'CMP@3')
+
+
+def test_engine_arithmetic():
+    rng = numpy.random.RandomState(0)
+    for _ in range(10):
+        a, b = (int(value) for value in rng.randint(0, 256, size=2))
+        SputnikParser = Parser('tests/arith.sputnik')
+        proggy = SputnikParser.get_program()
+
+        sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+        state, _ = sputnik.execute_program(a=constant_bits(a, 8), b=constant_bits(b, 8))
+        assert bits_value(proggy.variables['sum']) == (a + b) % 256
+        assert bits_value(proggy.variables['difference']) == (a - b) % 256
+        assert bits_value(proggy.variables['less']) == int(a < b)
+        assert bits_value(state) == (int(a < b) + a + b) % 256
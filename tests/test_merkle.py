@@ -0,0 +1,62 @@
+import hashlib
+import numpy
+import pytest
+
+from merkletools import MerkleTools
+from sputnik.backends import NumpyBackend
+from sputnik.merkle import TRACE_SAMPLED, MerkleAccumulator, MerklePipeline, hash_leaf
+
+
+def test_accumulator_matches_merkletools():
+    for leaf_count in range(1, 18):
+        digests = [hashlib.sha256(bytes([idx])).digest() for idx in range(leaf_count)]
+
+        merkle = MerkleTools(hash_type='SHA256')
+        merkle.add_leaf([digest.hex() for digest in digests])
+        merkle.make_tree()
+
+        accumulator = MerkleAccumulator()
+        for digest in digests:
+            accumulator.add_leaf(digest)
+
+        assert accumulator.leaf_count == leaf_count
+        assert accumulator.get_merkle_root() == merkle.get_merkle_root()
+
+
+def test_accumulator_empty():
+    assert MerkleAccumulator().get_merkle_root() is None
+
+
+def test_hash_leaf():
+    a = numpy.arange(12, dtype=numpy.int32).reshape(2, 6)
+    b = numpy.arange(2, dtype=numpy.int32)
+
+    digest = hash_leaf(7, [(a, b), (a, b), (a, b)])
+    assert len(digest) == 32
+    assert digest == hash_leaf(7, [(a.copy(), b.copy())] * 3)
+
+    # OPCODE, contents and shapes are all part of the digest
+    assert digest != hash_leaf(5, [(a, b), (a, b), (a, b)])
+    assert digest != hash_leaf(7, [(a, b), (a, b), (a, b + 1)])
+    assert digest != hash_leaf(7, [(a.reshape(3, 4), b), (a, b), (a, b)])
+
+
+def test_pipeline_modes():
+    with pytest.raises(ValueError):
+        MerklePipeline(None, mode='sometimes')
+    with pytest.raises(ValueError):
+        MerklePipeline(None, mode=TRACE_SAMPLED, sample_every=0)
+
+
+def test_pipeline_close():
+    merkle = MerklePipeline(NumpyBackend(), batch_size=1)
+    for _ in range(3):
+        merkle.add_computation('AND', [numpy.ones(4, dtype=bool)] * 2, numpy.ones(4, dtype=bool))
+    workers = set(merkle._pool._threads)
+    assert workers
+
+    merkle.close()
+    assert merkle.tree.leaf_count == 3
+    assert not any(thread.is_alive() for thread in workers)
+    # Closing twice is harmless
+    merkle.close()
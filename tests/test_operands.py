@@ -0,0 +1,109 @@
+import numpy
+import pytest
+
+from sputnik.analyzer import Analysis
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.operands import expand_operands, parse_operand
+from sputnik.optimizer import optimize
+from sputnik.parser import Parser
+
+
+def expected_slices(a, b):
+    swapped = numpy.concatenate([a[8:16], a[:8]]) & b
+    low = a[:8] ^ b[:8]
+    low = b[:8] | low
+    return numpy.concatenate([low, swapped[8:16]]) & a
+
+
+def test_parse_operand():
+    assert parse_operand('a') == [('a', None, None)]
+    assert parse_operand('a[4:8]') == [('a', 4, 8)]
+    assert parse_operand('a[:8]') == [('a', 0, 8)]
+    assert parse_operand('STATE[3]') == [('STATE', 3, 4)]
+    assert parse_operand('{a,b[0:4]}') == [('a', None, None), ('b', 0, 4)]
+    assert parse_operand('{a[0:4],a[4:6],b}') == [('a', 0, 6), ('b', None, None)]
+
+    for operand in ('a[4:4]', 'a[8:4]', 'a[x]', 'a[0:4', '{a,}', 'a[0:4][1]'):
+        with pytest.raises(SyntaxError):
+            parse_operand(operand)
+
+
+def test_expand_operands():
+    assert expand_operands(('AND', 'a', 'b'), 'AND@1') == [('AND', 'a', 'b')]
+    assert expand_operands(('AND', 'a[0:8]', '{STATE,b[1]}'), 'AND@1') == [
+        ('SLICE', 'a', '0', '8', 'AND@1.0'),
+        ('SLICE', 'b', '1', '2', 'AND@1.1'),
+        ('CONCAT', 'STATE', 'AND@1.1', 'AND@1.2'),
+        ('AND', 'AND@1.0', 'AND@1.2'),
+    ]
+    # Macros read all their arguments
+    assert expand_operands(('ADD', 'a[0:8]', 'b'), 'ADD@1', arity=2)[-1] == \
+        ('ADD', 'ADD@1.0', 'b')
+    with pytest.raises(SyntaxError, match='can only be read'):
+        expand_operands(('PUSH', 'STATE', 'a[0:8]'), 'PUSH@1')
+
+
+def test_parser_errors(tmp_path):
+    path = tmp_path / 'bad.sputnik'
+    path.write_text('EXEC a b\nAND a[4:0] b\nEXIT\n')
+    with pytest.raises(SyntaxError, match='Line 2'):
+        Parser(str(path))
+
+
+@pytest.mark.parametrize('engine_args', [{}, {'reuse_buffers': True}, {'schedule': True}])
+def test_engine_slices(engine_args):
+    rng = numpy.random.RandomState(0)
+    for _ in range(5):
+        a, b = (rng.randint(0, 2, size=16).astype(bool) for _ in range(2))
+        proggy = Parser('tests/slices.sputnik').get_program()
+        sputnik = Sputnik(proggy, None, backend=NumpyBackend(), **engine_args)
+        state, _ = sputnik.execute_program(test_key='test', a=a, b=b)
+        assert (state == expected_slices(a, b)).all()
+
+
+def test_slices_are_views():
+    a = numpy.zeros(16, dtype=bool)
+    b = numpy.ones(16, dtype=bool)
+    proggy = Parser('tests/slices.sputnik').get_program()
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    sputnik.execute_program(test_key='test', a=a, b=b)
+    assert numpy.shares_memory(proggy.get_variable_data('XOR@10.0'), a)
+    # Gates over slices only compute the selected bits
+    assert proggy.get_variable_data('low').shape == (8,)
+    assert proggy.get_variable_data('swapped').shape == (16,)
+
+
+def test_slice_out_of_range():
+    a = numpy.zeros(4, dtype=bool)
+    proggy = Parser('tests/slices.sputnik').get_program()
+    sputnik = Sputnik(proggy, None, backend=NumpyBackend())
+    with pytest.raises(RuntimeError, match='SLICE'):
+        sputnik.execute_program(test_key='test', a=a, b=a)
+
+
+def test_analyze_slices():
+    analysis = Analysis(Parser('tests/slices.sputnik').get_program())
+    assert analysis.bootstrapped == 4
+    assert analysis.histogram['SLICE'] == 7
+    # {a[0],a[1:16]} is a single view
+    assert analysis.histogram['CONCAT'] == 2
+
+    # The optimizer leaves programs with slices alone
+    proggy = Parser('tests/slices.sputnik').get_program()
+    optimized, report = optimize(proggy)
+    assert optimized is proggy
+
+
+def test_views_keep_their_variable_alive(tmp_path):
+    # `t` isn't read after the slice, but its buffer must not be reused
+    # while the view is
+    path = tmp_path / 'views.sputnik'
+    path.write_text('EXEC a b\nKEY test_key\nNOT a\nPUSH STATE t\nPUSH t[0:8] u\n'
+                    'XOR a b\nAND STATE u\nEXIT\n')
+    a = numpy.array([0, 1] * 4, dtype=bool)
+    b = numpy.array([0, 0, 1, 1] * 2, dtype=bool)
+    sputnik = Sputnik(Parser(str(path)).get_program(), None, backend=NumpyBackend(),
+                      reuse_buffers=True)
+    state, _ = sputnik.execute_program(test_key='test', a=a, b=b)
+    assert (state == ((a ^ b) & ~a)).all()
@@ -0,0 +1,63 @@
+import numpy
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Program, Sputnik
+from sputnik.optimizer import optimize
+from sputnik.parser import Parser
+
+
+def run(program, **kwargs):
+    sputnik = Sputnik(program, None, backend=NumpyBackend())
+    state, _ = sputnik.execute_program(**kwargs)
+    return state
+
+
+def test_optimize_equivalence():
+    rng = numpy.random.RandomState(0)
+    for path in ('tests/redundant.sputnik', 'tests/xor-combo.sputnik',
+                 'tests/abc.sputnik', 'tests/const.sputnik'):
+        for _ in range(10):
+            inputs = {var_name: rng.randint(0, 2, size=8).astype(bool)
+                      for var_name in ('a', 'b', 'c')}
+            expected = run(Parser(path).get_program(), test_key='test', **inputs)
+
+            optimized, _ = optimize(Parser(path).get_program())
+            assert (run(optimized, test_key='test', **inputs) == expected).all()
+
+
+def test_optimize_report():
+    SputnikParser = Parser('tests/redundant.sputnik')
+    optimized, report = optimize(SputnikParser.get_program())
+
+    assert report.bootstraps_before == 9
+    assert report.bootstraps_after == 4
+    assert report.bootstraps_saved == 5
+    assert report.rewrites['cse'] == 1
+
+    # NOT a; AND STATE b is fused, the unused OR and the constants are gone
+    op_codes = [operation[0] for operation in optimized.operations]
+    assert 'NOT' not in op_codes
+    assert 'CONST' not in op_codes
+    assert op_codes.count('XOR') == 1
+    assert op_codes.count('OR') == 1
+
+
+def test_optimize_keeps_halt():
+    SputnikParser = Parser('tests/entrance_vars.sputnik')
+    proggy = SputnikParser.get_program()
+    proggy.operations.insert(1, ('HALT',))
+
+    optimized, report = optimize(proggy)
+    assert optimized is proggy
+    assert report.bootstraps_saved == 0
+
+
+def test_optimize_copied_input():
+    for operations in ([('COPY', 'a')], [('PUSH', 'a', 'b'), ('COPY', 'b')]):
+        program = Program([('EXEC', 'a'), ('SIZE', '8')] + operations + [('EXIT',)])
+        optimized, _ = optimize(program)
+        a = numpy.ones(8, dtype=bool)
+        state = run(optimized, a=a)
+        # STATE has a ciphertext of its own, as it would unoptimized
+        assert (state == a).all()
+        assert not numpy.shares_memory(state, a)
@@ -1,3 +1,5 @@
+import pytest
+
 from sputnik.parser import Parser
 
 
@@ -17,3 +19,24 @@ def test_parser_read_testfile():
 
     end = SputnikParser.operations[2]
     assert len(end) == 1
+
+
+def test_parser_compact_operations():
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    operations = SputnikParser.operations
+
+    assert operations[0] == ('EXEC', 'a', 'b')
+    assert operations[-1] == ('EXIT',)
+    assert list(operations)[1:3] == operations[1:3]
+
+    # Names are stored once and operations refer to them by id
+    assert operations.symbols.count('orResult') == 1
+    assert operations.args(1) == operations.args(3)
+    assert operations.line_numbers[0] == 1
+    assert operations.line_numbers[1] == 4
+
+
+def test_parser_error_line():
+    SputnikParser = Parser('tests/parser.sputnik')
+    with pytest.raises(SyntaxError, match='Line 4 `XOR PLAIN PAD 0 0`'):
+        SputnikParser.get_program().compile()
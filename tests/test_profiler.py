@@ -0,0 +1,60 @@
+import json
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik, constant_bits
+from sputnik.parser import Parser
+from sputnik.profiler import Profiler
+
+
+def test_profile_operations(tmp_path):
+    profiler = Profiler()
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                      profiler=profiler)
+    sputnik.execute_program(a=constant_bits(7, 8), b=constant_bits(17, 8))
+
+    summary = profiler.summary()
+    assert summary['XOR']['calls'] == 2
+    assert summary['PUSH']['calls'] == 3
+    assert summary['EXIT']['calls'] == 1
+    assert summary['PUSH']['bytes'] == 0
+    # Every traced gate copies its two inputs and result to the host
+    assert summary['AND']['bytes'] == 2 * 3 * 8
+    assert 'OPCODE' in profiler.format_summary()
+
+    trace_path = tmp_path / 'trace.json'
+    profiler.write_chrome_trace(str(trace_path))
+    with open(str(trace_path)) as f:
+        trace = json.load(f)
+    names = [event['name'] for event in trace['traceEvents']]
+    assert names.count('XOR') == 2
+    assert 'merkle' in names
+
+
+def test_profile_scheduled():
+    profiler = Profiler()
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                      schedule=True, profiler=profiler)
+    sputnik.execute_program(a=constant_bits(7, 8), b=constant_bits(17, 8))
+    assert set(profiler.summary()) == {'EXEC', 'SCHEDULE', 'EXIT'}
+
+
+def test_profile_transfers(tmp_path):
+    profiler = Profiler()
+    backend = NumpyBackend()
+    SputnikParser = Parser('tests/halt.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=backend, profiler=profiler,
+                      checkpoint=str(tmp_path / 'halt.ckpt'))
+    # Uploads before the program runs count towards the totals
+    a = backend.load(None, (constant_bits(7, 8),))
+    b = backend.load(None, (constant_bits(17, 8),))
+    assert profiler.bytes_to_device == 2 * 8
+    sputnik.execute_program(a=a, b=b)
+
+    # HALT dumps every variable to the checkpoint
+    summary = profiler.summary()
+    assert summary['HALT']['to_host'] > 0
+    assert summary['HALT']['to_device'] == 0
+    assert profiler.bytes_to_host == sum(total['to_host'] for total in summary.values())
+    assert 'bytes to device' in profiler.format_summary()
@@ -0,0 +1,40 @@
+from sputnik.parser import Parser
+from sputnik.scheduler import Schedule
+
+
+def test_schedule_levels():
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    proggy = SputnikParser.get_program()
+
+    schedule = Schedule(proggy.operations, proggy.find_entrance() + 1)
+    assert len(schedule.gates) == 5
+    assert schedule.depth == 3
+
+    # OR a b, AND a b and XOR a b only depend on the entrance variables
+    first_level = [schedule.gates[gate_id][1] for gate_id in schedule.levels[0]]
+    assert first_level == ['OR', 'AND', 'XOR']
+
+    # The block stops at EXIT and STATE is the last AND
+    assert proggy.operations[schedule.end] == ('EXIT',)
+    assert schedule.bindings['STATE'] == 4
+    assert schedule.bindings['xorResult'] == 2
+
+
+def test_schedule_state_chain():
+    SputnikParser = Parser('tests/abc.sputnik')
+    proggy = SputnikParser.get_program()
+
+    schedule = Schedule(proggy.operations, proggy.find_entrance() + 1)
+    assert schedule.depth == 3
+    assert len(schedule.levels[0]) == 2
+    assert schedule.bindings['d'] == 1
+    assert schedule.gates[3][2] == (2, 1)
+
+
+def test_schedule_aliases_only():
+    SputnikParser = Parser('tests/engine.sputnik')
+    proggy = SputnikParser.get_program()
+
+    schedule = Schedule(proggy.operations, proggy.find_entrance() + 1)
+    assert schedule.depth == 0
+    assert schedule.bindings == {'STATE': 'test', 'new_var': 'test'}
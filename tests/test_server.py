@@ -0,0 +1,225 @@
+import json
+import socket
+import threading
+
+import numpy
+import pytest
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.gatecache import GateCache
+from sputnik.keystore import save_key
+from sputnik.parser import Parser
+from sputnik.server import FRAME, Client, Server, encode_message
+
+
+def start_server(tmp_path, **kwargs):
+    server = Server(str(tmp_path / 'sputnik.sock'), backend=NumpyBackend(), **kwargs)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    assert server.wait_ready(timeout=10)
+    return server, thread
+
+
+@pytest.fixture
+def key_path(tmp_path):
+    path = str(tmp_path / 'test.key')
+    # The numpy backend ignores keys, but KEY needs one
+    save_key('test', path, NumpyBackend())
+    return path
+
+
+class CountingBackend(NumpyBackend):
+    def __init__(self):
+        self.warmed = list()
+
+    def warmup(self, key, shape):
+        super().warmup(key, shape)
+        self.warmed.append(shape)
+
+
+def expected_run(sputnik_filepath, **inputs):
+    sputnik = Sputnik(Parser(sputnik_filepath).get_program(), None, backend=NumpyBackend())
+    return sputnik.execute_program(**inputs)
+
+
+def test_server_batches(tmp_path):
+    server, thread = start_server(tmp_path, max_batch=4, batch_window=0.05)
+    rng = numpy.random.RandomState(0)
+    requests = [{'a': rng.randint(0, 2, size=8).astype(bool),
+                 'b': rng.randint(0, 2, size=8).astype(bool)} for _ in range(6)]
+    try:
+        with Client(server.path) as client:
+            job_ids = [client.submit('tests/xor-combo.sputnik',
+                                     {var_name: (value,) for var_name, value in request.items()})
+                       for request in requests]
+            results = [client.result(job_id) for job_id in reversed(job_ids)][::-1]
+            metrics = client.metrics()
+    finally:
+        server.stop()
+        thread.join()
+
+    for request, (state, root) in zip(requests, results):
+        expected, tree = expected_run('tests/xor-combo.sputnik', **request)
+        assert (state[0] == expected).all()
+        # Every job gets the root of its own execution, not its batch's
+        assert root == tree.get_merkle_root()
+    # Jobs sent together ran as batches of up to 4
+    assert metrics['completed'] == 6
+    assert metrics['batches'] == 2
+    assert metrics['mean_batch_size'] == 3.0
+    assert metrics['queue_depth'] == 0
+    assert metrics['latency']['p50'] > 0
+    assert len(server.engines) == 1
+
+
+def test_server_groups(tmp_path, key_path):
+    server, thread = start_server(tmp_path, batch_window=0.05, keys={'test': key_path})
+    a = numpy.array([True, False, True, True, False, False, True, False])
+    try:
+        with Client(server.path) as client:
+            const_job = client.submit('tests/const.sputnik', {'a': (a,)}, 'test')
+            combo_job = client.submit('tests/xor-combo.sputnik', {'a': (a,), 'b': (~a,)})
+            bad_job = client.submit('tests/const.sputnik', {'a': (a,)})
+            const_state, _ = client.result(const_job)
+            combo_state, _ = client.result(combo_job)
+            with pytest.raises(RuntimeError):
+                client.result(bad_job)
+            metrics = client.metrics()
+    finally:
+        server.stop()
+        thread.join()
+
+    expected, _ = expected_run('tests/const.sputnik', a=a, test_key='test')
+    assert (const_state[0] == expected).all()
+    expected, _ = expected_run('tests/xor-combo.sputnik', a=a, b=~a)
+    assert (combo_state[0] == expected).all()
+    assert metrics['completed'] == 2
+    assert metrics['failed'] == 1
+    assert metrics['batches'] == 3
+
+
+def test_server_backpressure(tmp_path):
+    server, thread = start_server(tmp_path, max_batch=2, max_queue=3, batch_window=0)
+    inputs = {'a': (numpy.ones(8, dtype=bool),), 'b': (numpy.zeros(8, dtype=bool),)}
+    try:
+        with Client(server.path) as client:
+            job_ids = [client.submit('tests/xor-combo.sputnik', inputs) for _ in range(20)]
+            for job_id in job_ids:
+                client.result(job_id)
+            metrics = client.metrics()
+    finally:
+        server.stop()
+        thread.join()
+
+    assert metrics['completed'] == 20
+    assert metrics['peak_queue_depth'] <= 3
+
+
+def test_server_gate_cache(tmp_path):
+    server, thread = start_server(tmp_path, batch_window=0, gate_cache=GateCache(1 << 20))
+    inputs = {'a': (numpy.ones(8, dtype=bool),), 'b': (numpy.zeros(8, dtype=bool),)}
+    try:
+        with Client(server.path) as client:
+            first, _ = client.result(client.submit('tests/xor-combo.sputnik', inputs))
+            second, _ = client.result(client.submit('tests/xor-combo.sputnik', inputs))
+            metrics = client.metrics()
+    finally:
+        server.stop()
+        thread.join()
+
+    assert (first[0] == second[0]).all()
+    # The second job repeats every gate of the first
+    assert metrics['gate_cache']['misses'] > 0
+    assert metrics['gate_cache']['hits'] == metrics['gate_cache']['misses']
+    assert metrics['gate_cache']['bytes'] > 0
+
+
+def test_server_bad_messages(tmp_path, key_path):
+    server, thread = start_server(tmp_path, max_queue=2, batch_window=0, keys={'test': key_path})
+    inputs = {'a': (numpy.ones(8, dtype=bool),), 'b': (numpy.zeros(8, dtype=bool),)}
+    try:
+        # A job without a program, and a message cut short
+        for message in (encode_message({'type': 'run', 'id': 0}),
+                        encode_message({'type': 'run', 'id': 0, 'program': 'x'}, inputs)[:-4]):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(server.path)
+                sock.sendall(message)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(server.path)
+            sock.sendall(FRAME.pack(2) + b'{]')
+            # Undecodable messages are answered before the connection closes
+            with sock.makefile('rb') as reply:
+                header_length, = FRAME.unpack(reply.read(FRAME.size))
+                header = json.loads(reply.read(header_length))
+                assert reply.read() == b''
+        assert header['status'] == 'error'
+        assert 'Malformed header' in header['error']
+
+        # A framed job with undecodable variables only fails that job, and
+        # the jobs pipelined after it still run
+        header = {'type': 'run', 'id': 1, 'program': 'tests/xor-combo.sputnik', 'payload': 0,
+                  'variables': {'a': [{'dtype': 'nonsense', 'shape': [8]}]}}
+        header_data = json.dumps(header).encode()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10)
+            sock.connect(server.path)
+            sock.sendall(FRAME.pack(len(header_data)) + header_data + encode_message(
+                {'type': 'run', 'id': 2, 'program': 'tests/xor-combo.sputnik'}, inputs))
+            with sock.makefile('rb') as reply:
+                headers = list()
+                for _ in range(2):
+                    header_length, = FRAME.unpack(reply.read(FRAME.size))
+                    headers.append(json.loads(reply.read(header_length)))
+                    reply.read(headers[-1]['payload'])
+        assert headers[0]['id'] == 1 and headers[0]['status'] == 'error'
+        assert 'Malformed variables' in headers[0]['error']
+        assert headers[1]['id'] == 2 and headers[1]['status'] == 'ok'
+
+        with Client(server.path) as client:
+            client.socket.settimeout(10)
+            with pytest.raises(RuntimeError, match='No key registered'):
+                client.run('tests/const.sputnik', inputs, str(key_path))
+            # Every queue slot is still free
+            job_ids = [client.submit('tests/xor-combo.sputnik', inputs) for _ in range(3)]
+            for job_id in job_ids:
+                client.result(job_id)
+            metrics = client.metrics()
+    finally:
+        server.stop()
+        thread.join()
+
+    assert metrics['completed'] == 4
+
+
+def test_server_groups_dtypes(tmp_path):
+    server, thread = start_server(tmp_path, max_batch=4, batch_window=0.05)
+    inputs = [{'a': (numpy.ones(8, dtype=dtype),), 'b': (numpy.zeros(8, dtype=dtype),)}
+              for dtype in (bool, numpy.uint8)]
+    try:
+        with Client(server.path) as client:
+            job_ids = [client.submit('tests/xor-combo.sputnik', job_inputs)
+                       for job_inputs in inputs]
+            for job_id in job_ids:
+                client.result(job_id)
+            metrics = client.metrics()
+    finally:
+        server.stop()
+        thread.join()
+
+    # Inputs of another dtype don't run batched with the others
+    assert metrics['batches'] == 2
+
+
+def test_server_warmup(tmp_path, key_path):
+    server = Server(str(tmp_path / 'sputnik.sock'), backend=CountingBackend(), max_batch=3,
+                    keys={'test': key_path}, warmup_sizes=[8])
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    try:
+        # Every batch size of every registered key is compiled before serving
+        assert server.wait_ready(timeout=10)
+        assert server.backend.warmed == [(8,), (2, 8), (3, 8)]
+    finally:
+        server.stop()
+        thread.join()
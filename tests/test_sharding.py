@@ -0,0 +1,44 @@
+import numpy
+import pytest
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.parser import Parser
+from sputnik.sharding import ShardPool, shard_ranges
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with ShardPool(None, workers=2, backend=NumpyBackend) as pool:
+        yield pool
+
+
+def test_shard_ranges():
+    assert shard_ranges(8, 2) == [(0, 4), (4, 8)]
+    assert shard_ranges(10, 3) == [(0, 4), (4, 7), (7, 10)]
+    assert shard_ranges(2, 4) == [(0, 1), (1, 2)]
+
+
+@pytest.mark.parametrize('sputnik_filepath', ['tests/abc.sputnik', 'tests/const.sputnik'])
+def test_engine_sharded(pool, sputnik_filepath):
+    rng = numpy.random.RandomState(0)
+    inputs = {var_name: rng.randint(0, 2, size=8).astype(bool) for var_name in 'abc'}
+
+    SputnikParser = Parser(sputnik_filepath)
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend())
+    expected, _ = sputnik.execute_program(test_key='test', **inputs)
+
+    for shards in (None, 3):
+        SputnikParser = Parser(sputnik_filepath)
+        sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend())
+        state, merkle = sputnik.execute_sharded(pool, shards=shards, test_key='test', **inputs)
+        assert (state == expected).all()
+        assert merkle.leaf_count == (shards or 2)
+        assert sputnik.program.is_killed
+
+
+def test_engine_sharded_halt(pool):
+    SputnikParser = Parser('tests/halt.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend())
+    with pytest.raises(ValueError):
+        sputnik.execute_sharded(pool, a=numpy.zeros(8, dtype=bool), b=numpy.ones(8, dtype=bool))
@@ -0,0 +1,166 @@
+import numpy
+import os
+import pytest
+from merkletools import MerkleTools
+
+from sputnik.backends import NumpyBackend
+from sputnik.engine import Sputnik
+from sputnik.merkle import TRACE_SAMPLED, MerkleTree, verify_proof
+from sputnik.opcodes import OP_CODE_IDS
+from sputnik.parser import Parser
+from sputnik.sharding import ShardPool
+from sputnik.tracelog import TraceLog, TraceLogWriter
+from sputnik.verifier import verify
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with ShardPool(None, workers=2, backend=NumpyBackend) as pool:
+        yield pool
+
+
+def record(tmp_path, sputnik_filepath, **kwargs):
+    log_path = str(tmp_path / 'trace.log')
+    rng = numpy.random.RandomState(0)
+    inputs = {var_name: rng.randint(0, 2, size=8).astype(bool) for var_name in 'abc'}
+    sputnik = Sputnik(Parser(sputnik_filepath).get_program(), None, backend=NumpyBackend(),
+                      trace_log=log_path, **kwargs)
+    _, merkle = sputnik.execute_program(test_key='test', **inputs)
+    return log_path, merkle.get_merkle_root()
+
+
+def test_merkle_tree_proofs():
+    digests = [bytes([idx]) * 32 for idx in range(11)]
+    tree = MerkleTree(digests)
+
+    merkle = MerkleTools(hash_type='SHA256')
+    merkle.add_leaf([digest.hex() for digest in digests])
+    merkle.make_tree()
+    assert tree.get_merkle_root() == merkle.get_merkle_root()
+
+    root = tree.get_merkle_root()
+    for index, digest in enumerate(digests):
+        assert verify_proof(digest, tree.get_proof(index), root)
+    assert not verify_proof(digests[0], tree.get_proof(1), root)
+
+
+def test_trace_log(tmp_path):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    log = TraceLog(log_path)
+    assert len(log) == 5
+    assert list(log.gate_indices) == [0, 1, 2, 3, 4]
+    op_code, gate_index, buffers = log.leaf(2)
+    assert (op_code, gate_index) == ('XOR', 2)
+    assert len(buffers) == 3
+    assert MerkleTree([log.digest(index) for index in range(5)]).get_merkle_root() == root
+
+
+def test_trace_log_file(tmp_path):
+    log_path = str(tmp_path / 'trace.log')
+    writer = TraceLogWriter(log_path)
+    # The log only appears at its path once it's complete
+    assert not os.path.exists(log_path)
+    writer.close()
+    assert len(TraceLog(log_path)) == 0
+
+    # Other Sputnik container files aren't taken for leaf logs
+    checkpoint = str(tmp_path / 'combo.ckpt')
+    record(tmp_path, 'tests/xor-combo.sputnik', checkpoint=checkpoint, checkpoint_every=1)
+    with pytest.raises(ValueError, match='not a Sputnik leaf log'):
+        TraceLog(checkpoint)
+
+
+def test_verify(tmp_path, pool):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    program = Parser('tests/xor-combo.sputnik').get_program()
+    report = verify(program, log_path, root, pool, sample=1.0, seed=0)
+    assert report.ok
+    assert report.leaf_count == 5
+    assert report.gates_checked == 5
+    assert report.proofs_checked == 5
+
+    # Some other root
+    report = verify(program, log_path, '00' * 32, pool, sample=1.0)
+    assert not report.root_matches
+    assert len(report.invalid_proofs) == 5
+
+    # Another program
+    report = verify(Parser('tests/abc.sputnik').get_program(), log_path, root, pool)
+    assert report.unexpected_leaves
+
+
+def test_verify_checkpointed(tmp_path, pool):
+    # Checkpoints wait for the logged leaves without finishing the log
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik',
+                            checkpoint=str(tmp_path / 'combo.ckpt'), checkpoint_every=1)
+    program = Parser('tests/xor-combo.sputnik').get_program()
+    report = verify(program, log_path, root, pool, sample=1.0)
+    assert report.ok
+    assert report.leaf_count == 5
+
+
+def test_verify_sampled_trace(tmp_path, pool):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik',
+                            trace=TRACE_SAMPLED, trace_every=2)
+    program = Parser('tests/xor-combo.sputnik').get_program()
+    report = verify(program, log_path, root, pool, sample=0.5, seed=1)
+    assert report.ok
+    assert report.leaf_count == 3
+    assert report.gates_checked == 2
+
+
+def test_verify_recorded_again(tmp_path, pool):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    program = Parser('tests/xor-combo.sputnik').get_program()
+    assert verify(program, log_path, root, pool, sample=1.0).ok
+
+    # The workers don't keep using the log they opened before
+    log_path, root = record(tmp_path, 'tests/abc.sputnik')
+    program = Parser('tests/abc.sputnik').get_program()
+    report = verify(program, log_path, root, pool, sample=1.0)
+    assert report.ok
+    assert report.leaf_count == len(TraceLog(log_path))
+
+
+def test_verify_not_a_gate(tmp_path, pool):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    log = TraceLog(log_path)
+    offset = log.op_ids.__array_interface__['data'][0] - \
+        numpy.frombuffer(log.data, dtype=numpy.uint8).__array_interface__['data'][0]
+    del log
+    # Make the third leaf an EXEC, which has no ciphertexts to read
+    with open(log_path, 'r+b') as f:
+        f.seek(offset + 2)
+        f.write(bytes([OP_CODE_IDS['EXEC']]))
+    with pytest.raises(ValueError, match="isn't a gate"):
+        TraceLog(log_path).leaf(2)
+
+    program = Parser('tests/xor-combo.sputnik').get_program()
+    report = verify(program, log_path, root, pool, sample=1.0)
+    assert report.unexpected_leaves == [2]
+    assert report.invalid_gates == [2]
+    assert not report.root_matches
+
+
+def test_verify_tampered(tmp_path, pool):
+    log_path, root = record(tmp_path, 'tests/xor-combo.sputnik')
+    log = TraceLog(log_path)
+    # Flip a bit of the result of the third gate, and recompute the root
+    # as a dishonest executor would
+    _, _, buffers = log.leaf(2)
+    offset = buffers[-1][0].__array_interface__['data'][0] - \
+        numpy.frombuffer(log.data, dtype=numpy.uint8).__array_interface__['data'][0]
+    del buffers, log
+    with open(log_path, 'r+b') as f:
+        f.seek(offset)
+        value = f.read(1)
+        f.seek(offset)
+        f.write(bytes([value[0] ^ 1]))
+    log = TraceLog(log_path)
+    root = MerkleTree([log.digest(index) for index in range(len(log))]).get_merkle_root()
+
+    program = Parser('tests/xor-combo.sputnik').get_program()
+    report = verify(program, log_path, root, pool, sample=1.0)
+    assert report.root_matches
+    assert report.invalid_gates == [2]
+    assert not report.ok
@@ -0,0 +1,72 @@
+import io
+
+import numpy
+import pytest
+
+from sputnik.backends import NumpyBackend
+from sputnik.checkpoint import MAGIC, Checkpoint
+from sputnik.engine import Sputnik, constant_bits
+from sputnik.parser import Parser
+from sputnik import wire
+from sputnik.wire import load_ciphertext, open_ciphertext, read_ciphertext, save_ciphertext
+
+
+def test_ciphertext_round_trip(tmp_path):
+    backend = NumpyBackend()
+    ciphertext = numpy.random.RandomState(0).randint(0, 2, size=(3, 40)).astype(bool)
+    path = str(tmp_path / 'x.ctx')
+    save_ciphertext(path, backend, None, ciphertext)
+
+    loaded = open_ciphertext(path, backend, None)
+    assert loaded.shape == (3, 40)
+    assert (loaded == ciphertext).all()
+    # The buffers are the file's pages, not a copy
+    assert not loaded.flags.owndata
+
+
+def test_ciphertext_stream(monkeypatch):
+    backend = NumpyBackend()
+    monkeypatch.setattr(wire, 'CHUNK_SIZE', 7)
+    ciphertexts = [constant_bits(value, 100) for value in (3, 1000, 2**90)]
+    f = io.BytesIO()
+    for ciphertext in ciphertexts:
+        f.write(b'\0' * (-f.tell() % wire.ALIGNMENT))
+        buffers = wire.write_ciphertext(f, backend, None, ciphertext)
+        assert buffers[0]['offset'] % wire.ALIGNMENT == 0
+
+    # Ciphertexts are read back to back from a memoryview
+    data = memoryview(f.getvalue())
+    offset = 0
+    for ciphertext in ciphertexts:
+        offset += -offset % wire.ALIGNMENT
+        header, arrays, offset = read_ciphertext(data, offset)
+        assert header['shape'] == [100]
+        assert header['backend'] == 'NumpyBackend'
+        assert (load_ciphertext(backend, None, header, arrays) == ciphertext).all()
+    assert offset == len(data)
+
+
+def test_ciphertext_invalid(tmp_path):
+    backend = NumpyBackend()
+    f = io.BytesIO()
+    wire.write_arrays(f, [numpy.zeros(8, dtype=bool)], (8,), params={'size': 500})
+    header, arrays, _ = read_ciphertext(f.getvalue())
+    with pytest.raises(ValueError):
+        load_ciphertext(backend, None, header, arrays)
+    with pytest.raises(ValueError):
+        read_ciphertext(b'\0' * 64)
+
+
+def test_checkpoint_ciphertexts(tmp_path):
+    checkpoint = str(tmp_path / 'combo.ckpt')
+    SputnikParser = Parser('tests/xor-combo.sputnik')
+    sputnik = Sputnik(SputnikParser.get_program(), None, backend=NumpyBackend(),
+                      checkpoint=checkpoint, checkpoint_every=4)
+    sputnik.execute_program(a=constant_bits(7, 8), b=constant_bits(17, 8))
+
+    # Every checkpointed variable is a ciphertext in the wire format
+    data = Checkpoint(checkpoint).data
+    offset = len(MAGIC) + 2
+    offset += -offset % wire.ALIGNMENT
+    header, arrays, _ = read_ciphertext(data, offset)
+    assert (arrays[0] == constant_bits(7, 8)).all()